@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Clinic, Patient, Doctor, Secretary, MedicalRecord, Appointment, Expense, Income, WaitingListEntry, WhatsAppConversation, FAQEntry, PatientFile, ConsultationRecord
+from .models import Clinic, Patient, Doctor, Secretary, MedicalRecord, Appointment, Expense, Income, WaitingListEntry, WhatsAppConversation, FAQEntry, PatientFile, ConsultationRecord, BackgroundJob, DoctorMonthlyStats, PatientVisitSummary
+from .rollup_service import schedule_refresh_for_appointments
+from .visit_summary_service import schedule_summary_refresh_for_appointments
 
 
 @admin.register(Clinic)
@@ -286,6 +288,8 @@ class AppointmentAdmin(admin.ModelAdmin):
     actions = ['mark_as_completed', 'mark_as_cancelled', 'send_reminders']
 
     def mark_as_completed(self, request, queryset):
+        schedule_refresh_for_appointments(queryset)
+        schedule_summary_refresh_for_appointments(queryset)
         updated = queryset.update(status='completed')
         self.message_user(request, f'{updated} appointments marked as completed.')
     mark_as_completed.short_description = "Mark selected appointments as completed"
@@ -296,6 +300,8 @@ class AppointmentAdmin(admin.ModelAdmin):
             associated_incomes = appointment.incomes.all()
             income_deleted_count += associated_incomes.count()
             associated_incomes.delete()
+        schedule_refresh_for_appointments(queryset)
+        schedule_summary_refresh_for_appointments(queryset)
         updated = queryset.update(status='cancelled')
         message = f'{updated} appointments marked as cancelled'
         if income_deleted_count > 0:
@@ -662,3 +668,28 @@ class WhatsAppConversationAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'total', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = ['created_at', 'updated_at', 'finished_at', 'params', 'result']
+    ordering = ['-created_at']
+
+
+@admin.register(DoctorMonthlyStats)
+class DoctorMonthlyStatsAdmin(admin.ModelAdmin):
+    list_display = ['doctor', 'month', 'total_appointments', 'completed_count', 'no_show_count', 'cancelled_count', 'revenue', 'updated_at']
+    list_filter = ['doctor', 'month']
+    readonly_fields = ['updated_at']
+    ordering = ['-month', 'doctor']
+
+
+@admin.register(PatientVisitSummary)
+class PatientVisitSummaryAdmin(admin.ModelAdmin):
+    list_display = ['patient', 'doctor', 'first_visit', 'last_completed_visit', 'completed_count', 'no_show_count', 'updated_at']
+    list_filter = ['doctor']
+    search_fields = ['patient__first_name', 'patient__last_name']
+    readonly_fields = ['updated_at']
+    raw_id_fields = ['patient']
@@ -0,0 +1,194 @@
+"""
+Live agenda events.
+
+Appointment and calendar-block changes are published to a per-doctor channel
+("agenda:<doctor_id>") and pushed to open dashboards over server-sent events
+(see views.api_agenda_stream). The broker is pluggable through the
+AGENDA_EVENT_BROKER setting; the default InProcessBroker only reaches clients
+connected to the same worker process, so multi-process deployments use
+RedisBroker (Redis pub/sub at settings.REDIS_URL).
+
+An open stream holds its worker for up to STREAM_MAX_SECONDS, so streaming
+is only enabled (AGENDA_LIVE_UPDATES = 'stream') behind an async or threaded
+worker class. Otherwise the stream endpoint answers 204, which tells
+EventSource not to reconnect, and the dashboard polls
+views.api_agenda_changes instead.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+# Clients reconnect automatically (EventSource); bounding the stream frees the worker
+STREAM_MAX_SECONDS = 300
+
+
+def agenda_channel(doctor_id):
+    return f'agenda:{doctor_id}'
+
+
+class Subscription:
+    """Queue of events for one connected client."""
+
+    def __init__(self, broker, channels, maxsize=100):
+        self.broker = broker
+        self.channels = list(channels)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Thread-safe fan-out of events to the subscriptions of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop the event, it will resync on the next one
+                pass
+
+
+class RedisSubscription:
+    """Redis pub/sub connection of one connected client."""
+
+    def __init__(self, pubsub, channels):
+        self.pubsub = pubsub
+        self.channels = list(channels)
+        self.pubsub.subscribe(*self.channels)
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Subscribe confirmations are skipped and come back as None early
+            message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                return json.loads(message['data'])
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    """Fan-out through Redis pub/sub, reaching the clients of every worker process."""
+
+    def __init__(self):
+        import redis
+
+        if not getattr(settings, 'REDIS_URL', ''):
+            raise ImproperlyConfigured('RedisBroker requires the REDIS_URL setting')
+        self._client = redis.Redis.from_url(settings.REDIS_URL)
+
+    def subscribe(self, channels):
+        return RedisSubscription(self._client.pubsub(), channels)
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+
+    def publish(self, channel, event):
+        from redis.exceptions import RedisError
+
+        try:
+            self._client.publish(channel, json.dumps(event))
+        except RedisError:
+            # Runs after the write committed; open agendas still catch up on their next refresh
+            logger.exception("Could not publish agenda event on %s", channel)
+
+
+def live_updates_streaming():
+    """True when open agendas are updated over server-sent events rather than by polling."""
+    return getattr(settings, 'AGENDA_LIVE_UPDATES', 'poll') == 'stream'
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_path = getattr(settings, 'AGENDA_EVENT_BROKER', 'dashboard.agenda_events.InProcessBroker')
+                _broker = import_string(broker_path)()
+    return _broker
+
+
+def publish_agenda_event(doctor_id, event_type, **payload):
+    """
+    Publish an event to the doctor's agenda channel once the current
+    transaction commits (immediately when not in a transaction).
+    Payloads carry ids and statuses only, never patient data.
+    """
+    event = {'type': event_type, 'doctor_id': doctor_id, **payload}
+    transaction.on_commit(lambda: get_broker().publish(agenda_channel(doctor_id), event))
+
+
+def appointment_event_type(appointment, created):
+    if created:
+        return 'appointment.created'
+    if appointment.status in ('cancelled', 'no_show'):
+        return 'appointment.cancelled'
+    if appointment.status == 'completed':
+        return 'appointment.completed'
+    return 'appointment.updated'
+
+
+def sse_stream(subscription, max_seconds=STREAM_MAX_SECONDS):
+    """Server-sent-events body for a subscription, with keepalive comments."""
+    # The stream never touches the database; release the request's connection
+    connection.close()
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=HEARTBEAT_SECONDS)
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield f'data: {json.dumps(event)}\n\n'
+    finally:
+        subscription.close()
@@ -0,0 +1,219 @@
+"""
+Agenda read-path services shared by the dashboard views.
+
+The agenda stats widget and the calendar feed are polled on every agenda
+load, so the helpers here keep the number of database round trips fixed no
+matter how many appointments are shown. QueryCounter reports that number
+back to the caller.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection
+from django.db.models import Count, Exists, Max, OuterRef, Q
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+
+from .models import Appointment, CalendarBlock
+
+
+PENDING_STATUSES = ('scheduled', 'confirmed')
+
+
+class QueryCounter:
+    """
+    Context manager that counts the SQL statements executed on the default
+    connection while it is active (works with DEBUG=False).
+
+        with QueryCounter() as counter:
+            ...
+        counter.count
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._wrapper.__exit__(exc_type, exc_value, traceback)
+
+
+def get_doctor_scope(current_doctor, accessible_doctors):
+    """
+    Q filter selecting the appointments shown on the agenda: the selected
+    doctor when the user can access them, otherwise every accessible doctor.
+    """
+    if current_doctor and current_doctor in accessible_doctors:
+        return Q(doctor=current_doctor)
+    return Q(doctor__in=accessible_doctors)
+
+
+def format_next_appointment(appointment_date, appointment_time, today):
+    """Human readable label for the next appointment ("Hoje às 14:00")."""
+    if appointment_date is None:
+        return 'sem consultas próximas'
+    time_label = appointment_time.strftime('%H:%M')
+    if appointment_date == today:
+        return f"Hoje às {time_label}"
+    if appointment_date == today + timedelta(days=1):
+        return f"Amanhã às {time_label}"
+    return f"{appointment_date.strftime('%d/%m')} às {time_label}"
+
+
+def get_agenda_stats(doctor_scope, now=None):
+    """
+    Compute the agenda widget stats for the given doctor scope.
+
+    Runs exactly two queries: one conditional aggregation for today's
+    totals and one ordered lookup for the next pending appointment.
+    Returns (stats, query_count).
+    """
+    now = timezone.localtime(now or timezone.now())
+    today = now.date()
+
+    with QueryCounter() as counter:
+        totals = Appointment.objects.filter(
+            doctor_scope, appointment_date=today
+        ).aggregate(
+            total=Count('id', filter=~Q(status='cancelled')),
+            completed=Count('id', filter=Q(status='completed')),
+            pending=Count('id', filter=Q(status__in=PENDING_STATUSES)),
+        )
+
+        # Later today, or any day from tomorrow on, in a single lookup
+        next_appointment = Appointment.objects.filter(
+            doctor_scope,
+            Q(appointment_date=today, appointment_time__gt=now.time())
+            | Q(appointment_date__gt=today),
+            status__in=PENDING_STATUSES,
+        ).order_by('appointment_date', 'appointment_time').values_list(
+            'appointment_date', 'appointment_time'
+        ).first()
+
+    next_date, next_time = next_appointment or (None, None)
+    stats = {
+        'consultas_hoje': totals['total'],
+        'pacientes_atendidos': totals['completed'],
+        'consultas_pendentes': totals['pending'],
+        'proxima_consulta': format_next_appointment(next_date, next_time, today),
+    }
+    return stats, counter.count
+
+
+def annotate_first_appointment(queryset):
+    """
+    Annotate each appointment with is_first_appointment: True when the patient
+    has no earlier non-cancelled appointment with the same doctor.
+
+    The check is a correlated EXISTS evaluated by the database inside the
+    calendar query itself, so it costs no extra round trips per event.
+    """
+    earlier = Appointment.objects.filter(
+        patient=OuterRef('patient'),
+        doctor=OuterRef('doctor'),
+    ).exclude(status='cancelled').filter(
+        Q(appointment_date__lt=OuterRef('appointment_date')) |
+        Q(appointment_date=OuterRef('appointment_date'), appointment_time__lt=OuterRef('appointment_time'))
+    )
+    return queryset.annotate(is_first_appointment=~Exists(earlier))
+
+
+# ─── Incremental calendar feed ───────────────────────────────────────────────
+
+def _to_micros(value):
+    """Datetime -> integer microseconds since the epoch (0 for None)."""
+    if value is None:
+        return 0
+    return int(value.timestamp() * 1_000_000)
+
+
+def _from_micros(value):
+    return datetime.fromtimestamp(value / 1_000_000, tz=dt_timezone.utc)
+
+
+def get_calendar_feed_state(scope_tag, appointment_scope, block_scope, start_date, end_date):
+    """
+    Cheap fingerprint of the calendar feed for a doctor scope and date range.
+
+    The latest change timestamps of the scope's appointments and blocks (an
+    index seek on (doctor, updated_at) each) plus the row counts in the
+    range, counted over the range only; counts catch hard deletes (blocks
+    are deleted, not cancelled). Returns a dict with:
+      - cursor: opaque token the client sends back as ?since= for deltas
+      - etag:   quoted ETag for conditional GETs of this exact range
+    """
+    range_start, range_end = day_range_bounds(start_date, end_date)
+
+    appointments = Appointment.objects.filter(appointment_scope)
+    blocks = CalendarBlock.objects.filter(block_scope)
+    appointment_state = {
+        'last_change': appointments.aggregate(last_change=Max('updated_at'))['last_change'],
+        'in_range': appointments.filter(
+            appointment_date__range=[start_date, end_date]
+        ).exclude(status='cancelled').count(),
+    }
+    block_state = {
+        'last_change': blocks.aggregate(last_change=Max('updated_at'))['last_change'],
+        'in_range': blocks.filter(start__lt=range_end, end__gt=range_start).count(),
+    }
+
+    cursor = '.'.join([
+        scope_tag,
+        str(_to_micros(appointment_state['last_change'])),
+        str(_to_micros(block_state['last_change'])),
+    ])
+    fingerprint = '|'.join([
+        cursor,
+        start_date.isoformat(),
+        end_date.isoformat(),
+        str(appointment_state['in_range']),
+        str(block_state['in_range']),
+    ])
+    return {
+        'cursor': cursor,
+        'etag': quote_etag(hashlib.md5(fingerprint.encode()).hexdigest()),
+    }
+
+
+def parse_feed_cursor(cursor, scope_tag):
+    """
+    Decode a cursor produced by get_calendar_feed_state.
+
+    Returns (appointments_since, blocks_since) as aware datetimes, or None when
+    the cursor is malformed or belongs to another doctor scope (the client
+    must then reload the full range).
+    """
+    try:
+        tag, appointment_micros, block_micros = cursor.split('.')
+        if tag != scope_tag:
+            return None
+        return _from_micros(int(appointment_micros)), _from_micros(int(block_micros))
+    except (AttributeError, ValueError):
+        return None
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match header covers the given ETag."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags or etag in [e.removeprefix('W/') for e in etags]
+
+
+def day_range_bounds(start_date, end_date):
+    """Aware datetimes covering start_date 00:00:00 to end_date 23:59:59."""
+    current_tz = timezone.get_current_timezone()
+    range_start = timezone.make_aware(datetime.combine(start_date, datetime.min.time()), current_tz)
+    range_end = timezone.make_aware(
+        datetime.combine(end_date, datetime.max.time().replace(microsecond=0)), current_tz
+    )
+    return range_start, range_end
@@ -0,0 +1,438 @@
+"""
+In-memory analytics engine for the indicators endpoint.
+
+AppointmentFacts reads the (patient, doctor, date, status, payment type,
+duration) rows of a set of doctors once, sorted by date, into parallel
+compact arrays. Every period, monthly series and cohort is then a date
+slice found with bisect and counted in a single pass, so the number of
+queries no longer grows with the number of months or cohorts shown.
+Per-patient first visit and last completed visit come from the
+PatientVisitSummary side table (load_visit_history), cohort retention from
+per-patient bitsets of active months (CohortActivity), and closed months of
+the monthly series from the DoctorMonthlyStats rollup, so the row scan
+stays limited to the dates the indicators actually look at. Occupancy and
+vacancy are shares of the doctors' slot capacity (capacity_service).
+"""
+import bisect
+from array import array
+from collections import Counter
+from datetime import date, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+
+from .capacity_service import EMPTY_DAY, load_capacity, sum_capacity
+from .models import Appointment
+from .rollup_service import load_monthly_stats, period_figures_by_doctor
+from .visit_summary_service import first_and_active_by_doctor, load_visit_history
+
+
+STATUS_CODES = {status: code for code, (status, _label) in enumerate(Appointment.STATUS_CHOICES)}
+PAYMENT_CODES = {payment: code for code, (payment, _label) in enumerate(Appointment.PAYMENT_TYPE_CHOICES)}
+COMPLETED = STATUS_CODES['completed']
+NO_SHOW = STATUS_CODES['no_show']
+CANCELLED = STATUS_CODES['cancelled']
+PARTICULAR = PAYMENT_CODES['particular']
+CONVENIO = PAYMENT_CODES['convenio']
+
+MONTHLY_SERIES_MONTHS = 5
+RETENTION_COHORTS = 6
+RETENTION_FOLLOW_UP_MONTHS = 3
+# Largest cohort matrix the indicators endpoint accepts
+RETENTION_MAX_COHORTS = 36
+RETENTION_MAX_FOLLOW_UP_MONTHS = 24
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def month_index(day):
+    """Months since year 0 (consecutive months have consecutive indexes)."""
+    return day.year * 12 + day.month - 1
+
+
+def add_months(first_of_month, months):
+    """Shift a first-of-month date by a number of months (negative for earlier)."""
+    index = first_of_month.year * 12 + first_of_month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_end(first_of_month):
+    return add_months(first_of_month, 1) - timedelta(days=1)
+
+
+def _merge_date_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class WindowSummary:
+    """Counts for the appointments of one date window."""
+
+    def __init__(self, statuses, payments, patient_ids, durations):
+        status_counts = Counter(statuses)
+        payment_counts = Counter(payments)
+        visits = Counter(patient_ids)
+        self.total = len(statuses)
+        self.completed = status_counts[COMPLETED]
+        self.no_show = status_counts[NO_SHOW]
+        self.cancelled = status_counts[CANCELLED]
+        self.particular = payment_counts[PARTICULAR]
+        self.convenio = payment_counts[CONVENIO]
+        self.unique_patients = len(visits)
+        self.returning_patients = sum(1 for count in visits.values() if count > 1)
+        completed_durations = [
+            duration for duration, status in zip(durations, statuses) if status == COMPLETED
+        ]
+        self.avg_completed_duration = (
+            sum(completed_durations) / len(completed_durations) if completed_durations else None
+        )
+
+    @classmethod
+    def from_rollup(cls, figures):
+        """Summary of a closed month read from DoctorMonthlyStats figures."""
+        summary = cls((), (), (), ())
+        summary.total = figures['total_appointments']
+        summary.completed = figures['completed_count']
+        summary.no_show = figures['no_show_count']
+        summary.cancelled = figures['cancelled_count']
+        summary.particular = figures['particular_count']
+        summary.convenio = figures['convenio_count']
+        summary.unique_patients = figures['unique_patients']
+        summary.returning_patients = figures['returning_patients']
+        if figures['completed_count']:
+            summary.avg_completed_duration = figures['completed_duration_minutes'] / figures['completed_count']
+        return summary
+
+    def percent(self, count):
+        return (count / self.total * 100) if self.total else 0
+
+
+class AppointmentFacts:
+    """
+    Appointment rows of a set of doctors within the given date ranges,
+    loaded with one query and stored column-wise, sorted by date.
+    """
+
+    def __init__(self, doctors, date_ranges):
+        self.days = array('l')
+        self.patient_ids = array('q')
+        self.doctor_ids = array('q')
+        self.statuses = array('b')
+        self.payments = array('b')
+        self.durations = array('l')
+        ranges = _merge_date_ranges(date_ranges)
+        if not ranges:
+            return
+        window = reduce(or_, (Q(appointment_date__range=[start, end]) for start, end in ranges))
+        rows = Appointment.objects.filter(window, doctor__in=doctors).order_by('appointment_date').values_list(
+            'patient_id', 'doctor_id', 'appointment_date', 'status', 'payment_type', 'duration_minutes'
+        )
+        for patient_id, doctor_id, day, status, payment_type, duration in rows.iterator(chunk_size=5000):
+            self.days.append(day.toordinal())
+            self.patient_ids.append(patient_id)
+            self.doctor_ids.append(doctor_id)
+            self.statuses.append(STATUS_CODES.get(status, -1))
+            self.payments.append(PAYMENT_CODES.get(payment_type, -1))
+            self.durations.append(duration)
+
+    def window(self, start_date, end_date):
+        """(lo, hi) slice bounds of the rows dated within [start_date, end_date]."""
+        lo = bisect.bisect_left(self.days, start_date.toordinal())
+        hi = bisect.bisect_right(self.days, end_date.toordinal())
+        return lo, hi
+
+    def summary(self, start_date, end_date):
+        lo, hi = self.window(start_date, end_date)
+        return WindowSummary(self.statuses[lo:hi], self.payments[lo:hi], self.patient_ids[lo:hi], self.durations[lo:hi])
+
+
+class CohortActivity:
+    """
+    Months in which each patient had a completed appointment with the
+    doctors, from since_month through until_month: one int bitset per patient
+    with bit i set for the i-th month after since_month. Built from one pass
+    over the completed appointments, grouped to one row per patient-month.
+    """
+
+    def __init__(self, doctors, since_month, until_month):
+        self.base = month_index(since_month)
+        self.active = {}
+        rows = Appointment.objects.filter(
+            doctor__in=doctors,
+            status='completed',
+            appointment_date__range=[since_month, month_end(until_month)],
+        ).annotate(month=TruncMonth('appointment_date')).order_by().values_list('patient_id', 'month').distinct()
+        for patient_id, month in rows.iterator(chunk_size=5000):
+            self.active[patient_id] = self.active.get(patient_id, 0) | (1 << (month_index(month) - self.base))
+
+
+def retention_matrix(history, activity, first_cohort, cohorts, follow_up_months):
+    """
+    Retention of `cohorts` monthly cohorts of new patients starting at
+    first_cohort (a patient's cohort is the month of their first visit):
+    for each cohort, the % with a completed visit 1..follow_up_months months
+    later, month 0 being 100%. activity must start at first_cohort and cover
+    the last follow-up month.
+    """
+    first_index = month_index(first_cohort)
+    members = {}
+    for patient_id, (first_visit, _last) in history.items():
+        if first_visit:
+            offset = month_index(first_visit) - first_index
+            if 0 <= offset < cohorts:
+                members.setdefault(offset, []).append(activity.active.get(patient_id, 0))
+
+    matrix = []
+    for offset in range(cohorts):
+        bitsets = members.get(offset)
+        if bitsets:
+            shift = first_index + offset - activity.base
+            returns = [100]  # Month 0 is always 100%
+            for m_offset in range(1, follow_up_months + 1):
+                returned = sum((bits >> (shift + m_offset)) & 1 for bits in bitsets)
+                returns.append(round((returned / len(bitsets) * 100), 1))
+        else:
+            returns = [0] * (follow_up_months + 1)
+        matrix.append({
+            'cohort': add_months(first_cohort, offset).strftime('%b-%y'),
+            'returns': returns
+        })
+    return matrix
+
+
+def _count_first_visits(history, start_date, end_date):
+    return sum(1 for first_visit, _last in history.values() if first_visit and start_date <= first_visit <= end_date)
+
+
+def compute_indicators(doctors, start_date, end_date, today, churn_months=12, risk_months=6,
+                       retention_cohorts=RETENTION_COHORTS, retention_months=RETENTION_FOLLOW_UP_MONTHS,
+                       settings=None):
+    """
+    Every metric and series of the indicators endpoint for the doctors and
+    the [start_date, end_date] period, from four queries (plus two for slot
+    capacity not cached yet). The retention curve covers retention_cohorts
+    monthly cohorts up to today's, each followed for retention_months
+    months. settings (AppointmentSettings) gives the working hours.
+    Returns the 'metrics' dict of the endpoint (minus total_patients).
+    """
+    series_start = add_months(month_start(end_date), -(MONTHLY_SERIES_MONTHS - 1))
+    prev_start = add_months(month_start(start_date), -1)
+    prev_end = month_start(start_date) - timedelta(days=1)
+    cohort_start = add_months(month_start(today), -(retention_cohorts - 1))
+
+    # Closed months are read from the monthly rollup. Its distinct-patient
+    # figures are per doctor, so the previous month (which needs them) only
+    # comes from the rollup when a single doctor is selected.
+    open_month = month_start(today)
+    series_months = [add_months(series_start, offset) for offset in range(MONTHLY_SERIES_MONTHS)]
+    rollup_months = [month for month in series_months if month < open_month]
+    prev_from_rollup = len(doctors) == 1 and prev_start < open_month
+    if prev_from_rollup:
+        rollup_months.append(prev_start)
+    doctor_ids = [getattr(doctor, 'id', doctor) for doctor in doctors]
+    rollups = load_monthly_stats(doctor_ids, rollup_months)
+    capacity = load_capacity(
+        doctor_ids, min(prev_start, series_start), max(end_date, month_end(series_months[-1])), settings=settings
+    )
+
+    live_ranges = [(start_date, end_date)]
+    live_ranges += [(month, month_end(month)) for month in series_months if month not in rollups]
+    if not prev_from_rollup:
+        live_ranges.append((prev_start, prev_end))
+    facts = AppointmentFacts(doctors, live_ranges)
+    history = load_visit_history(doctors)
+    activity = CohortActivity(doctors, cohort_start, add_months(month_start(today), retention_months))
+
+    def month_summary(first):
+        if first in rollups:
+            return WindowSummary.from_rollup(rollups[first])
+        return facts.summary(first, month_end(first))
+
+    # Selected period
+    period = facts.summary(start_date, end_date)
+    total_appointments = period.total
+    show_rate = round(period.percent(period.completed), 1)
+    no_show_rate = round(period.percent(period.no_show), 1)
+    cancelled_rate = round(period.percent(period.cancelled), 1)
+    # Occupancy and "vago" (empty slots) are shares of the working minutes left after blocks
+    period_capacity = sum_capacity(capacity, start_date, end_date)
+    occupation_rate = round(period_capacity.percent(period_capacity.booked), 1)
+    vago_rate = round(period_capacity.percent(period_capacity.vacant), 1)
+
+    total_payment_appointments = period.particular + period.convenio
+    private_pct = round((period.particular / total_payment_appointments * 100) if total_payment_appointments > 0 else 0, 1)
+    insurance_pct = round((period.convenio / total_payment_appointments * 100) if total_payment_appointments > 0 else 0, 1)
+
+    total_unique_patients = period.unique_patients
+    retention_rate = round((period.returning_patients / total_unique_patients * 100) if total_unique_patients > 0 else 0, 1)
+    total_retornos = max(0, total_appointments - total_unique_patients)
+
+    days_in_period = (end_date - start_date).days + 1
+    avg_consultations_per_day = round(total_appointments / days_in_period, 1) if days_in_period > 0 else 0
+    avg_duration_minutes = int(period.avg_completed_duration or 0)
+
+    # New patients: first appointment ever with these doctors falls in the period
+    new_patients_count = _count_first_visits(history, start_date, end_date)
+    avg_consultations_per_patient = round(
+        total_appointments / total_unique_patients, 1
+    ) if total_unique_patients > 0 else 0
+
+    # Monthly series for charts (5 months ending with selected month)
+    monthly_agenda = []
+    monthly_patients = []
+    for first in series_months:
+        month = month_summary(first)
+        slots = sum_capacity(capacity, first, month_end(first))
+        monthly_agenda.append({
+            'month': first.strftime('%b-%y'),
+            'ocupacao': round(slots.percent(slots.booked), 1),
+            'vago': round(slots.percent(slots.vacant), 1),
+            'no_show': round(slots.percent(slots.no_show), 1),
+            'cancelamento': round(slots.percent(slots.cancelled), 1),
+        })
+        monthly_patients.append({
+            'month': first.strftime('%b-%y'),
+            'particular': month.particular,
+            'convenio': month.convenio,
+        })
+
+    # Previous month for trends (comparison vs month before selected period).
+    # Its distinct-patient figures cannot be summed over several doctors'
+    # rollups, so it is only read from the rollup for a single doctor.
+    prev = month_summary(prev_start) if prev_from_rollup else facts.summary(prev_start, prev_end)
+    prev_capacity = sum_capacity(capacity, prev_start, prev_end)
+    prev_occupation_rate = round(prev_capacity.percent(prev_capacity.booked), 1)
+    prev_no_show_rate = round(prev.percent(prev.no_show), 1)
+    prev_cancelled_rate = round(prev.percent(prev.cancelled), 1)
+    prev_new = _count_first_visits(history, prev_start, prev_end) if prev.total else 0
+    prev_retention = round(prev.returning_patients / prev.unique_patients * 100, 1) if prev.unique_patients else 0
+    prev_avg_per_patient = round(prev.total / prev.unique_patients, 2) if prev.unique_patients else 0
+
+    def pct_pt(a, b):
+        return round(a - b, 1)
+
+    # Loyalty: active in the last 12 months, at risk between risk and churn thresholds
+    active_cutoff = today - timedelta(days=365)
+    risk_cutoff = today - timedelta(days=risk_months * 30)
+    churn_cutoff = today - timedelta(days=churn_months * 30)
+    total_active_patients = 0
+    risk_count = 0
+    for _first, last_completed in history.values():
+        if last_completed is None:
+            continue
+        if last_completed >= active_cutoff:
+            total_active_patients += 1
+        if churn_cutoff <= last_completed <= risk_cutoff:
+            risk_count += 1
+
+    # Retention curve: monthly cohorts of new patients, returns in the following months
+    retention_data = retention_matrix(history, activity, cohort_start, retention_cohorts, retention_months)
+
+    return {
+        'total_appointments': total_appointments,
+        'total_retornos': total_retornos,
+        'show_rate': show_rate,
+        'no_show_rate': no_show_rate,
+        'cancelled_rate': cancelled_rate,
+        'vago_rate': vago_rate,
+        'private_pct': private_pct,
+        'insurance_pct': insurance_pct,
+        'retention_rate': retention_rate,
+        'attended_count': period.completed,
+        'no_show_count': period.no_show,
+        'cancelled_count': period.cancelled,
+        'particular_count': period.particular,
+        'convenio_count': period.convenio,
+        'avg_consultations_per_day': avg_consultations_per_day,
+        'avg_duration_minutes': avg_duration_minutes,
+        'occupation_rate': occupation_rate,
+        'new_patients_count': new_patients_count,
+        'total_unique_patients': total_unique_patients,
+        'avg_consultations_per_patient': avg_consultations_per_patient,
+        'monthly_agenda': monthly_agenda,
+        'monthly_patients': monthly_patients,
+        'trend_ocupacao_pp': pct_pt(occupation_rate, prev_occupation_rate),
+        'trend_cancelamento_pp': pct_pt(cancelled_rate, prev_cancelled_rate),
+        'trend_noshow_pp': pct_pt(no_show_rate, prev_no_show_rate),
+        'trend_novos_pct': round(((new_patients_count - prev_new) / prev_new * 100) if prev_new else 0, 0),
+        'trend_retencao_pp': pct_pt(retention_rate, prev_retention),
+        'trend_media_consultas_pct': round(
+            ((avg_consultations_per_patient - prev_avg_per_patient) / prev_avg_per_patient * 100) if prev_avg_per_patient else 0, 0
+        ),
+        # Loyalty metrics
+        'total_active_patients': total_active_patients,
+        'risk_count': risk_count,
+        'retention_curve': retention_data,
+    }
+
+
+def _rate(count, total):
+    return round((count / total * 100) if total else 0, 1)
+
+
+def compare_doctors(doctor_ids, start_date, end_date, today, settings=None):
+    """
+    The period KPIs of each doctor, side by side: {doctor_id: kpis}. Every
+    figure is grouped by doctor (counts and revenue from the rollup plus
+    live edges, distinct patients from one patient-pair query, new and
+    active patients from the visit summaries, slot capacity), so the number
+    of queries does not depend on the number of doctors.
+    """
+    figures = period_figures_by_doctor(doctor_ids, start_date, end_date, today=today)
+    patients = Appointment.objects.filter(
+        doctor_id__in=doctor_ids, appointment_date__range=[start_date, end_date]
+    ).order_by().values('doctor_id', 'patient_id').annotate(visits=Count('id')).values_list('doctor_id', 'visits')
+    unique = Counter()
+    returning = Counter()
+    for doctor_id, visits in patients.iterator(chunk_size=5000):
+        unique[doctor_id] += 1
+        if visits > 1:
+            returning[doctor_id] += 1
+    first_and_active = first_and_active_by_doctor(doctor_ids, start_date, end_date, today - timedelta(days=365))
+    capacity = load_capacity(doctor_ids, start_date, end_date, settings=settings)
+    slots = {doctor_id: EMPTY_DAY for doctor_id in doctor_ids}
+    for (doctor_id, _day), values in capacity.items():
+        slots[doctor_id] = slots[doctor_id] + values
+    days_in_period = (end_date - start_date).days + 1
+
+    comparison = {}
+    for doctor_id in doctor_ids:
+        doctor = figures[doctor_id]
+        total = doctor['total_appointments']
+        completed = doctor['completed_count']
+        payments = doctor['particular_count'] + doctor['convenio_count']
+        new_patients, active_patients = first_and_active.get(doctor_id, (0, 0))
+        comparison[doctor_id] = {
+            'total_appointments': total,
+            'total_retornos': max(0, total - unique[doctor_id]),
+            'attended_count': completed,
+            'no_show_count': doctor['no_show_count'],
+            'cancelled_count': doctor['cancelled_count'],
+            'show_rate': _rate(completed, total),
+            'no_show_rate': _rate(doctor['no_show_count'], total),
+            'cancelled_rate': _rate(doctor['cancelled_count'], total),
+            'occupation_rate': round(slots[doctor_id].percent(slots[doctor_id].booked), 1),
+            'vago_rate': round(slots[doctor_id].percent(slots[doctor_id].vacant), 1),
+            'particular_count': doctor['particular_count'],
+            'convenio_count': doctor['convenio_count'],
+            'private_pct': _rate(doctor['particular_count'], payments),
+            'insurance_pct': _rate(doctor['convenio_count'], payments),
+            'total_unique_patients': unique[doctor_id],
+            'retention_rate': _rate(returning[doctor_id], unique[doctor_id]),
+            'avg_consultations_per_day': round(total / days_in_period, 1) if days_in_period > 0 else 0,
+            'avg_consultations_per_patient': round(total / unique[doctor_id], 1) if unique[doctor_id] else 0,
+            'avg_duration_minutes': int(doctor['completed_duration_minutes'] / completed) if completed else 0,
+            'new_patients_count': new_patients,
+            'total_active_patients': active_patients,
+            'revenue': float(doctor['revenue']),
+        }
+    return comparison
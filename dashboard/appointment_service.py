@@ -0,0 +1,216 @@
+"""
+Write-side appointment operations shared by the dashboard views.
+
+Everything here works on querysets and runs set-based statements inside a
+transaction instead of saving appointments one by one.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .agenda_events import publish_agenda_event
+from .availability_service import check_slot_conflicts
+from .models import Appointment, Income
+from .rollup_service import schedule_refresh, schedule_refresh_for_appointments
+from .visit_summary_service import schedule_summary_refresh, schedule_summary_refresh_for_appointments
+
+
+# Above this many appointments, bulk cancellation runs as a background job
+BULK_CANCEL_BACKGROUND_THRESHOLD = 500
+BULK_CANCEL_CHUNK_SIZE = 500
+
+
+def build_cancellation_queryset(doctors, from_date, until_date, from_time, until_time, exclude_completed=True):
+    """
+    Appointments in the [from_date from_time, until_date until_time] window
+    that a bulk cancellation would affect. Shared by the dry-run count and
+    the cancellation itself so both always agree.
+    """
+    if from_date == until_date:
+        # Same day: filter by time range
+        window = Q(
+            appointment_date=from_date,
+            appointment_time__gte=from_time,
+            appointment_time__lte=until_time
+        )
+    else:
+        window = Q(
+            # Appointments on start date with time >= from_time
+            appointment_date=from_date,
+            appointment_time__gte=from_time
+        ) | Q(
+            # Appointments on end date with time <= until_time
+            appointment_date=until_date,
+            appointment_time__lte=until_time
+        ) | Q(
+            # Appointments between start and end dates (all times)
+            appointment_date__gt=from_date,
+            appointment_date__lt=until_date
+        )
+
+    queryset = Appointment.objects.filter(doctor__in=doctors).filter(window).exclude(status='cancelled')
+    if exclude_completed:
+        queryset = queryset.exclude(status='completed')
+    return queryset
+
+
+def cancellation_values(reason, now=None):
+    """Field values Appointment.cancel() would set, for use with update()."""
+    now = now or timezone.now()
+    # update() skips auto_now, so updated_at is set explicitly for the calendar feed cursor
+    values = {'updated_at': now}
+    if reason and 'falta' in reason.lower():
+        values['status'] = 'no_show'
+    else:
+        values['status'] = 'cancelled'
+        values['cancelled_at'] = now
+    if reason:
+        values['cancellation_reason'] = reason
+    return values
+
+
+def bulk_cancel_appointments(queryset, reason):
+    """
+    Cancel every appointment in queryset and delete their incomes, atomically.
+    Returns (cancelled_count, income_deleted_count).
+    """
+    with transaction.atomic():
+        affected = defaultdict(list)
+        for appointment_id, doctor_id in queryset.values_list('id', 'doctor_id'):
+            affected[doctor_id].append(appointment_id)
+        _, deleted = Income.objects.filter(appointment__in=queryset).delete()
+        # update() sends no post_save signals, so the monthly rollups are refreshed here
+        schedule_refresh_for_appointments(queryset)
+        schedule_summary_refresh_for_appointments(queryset)
+        cancelled_count = queryset.update(**cancellation_values(reason))
+        # update() sends no post_save signals, so live agendas are notified here
+        for doctor_id, appointment_ids in affected.items():
+            publish_agenda_event(doctor_id, 'appointment.cancelled', appointment_ids=appointment_ids)
+    return cancelled_count, deleted.get(Income._meta.label, 0)
+
+
+def run_bulk_cancel_job(job, appointment_ids, reason, exclude_completed=True):
+    """
+    Background variant of bulk_cancel_appointments: cancels in chunks, each
+    chunk in its own transaction, reporting progress on the job. Each chunk
+    is filtered again, so appointments cancelled (or, with exclude_completed,
+    completed) since the job was submitted are left alone.
+    """
+    cancelled_count = 0
+    income_deleted_count = 0
+    job.set_progress(0, total=len(appointment_ids))
+    for offset in range(0, len(appointment_ids), BULK_CANCEL_CHUNK_SIZE):
+        chunk = appointment_ids[offset:offset + BULK_CANCEL_CHUNK_SIZE]
+        appointments = Appointment.objects.filter(id__in=chunk).exclude(status='cancelled')
+        if exclude_completed:
+            appointments = appointments.exclude(status='completed')
+        cancelled, incomes = bulk_cancel_appointments(appointments, reason)
+        cancelled_count += cancelled
+        income_deleted_count += incomes
+        job.set_progress(offset + len(chunk))
+    return {
+        'cancelled_count': cancelled_count,
+        'income_deleted_count': income_deleted_count,
+        'message': format_cancel_message(cancelled_count, income_deleted_count),
+    }
+
+
+def format_cancel_message(cancelled_count, income_deleted_count):
+    message = f'{cancelled_count} consulta(s) cancelada(s) com sucesso'
+    if income_deleted_count > 0:
+        message += f' e {income_deleted_count} receita(s) removida(s)'
+    return message
+
+
+# ─── Incomes ─────────────────────────────────────────────────────────────────
+
+def booking_income(appointment, today=None):
+    """
+    The Income a new booking generates, unsaved, or None: only confirmed or
+    completed appointments with a value, dated today or earlier, have been paid.
+    """
+    today = today or timezone.localdate()
+    if not (appointment.value and appointment.value > 0):
+        return None
+    if appointment.status not in ('confirmed', 'completed') or appointment.appointment_date > today:
+        return None
+    return Income(
+        doctor=appointment.doctor,
+        appointment=appointment,
+        patient=appointment.patient,
+        amount=appointment.value,
+        description=f"Consulta - {appointment.patient.full_name}",
+        category=appointment.appointment_type,
+        income_date=appointment.appointment_date,
+        notes=f"Receita gerada pela consulta agendada para {appointment.appointment_date} às {appointment.appointment_time}"
+    )
+
+
+# ─── Recurring series ────────────────────────────────────────────────────────
+
+MAX_SERIES_OCCURRENCES = 52
+
+
+def series_dates(first_date, occurrences, interval_weeks=1):
+    """Dates of a weekly series: first_date, then every interval_weeks weeks."""
+    return [first_date + timedelta(weeks=interval_weeks * i) for i in range(occurrences)]
+
+
+def find_series_conflicts(doctor, dates, appointment_time, duration_minutes):
+    """
+    Check every occurrence of a series against the doctor's existing
+    appointments and calendar blocks in one batch (check_slot_conflicts).
+    Returns {date: 'appointment' | 'block'} for the occurrences that clash.
+    """
+    results = check_slot_conflicts(
+        (doctor.id, day, appointment_time, duration_minutes) for day in dates
+    )
+    return {day: conflict['kind'] for day, conflict in zip(dates, results) if conflict}
+
+
+def create_appointment_series(doctor, patient, dates, appointment_time, duration_minutes, dry_run=False, **fields):
+    """
+    Book one appointment per date, skipping occurrences that conflict.
+
+    All conflicts are found up front (find_series_conflicts) and the valid
+    occurrences are inserted with a single bulk_create inside a transaction,
+    together with the incomes of the occurrences already paid (booking_income).
+    Returns (created_appointments, conflicts).
+    """
+    conflicts = find_series_conflicts(doctor, dates, appointment_time, duration_minutes)
+    valid_dates = [day for day in dates if day not in conflicts]
+    if dry_run or not valid_dates:
+        return [], conflicts
+
+    appointments = [
+        Appointment(
+            doctor=doctor,
+            patient=patient,
+            appointment_date=day,
+            appointment_time=appointment_time,
+            duration_minutes=duration_minutes,
+            **fields
+        )
+        for day in valid_dates
+    ]
+    with transaction.atomic():
+        created = Appointment.objects.bulk_create(appointments)
+        today = timezone.localdate()
+        Income.objects.bulk_create([
+            income for income in (booking_income(appointment, today) for appointment in created) if income
+        ])
+        # bulk_create sends no post_save signals, so rollups (appointments and
+        # incomes of the same doctor-months), visit summaries and live agendas
+        # are updated here
+        for day in valid_dates:
+            schedule_refresh(doctor.id, day)
+        schedule_summary_refresh(patient.id, doctor.id)
+        publish_agenda_event(
+            doctor.id,
+            'appointment.created',
+            appointment_ids=[appointment.id for appointment in created],
+        )
+    return created, conflicts
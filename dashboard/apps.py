@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dashboard'
+
+    def ready(self):
+        from django.core.signals import request_started
+
+        from . import signals  # noqa: F401
+        from .jobs import fail_orphaned_jobs_on_startup
+
+        # Jobs of a process that was restarted are failed on the new process's first request
+        request_started.connect(fail_orphaned_jobs_on_startup)
@@ -0,0 +1,346 @@
+"""
+Availability engine for doctor schedules.
+
+Busy time (non-cancelled appointments and CalendarBlocks) is loaded once for
+a set of doctors and a date range, then free time is computed per doctor-day
+with sorted-interval arithmetic. Working hours and days come from
+AppointmentSettings. All intervals are expressed in minutes from midnight,
+local time.
+"""
+import bisect
+import heapq
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta
+
+from django.utils import timezone
+
+from .models import Appointment, AppointmentSettings, CalendarBlock
+
+
+DEFAULT_WORK_START = '08:00'
+DEFAULT_WORK_END = '18:00'
+# FullCalendar convention (0=Sun ... 6=Sat), as stored in AppointmentSettings.work_days
+DEFAULT_WORK_DAYS = [1, 2, 3, 4, 5]
+SLOT_MINUTES = 30
+
+
+def _parse_minutes(value, default):
+    """'HH:MM' -> minutes from midnight."""
+    try:
+        hours, minutes = str(value or default).split(':')[:2]
+        return int(hours) * 60 + int(minutes)
+    except (TypeError, ValueError):
+        hours, minutes = default.split(':')
+        return int(hours) * 60 + int(minutes)
+
+
+def work_window(settings):
+    """(work_start_min, work_end_min, work_days) from AppointmentSettings, with defaults."""
+    return (
+        _parse_minutes(settings.work_start_time, DEFAULT_WORK_START),
+        _parse_minutes(settings.work_end_time, DEFAULT_WORK_END),
+        set(settings.work_days or DEFAULT_WORK_DAYS),
+    )
+
+
+def minutes_to_time(minutes):
+    return dt_time(minutes // 60, minutes % 60)
+
+
+def time_to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def fc_weekday(day):
+    """Python weekday (0=Mon) -> FullCalendar weekday (0=Sun)."""
+    return (day.weekday() + 1) % 7
+
+
+def merge_intervals(intervals):
+    """Merge overlapping/touching (start, end) intervals; returns a sorted list."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(window, busy):
+    """Free parts of the (start, end) window given merged, sorted busy intervals."""
+    window_start, window_end = window
+    free = []
+    cursor = window_start
+    for start, end in busy:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start > cursor:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        free.append((cursor, window_end))
+    return free
+
+
+def load_appointment_intervals(doctor_ids, start_date, end_date):
+    """
+    Minutes taken by non-cancelled appointments per (doctor_id, date), in one
+    query. Returns {(doctor_id, date): [(start_min, end_min), ...]} unmerged.
+    """
+    busy = defaultdict(list)
+    appointments = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        appointment_date__range=[start_date, end_date],
+    ).exclude(status='cancelled').values_list(
+        'doctor_id', 'appointment_date', 'appointment_time', 'duration_minutes'
+    )
+    for doctor_id, day, start, duration in appointments:
+        start_min = time_to_minutes(start)
+        busy[(doctor_id, day)].append((start_min, min(start_min + duration, 24 * 60)))
+    return busy
+
+
+def _iter_block_days(doctor_ids, start_date, end_date):
+    """
+    CalendarBlocks overlapping [start_date, end_date], clipped per local day.
+    Yields (doctor_id, date, start_min, end_min, block_id); one query.
+    """
+    current_tz = timezone.get_current_timezone()
+    range_start = timezone.make_aware(datetime.combine(start_date, dt_time.min), current_tz)
+    range_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), dt_time.min), current_tz)
+    blocks = CalendarBlock.objects.filter(
+        doctor_id__in=doctor_ids,
+        start__lt=range_end,
+        end__gt=range_start,
+    ).values_list('id', 'doctor_id', 'start', 'end')
+    for block_id, doctor_id, block_start, block_end in blocks:
+        block_start = max(timezone.localtime(block_start, current_tz), range_start)
+        block_end = min(timezone.localtime(block_end, current_tz), range_end)
+        day = block_start.date()
+        while day <= block_end.date() and day <= end_date:
+            day_start = time_to_minutes(block_start.time()) if day == block_start.date() else 0
+            day_end = time_to_minutes(block_end.time()) if day == block_end.date() else 24 * 60
+            if day_end > day_start:
+                yield doctor_id, day, day_start, day_end, block_id
+            day += timedelta(days=1)
+
+
+def load_block_intervals(doctor_ids, start_date, end_date):
+    """
+    Minutes covered by CalendarBlocks per (doctor_id, date), in one query.
+    Blocks spanning several days are clipped per day (local time).
+    """
+    busy = defaultdict(list)
+    for doctor_id, day, start_min, end_min, _block_id in _iter_block_days(doctor_ids, start_date, end_date):
+        busy[(doctor_id, day)].append((start_min, end_min))
+    return busy
+
+
+def load_busy_intervals(doctor_ids, start_date, end_date):
+    """
+    Busy minutes per (doctor_id, date) for the whole range: appointments and
+    calendar blocks, one query each, independent of the number of doctors
+    and days. Returns {(doctor_id, date): [(start_min, end_min), ...]} merged.
+    """
+    busy = load_appointment_intervals(doctor_ids, start_date, end_date)
+    for key, intervals in load_block_intervals(doctor_ids, start_date, end_date).items():
+        busy[key].extend(intervals)
+    return {key: merge_intervals(intervals) for key, intervals in busy.items()}
+
+
+class Availability:
+    """
+    Free time for a set of doctors over [start_date, end_date].
+
+    Busy intervals are loaded on construction (see load_busy_intervals);
+    every lookup afterwards is pure Python.
+    """
+
+    def __init__(self, doctors, start_date, end_date, settings=None):
+        if settings is None:
+            settings = AppointmentSettings.get_settings()
+        self.doctor_ids = [getattr(doctor, 'id', doctor) for doctor in doctors]
+        self.start_date = start_date
+        self.end_date = end_date
+        self.work_start, self.work_end, self.work_days = work_window(settings)
+        self.busy = load_busy_intervals(self.doctor_ids, start_date, end_date)
+
+    def days(self):
+        """Working days in the range, in order."""
+        day = self.start_date
+        while day <= self.end_date:
+            if fc_weekday(day) in self.work_days:
+                yield day
+            day += timedelta(days=1)
+
+    def busy_intervals(self, doctor_id, day):
+        return self.busy.get((doctor_id, day), [])
+
+    def free_intervals(self, doctor_id, day, now=None):
+        """Free (start_min, end_min) intervals inside working hours."""
+        if fc_weekday(day) not in self.work_days or not self.start_date <= day <= self.end_date:
+            return []
+        window_start = self.work_start
+        if now is not None:
+            now = timezone.localtime(now)
+            if day < now.date():
+                return []
+            if day == now.date():
+                window_start = max(window_start, time_to_minutes(now.time()) + 1)
+        if window_start >= self.work_end:
+            return []
+        return subtract_intervals((window_start, self.work_end), self.busy_intervals(doctor_id, day))
+
+    def free_slots(self, doctor_id, day, duration=SLOT_MINUTES, step=SLOT_MINUTES, now=None):
+        """
+        Slot start times (datetime.time) on the working-hours grid whose whole
+        [start, start + duration) fits inside a free interval.
+        """
+        slots = []
+        for free_start, free_end in self.free_intervals(doctor_id, day, now=now):
+            # First grid point at or after free_start
+            offset = (free_start - self.work_start) % step
+            slot = free_start if offset == 0 else free_start + step - offset
+            while slot + duration <= free_end:
+                slots.append(minutes_to_time(slot))
+                slot += step
+        return slots
+
+    def has_free_slot(self, doctor_id, day, duration=SLOT_MINUTES, now=None):
+        return bool(self.free_slots(doctor_id, day, duration=duration, now=now))
+
+    def slots_by_day(self, doctor_id, duration=SLOT_MINUTES, now=None):
+        """{date: [time, ...]} for every working day in the range with free slots."""
+        result = {}
+        for day in self.days():
+            slots = self.free_slots(doctor_id, day, duration=duration, now=now)
+            if slots:
+                result[day] = slots
+        return result
+
+
+def next_free_slots(doctors, start_date, limit, per_day=3, horizon_days=60, window_days=7, now=None):
+    """
+    The earliest free slots across several doctors, ordered by date/time.
+
+    The horizon is scanned in windows of window_days; each window loads busy
+    time for every doctor at once (see Availability) and the per-doctor slot
+    streams are combined with a heap merge, stopping as soon as limit slots
+    are found. At most per_day slots are taken per doctor-day so one doctor
+    does not fill the whole list. Yields (date, time, doctor) tuples.
+    """
+    doctors = list(doctors)
+    if not doctors or limit <= 0:
+        return
+    settings = AppointmentSettings.get_settings()
+    horizon_end = start_date + timedelta(days=horizon_days - 1)
+
+    def doctor_slots(availability, rank, doctor):
+        for day in availability.days():
+            for slot in availability.free_slots(doctor.id, day, now=now)[:per_day]:
+                yield day, slot, rank, doctor
+
+    remaining = limit
+    window_start = start_date
+    while window_start <= horizon_end:
+        window_end = min(window_start + timedelta(days=window_days - 1), horizon_end)
+        availability = Availability(doctors, window_start, window_end, settings=settings)
+        streams = [doctor_slots(availability, rank, doctor) for rank, doctor in enumerate(doctors)]
+        for day, slot, _rank, doctor in heapq.merge(*streams):
+            yield day, slot, doctor
+            remaining -= 1
+            if remaining == 0:
+                return
+        window_start = window_end + timedelta(days=1)
+
+
+# ─── Conflict checks ─────────────────────────────────────────────────────────
+
+# Upper bound on candidates per batch check request
+MAX_CONFLICT_CHECK_SLOTS = 200
+
+CONFLICT_MESSAGES = {
+    'appointment': 'Já existe uma consulta agendada para este médico no horário selecionado',
+    'block': 'Este horário está dentro de um período bloqueado na agenda. Escolha outro horário.',
+}
+
+
+class ConflictIndex:
+    """
+    Overlap index of the busy time of a set of doctors over [start_date, end_date].
+
+    Unlike Availability, intervals are kept unmerged and tagged with what
+    occupies them, so a check can report the clashing appointment or block
+    and an appointment being moved can be left out of its own check. Each
+    doctor-day is sorted by start with a running maximum of end times, so
+    every candidate is answered with one bisect.
+    """
+
+    def __init__(self, doctor_ids, start_date, end_date, exclude_appointment_ids=()):
+        entries = defaultdict(list)
+        appointments = Appointment.objects.filter(
+            doctor_id__in=doctor_ids,
+            appointment_date__range=[start_date, end_date],
+        ).exclude(status='cancelled').exclude(id__in=list(exclude_appointment_ids)).values_list(
+            'id', 'doctor_id', 'appointment_date', 'appointment_time', 'duration_minutes'
+        )
+        for appointment_id, doctor_id, day, start, duration in appointments:
+            start_min = time_to_minutes(start)
+            entries[(doctor_id, day)].append((start_min, min(start_min + duration, 24 * 60), 'appointment', appointment_id))
+        for doctor_id, day, start_min, end_min, block_id in _iter_block_days(doctor_ids, start_date, end_date):
+            entries[(doctor_id, day)].append((start_min, end_min, 'block', block_id))
+
+        self._index = {}
+        for key, intervals in entries.items():
+            intervals.sort()
+            max_ends = []
+            running = 0
+            for _start, end, _kind, _ref in intervals:
+                running = max(running, end)
+                max_ends.append(running)
+            self._index[key] = ([interval[0] for interval in intervals], intervals, max_ends)
+
+    def conflict(self, doctor_id, day, start_min, end_min):
+        """
+        What [start_min, end_min) clashes with on that doctor-day:
+        {'kind': 'appointment' | 'block', 'id': ...}, or None when free.
+        """
+        index = self._index.get((doctor_id, day))
+        if index is None:
+            return None
+        starts, intervals, max_ends = index
+        # Only intervals starting before end_min can overlap...
+        position = bisect.bisect_left(starts, end_min)
+        # ...and one of them does iff the furthest end among them is past start_min
+        if position == 0 or max_ends[position - 1] <= start_min:
+            return None
+        for i in range(position - 1, -1, -1):
+            _start, end, kind, ref = intervals[i]
+            if end > start_min:
+                return {'kind': kind, 'id': ref}
+        return None
+
+
+def check_slot_conflicts(candidates, exclude_appointment_ids=()):
+    """
+    Check N candidate slots at once. candidates is an iterable of
+    (doctor_id, date, time, duration_minutes); returns a list, in the same
+    order, of None (free) or the conflict dict from ConflictIndex.conflict.
+    Busy time is loaded with one appointment and one block query covering
+    every doctor and the whole date span of the candidates.
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    doctor_ids = {candidate[0] for candidate in candidates}
+    days = [candidate[1] for candidate in candidates]
+    index = ConflictIndex(doctor_ids, min(days), max(days), exclude_appointment_ids=exclude_appointment_ids)
+    results = []
+    for doctor_id, day, start, duration in candidates:
+        start_min = time_to_minutes(start)
+        results.append(index.conflict(doctor_id, day, start_min, start_min + int(duration)))
+    return results
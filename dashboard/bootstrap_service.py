@@ -0,0 +1,124 @@
+"""
+Payload builders for the dashboard's first paint.
+
+The agenda stats, next appointment, appointment settings, patients and
+doctors endpoints serialize through the functions below, and api_bootstrap
+returns all of them in one document. Access checks run once per request
+through AccessContext instead of once per endpoint.
+"""
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.utils import get_accessible_doctors, get_accessible_patients, get_user_role
+
+from .agenda_service import PENDING_STATUSES, get_doctor_scope
+from .models import Appointment
+
+
+# Statements api_bootstrap is expected to stay within (logged when exceeded)
+BOOTSTRAP_QUERY_BUDGET = 12
+
+
+class AccessContext:
+    """
+    Who is asking and what they can see, resolved once per request: role,
+    selected doctor and the accessible doctors (loaded once, with their users).
+    """
+
+    def __init__(self, user, selected_doctor):
+        self.user = user
+        self.role = get_user_role(user)
+        self.selected_doctor = selected_doctor
+        self.accessible_doctors = list(
+            get_accessible_doctors(user).select_related('user').order_by('user__last_name', 'user__first_name')
+        )
+
+    @property
+    def accessible_doctor_ids(self):
+        return [doctor.id for doctor in self.accessible_doctors]
+
+    @property
+    def doctor_scope(self):
+        return get_doctor_scope(self.selected_doctor, self.accessible_doctors)
+
+    @property
+    def own_doctor(self):
+        """The user's own doctor profile (None for secretaries)."""
+        return getattr(self.user, 'doctor_profile', None)
+
+
+def next_appointment_data(doctor, now=None):
+    """
+    The doctor's next scheduled/confirmed appointment, serialized, or None.
+    One query: later today or any later day, earliest first.
+    """
+    if doctor is None:
+        return None
+    now = timezone.localtime(now or timezone.now())
+    today = now.date()
+    next_appointment = Appointment.objects.filter(
+        Q(appointment_date=today, appointment_time__gt=now.time()) | Q(appointment_date__gt=today),
+        doctor=doctor,
+        status__in=PENDING_STATUSES,
+    ).select_related('patient').order_by('appointment_date', 'appointment_time').first()
+    if next_appointment is None:
+        return None
+    return {
+        'id': next_appointment.id,
+        'patient_name': next_appointment.patient.full_name,
+        'appointment_date': next_appointment.appointment_date.strftime('%d/%m/%Y'),
+        'appointment_time': next_appointment.appointment_time.strftime('%H:%M'),
+        'appointment_type': next_appointment.get_appointment_type_display(),
+        'status': next_appointment.status,
+        'location': next_appointment.location or 'Consultório',
+        'reason': next_appointment.reason or 'Consulta médica',
+        'notes': next_appointment.notes or 'Nenhuma observação'
+    }
+
+
+def appointment_settings_data(settings):
+    return {
+        'duration_options': settings.duration_options,
+        'type_choices': settings.type_choices,
+        'status_choices': settings.status_choices,
+        'status_colors': settings.status_colors if settings.status_colors else {},
+        'location_options': settings.location_options,
+        'insurance_operators': settings.insurance_operators if settings.insurance_operators else [],
+        'cancellation_reasons': settings.cancellation_reasons if settings.cancellation_reasons else [],
+        'convenio_prices': settings.convenio_prices if settings.convenio_prices is not None else {},
+        'work_start_time': settings.work_start_time or '08:00',
+        'work_end_time': settings.work_end_time or '18:00',
+        'work_days': settings.work_days if settings.work_days else [1, 2, 3, 4, 5],
+    }
+
+
+def patient_list_data(user):
+    """Accessible patients for the appointment modal, read as plain rows."""
+    rows = get_accessible_patients(user).order_by('first_name', 'last_name').values(
+        'id', 'first_name', 'last_name', 'email', 'phone', 'cpf'
+    )
+    return [
+        {
+            'id': row['id'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'email': row['email'],
+            'phone': row['phone'],
+            'cpf': row['cpf'] or '',
+            'full_name': f"{row['first_name']} {row['last_name']}"
+        }
+        for row in rows
+    ]
+
+
+def doctor_list_data(doctors):
+    """Serialize doctors (fetched with select_related('user')) for the appointment modal."""
+    return [
+        {
+            'id': doctor.id,
+            'full_name': doctor.full_name,
+            'specialization': doctor.specialization,
+            'medical_license': doctor.medical_license
+        }
+        for doctor in doctors
+    ]
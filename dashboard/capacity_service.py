@@ -0,0 +1,185 @@
+"""
+Slot capacity and occupancy per doctor-day.
+
+A doctor-day's capacity is its working window (AppointmentSettings work
+hours, on work days) minus the CalendarBlocks that cover it. The capacity
+minutes are then split, in this order of precedence, into booked time
+(appointments that are not cancelled or no-show), no-show time, time freed
+by cancellations and never rebooked, and vacant time ("vago").
+
+Figures are computed in bulk (one appointment and one block query for any
+number of doctors and days) and, when the cache is shared by the workers
+(see result_cache_enabled), cached per doctor-month under the month's data
+version, so closed months are only recomputed when one of their appointments
+or blocks changes.
+"""
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+
+from django.core.cache import cache
+
+from .availability_service import (
+    fc_weekday, load_block_intervals, merge_intervals, subtract_intervals, time_to_minutes, work_window,
+)
+from .models import Appointment, AppointmentSettings
+from .result_cache import KEY_PREFIX, RESULT_CACHE_TIMEOUT, month_versions, result_cache_enabled
+
+
+class DayCapacity(namedtuple('DayCapacity', 'capacity booked no_show cancelled')):
+    """Minutes of one doctor-day (or a sum of them)."""
+
+    __slots__ = ()
+
+    @property
+    def vacant(self):
+        return self.capacity - self.booked - self.no_show - self.cancelled
+
+    def __add__(self, other):
+        return DayCapacity(*(mine + theirs for mine, theirs in zip(self, other)))
+
+    def percent(self, minutes):
+        return (minutes / self.capacity * 100) if self.capacity else 0
+
+
+EMPTY_DAY = DayCapacity(0, 0, 0, 0)
+
+
+def _minutes(intervals):
+    return sum(end - start for start, end in intervals)
+
+
+def _within(intervals, available):
+    """Parts of merged intervals that fall inside merged, sorted available intervals."""
+    inside = []
+    for start, end in intervals:
+        for available_start, available_end in available:
+            if available_start >= end:
+                break
+            if available_end > start:
+                inside.append((max(start, available_start), min(end, available_end)))
+    return inside
+
+
+def _without(intervals, taken):
+    """Parts of intervals not covered by merged, sorted taken intervals."""
+    free = []
+    for interval in intervals:
+        free.extend(subtract_intervals(interval, taken))
+    return free
+
+
+def compute_capacity(doctor_ids, start_date, end_date, settings=None):
+    """
+    {(doctor_id, date): DayCapacity} for every working day in
+    [start_date, end_date], in two queries.
+    """
+    if settings is None:
+        settings = AppointmentSettings.get_settings()
+    work_start, work_end, work_days = work_window(settings)
+    blocks = load_block_intervals(doctor_ids, start_date, end_date)
+
+    booked = defaultdict(list)
+    no_show = defaultdict(list)
+    cancelled = defaultdict(list)
+    appointments = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        appointment_date__range=[start_date, end_date],
+    ).values_list('doctor_id', 'appointment_date', 'appointment_time', 'duration_minutes', 'status')
+    for doctor_id, day, start, duration, status in appointments.iterator(chunk_size=5000):
+        start_min = time_to_minutes(start)
+        interval = (start_min, min(start_min + duration, 24 * 60))
+        target = {'no_show': no_show, 'cancelled': cancelled}.get(status, booked)
+        target[(doctor_id, day)].append(interval)
+
+    figures = {}
+    day = start_date
+    while day <= end_date:
+        if fc_weekday(day) in work_days and work_start < work_end:
+            for doctor_id in doctor_ids:
+                key = (doctor_id, day)
+                available = subtract_intervals((work_start, work_end), merge_intervals(blocks.get(key, ())))
+                booked_time = merge_intervals(_within(merge_intervals(booked.get(key, ())), available))
+                no_show_time = merge_intervals(_without(
+                    _within(merge_intervals(no_show.get(key, ())), available), booked_time
+                ))
+                cancelled_time = _without(
+                    _within(merge_intervals(cancelled.get(key, ())), available),
+                    merge_intervals(booked_time + no_show_time),
+                )
+                figures[key] = DayCapacity(
+                    _minutes(available), _minutes(booked_time), _minutes(no_show_time), _minutes(cancelled_time)
+                )
+        day += timedelta(days=1)
+    return figures
+
+
+def _month_starts(start_date, end_date):
+    month = date(start_date.year, start_date.month, 1)
+    while month <= end_date:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _month_last(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1) - timedelta(days=1)
+
+
+def load_capacity(doctor_ids, start_date, end_date, settings=None):
+    """
+    compute_capacity for [start_date, end_date], served from per
+    doctor-month cache entries; only the doctor-months whose data version
+    (or the working hours) changed since they were cached are recomputed,
+    together, in two queries. Computed directly when results may not be
+    cached (see result_cache_enabled).
+    """
+    if settings is None:
+        settings = AppointmentSettings.get_settings()
+    if not result_cache_enabled():
+        return compute_capacity(doctor_ids, start_date, end_date, settings=settings)
+    work_start, work_end, work_days = work_window(settings)
+    window = f'{work_start}-{work_end}-{"".join(map(str, sorted(work_days)))}'
+
+    months = list(_month_starts(start_date, end_date))
+    versions = month_versions(doctor_ids, months)
+    keys = {
+        pair: f'{KEY_PREFIX}:capacity:{pair[0]}:{pair[1]:%Y-%m}:{window}:{version}'
+        for pair, version in versions.items()
+    }
+    cached = cache.get_many(list(keys.values()))
+
+    figures = {}
+    missing = []
+    for (doctor_id, month), key in keys.items():
+        if key in cached:
+            figures.update({(doctor_id, date.fromordinal(day)): DayCapacity(*values) for day, values in cached[key]})
+        else:
+            missing.append((doctor_id, month))
+
+    if missing:
+        missing_doctors = sorted({doctor_id for doctor_id, _month in missing})
+        first = min(month for _doctor_id, month in missing)
+        last = _month_last(max(month for _doctor_id, month in missing))
+        computed = compute_capacity(missing_doctors, first, last, settings=settings)
+        by_month = defaultdict(list)
+        for (doctor_id, day), values in computed.items():
+            by_month[(doctor_id, day.replace(day=1))].append((day.toordinal(), tuple(values)))
+        cache.set_many(
+            {keys[pair]: by_month.get(pair, []) for pair in missing},
+            RESULT_CACHE_TIMEOUT,
+        )
+        missing = set(missing)
+        figures.update({
+            (doctor_id, day): values for (doctor_id, day), values in computed.items()
+            if (doctor_id, day.replace(day=1)) in missing
+        })
+
+    return {key: values for key, values in figures.items() if start_date <= key[1] <= end_date}
+
+
+def sum_capacity(figures, start_date, end_date):
+    """DayCapacity total of the figures dated within [start_date, end_date]."""
+    total = EMPTY_DAY
+    for (_doctor_id, day), values in figures.items():
+        if start_date <= day <= end_date:
+            total = total + values
+    return total
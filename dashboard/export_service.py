@@ -0,0 +1,312 @@
+"""
+Streaming export of the daily and monthly KPI series per doctor.
+
+daily_kpi_rows walks [start_date, end_date] day by day and doctor by doctor,
+merging two server-side cursors ordered the same way: appointment counts
+and income totals grouped by (day, doctor). Slot capacity is loaded one
+month at a time (and cached per doctor-month, see capacity_service), so
+memory use does not depend on the length of the range. monthly_kpi_rows
+folds the daily stream into calendar months (clipped to the range).
+
+appointment_report_rows streams the rows of the appointments report from
+a chunked cursor. csv_lines, jsonl_lines and xlsx_chunks turn rows into
+encoded chunks for a StreamingHttpResponse; the XLSX workbook is zipped on
+the fly (zipfile writes to unseekable streams with data descriptors), so
+its first bytes are sent before the last rows are read.
+"""
+import csv
+import json
+import re
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, Q, Sum
+
+from .analytics_service import add_months, month_start
+from .capacity_service import EMPTY_DAY, load_capacity
+from .models import Appointment, Income
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_GRANULARITIES = ('day', 'month')
+REPORT_EXPORT_FORMATS = ('csv', 'xlsx')
+CURSOR_CHUNK_SIZE = 2000
+# Worksheet rows written between two chunks sent to the client
+XLSX_FLUSH_ROWS = 500
+
+# Per-day counters summed into monthly rows
+COUNT_FIELDS = (
+    'total_appointments', 'completed_count', 'no_show_count', 'cancelled_count',
+    'particular_count', 'convenio_count', 'completed_duration_minutes',
+)
+EXPORT_COLUMNS = (
+    'period', 'doctor_id', 'doctor', *COUNT_FIELDS[:-1],
+    'show_rate', 'no_show_rate', 'cancelled_rate', 'avg_duration_minutes',
+    'capacity_minutes', 'booked_minutes', 'occupation_rate', 'vago_rate', 'revenue',
+)
+
+COMPLETED = Q(status='completed')
+DAILY_AGGREGATES = {
+    'total_appointments': Count('id'),
+    'completed_count': Count('id', filter=COMPLETED),
+    'no_show_count': Count('id', filter=Q(status='no_show')),
+    'cancelled_count': Count('id', filter=Q(status='cancelled')),
+    'particular_count': Count('id', filter=Q(payment_type='particular')),
+    'convenio_count': Count('id', filter=Q(payment_type='convenio')),
+    'completed_duration_minutes': Sum('duration_minutes', filter=COMPLETED),
+}
+
+
+def _grouped_stream(rows):
+    """Pull-one-ahead reader over rows whose first two values are (day, doctor_id)."""
+    rows = iter(rows)
+    row = next(rows, None)
+
+    def take(day, doctor_id):
+        nonlocal row
+        if row is not None and row[0] == day and row[1] == doctor_id:
+            current, row = row, next(rows, None)
+            return current
+        return None
+    return take
+
+
+def _rate(count, total):
+    return round(count / total * 100, 1) if total else 0
+
+
+def _kpi_row(period, doctor_id, doctor_name, counts, slots, revenue):
+    total = counts['total_appointments']
+    completed = counts['completed_count']
+    row = {'period': period, 'doctor_id': doctor_id, 'doctor': doctor_name}
+    row.update({field: counts[field] for field in COUNT_FIELDS[:-1]})
+    row.update({
+        'show_rate': _rate(completed, total),
+        'no_show_rate': _rate(counts['no_show_count'], total),
+        'cancelled_rate': _rate(counts['cancelled_count'], total),
+        'avg_duration_minutes': int(counts['completed_duration_minutes'] / completed) if completed else 0,
+        'capacity_minutes': slots.capacity,
+        'booked_minutes': slots.booked,
+        'occupation_rate': round(slots.percent(slots.booked), 1),
+        'vago_rate': round(slots.percent(slots.vacant), 1),
+        'revenue': str(revenue),
+    })
+    return row
+
+
+def _daily_figures(doctors, start_date, end_date, settings=None):
+    """(day, doctor_id, counts, DayCapacity, revenue) for every day and doctor, in order."""
+    doctor_ids = sorted(doctors)
+    appointments = _grouped_stream(
+        Appointment.objects.filter(doctor_id__in=doctor_ids, appointment_date__range=[start_date, end_date])
+        .order_by().values('appointment_date', 'doctor_id').annotate(**DAILY_AGGREGATES)
+        .order_by('appointment_date', 'doctor_id')
+        .values_list('appointment_date', 'doctor_id', *COUNT_FIELDS)
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+    incomes = _grouped_stream(
+        Income.objects.filter(doctor_id__in=doctor_ids, income_date__range=[start_date, end_date])
+        .order_by().values('income_date', 'doctor_id').annotate(total=Sum('amount'))
+        .order_by('income_date', 'doctor_id')
+        .values_list('income_date', 'doctor_id', 'total')
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+
+    capacity = {}
+    loaded_month = None
+    day = start_date
+    while day <= end_date:
+        if month_start(day) != loaded_month:
+            loaded_month = month_start(day)
+            capacity = load_capacity(
+                doctor_ids, max(start_date, loaded_month),
+                min(end_date, add_months(loaded_month, 1) - timedelta(days=1)), settings=settings,
+            )
+        for doctor_id in doctor_ids:
+            counted = appointments(day, doctor_id)
+            counts = dict(zip(COUNT_FIELDS, counted[2:])) if counted else dict.fromkeys(COUNT_FIELDS, 0)
+            counts['completed_duration_minutes'] = counts['completed_duration_minutes'] or 0
+            income = incomes(day, doctor_id)
+            revenue = (income[2] or Decimal('0')) if income else Decimal('0')
+            yield day, doctor_id, counts, capacity.get((doctor_id, day), EMPTY_DAY), revenue
+        day += timedelta(days=1)
+
+
+def daily_kpi_rows(doctors, start_date, end_date, settings=None):
+    """
+    One KPI row (EXPORT_COLUMNS) per day of [start_date, end_date] and
+    doctor, in date then doctor order. doctors maps doctor_id to name.
+    """
+    for day, doctor_id, counts, slots, revenue in _daily_figures(doctors, start_date, end_date, settings=settings):
+        yield _kpi_row(day.isoformat(), doctor_id, doctors[doctor_id], counts, slots, revenue)
+
+
+def monthly_kpi_rows(doctors, start_date, end_date, settings=None):
+    """daily_kpi_rows summed per calendar month ('YYYY-MM'); edge months only cover their days in range."""
+    month = None
+    totals = {}
+
+    def flush():
+        for doctor_id, (counts, slots, revenue) in sorted(totals.items()):
+            yield _kpi_row(f'{month:%Y-%m}', doctor_id, doctors[doctor_id], counts, slots, revenue)
+
+    for day, doctor_id, counts, slots, revenue in _daily_figures(doctors, start_date, end_date, settings=settings):
+        if month_start(day) != month:
+            yield from flush()
+            month = month_start(day)
+            totals = {}
+        if doctor_id in totals:
+            month_counts, month_slots, month_revenue = totals[doctor_id]
+            for field in COUNT_FIELDS:
+                month_counts[field] += counts[field]
+            totals[doctor_id] = (month_counts, month_slots + slots, month_revenue + revenue)
+        else:
+            totals[doctor_id] = (counts, slots, revenue)
+    yield from flush()
+
+
+APPOINTMENT_REPORT_COLUMNS = ('Data', 'Horário', 'Paciente', 'Médico', 'Tipo', 'Pagamento', 'Valor', 'Status')
+
+
+def appointment_report_rows(appointments):
+    """
+    Rows (APPOINTMENT_REPORT_COLUMNS) of the appointments report for an
+    appointment queryset, read in chunks with patient and doctor joined.
+    """
+    appointments = appointments.select_related('patient', 'doctor__user').only(
+        'appointment_date', 'appointment_time', 'appointment_type', 'payment_type', 'value', 'status',
+        'patient__first_name', 'patient__last_name',
+        'doctor__user__first_name', 'doctor__user__last_name', 'doctor__user__username',
+    ).order_by('appointment_date', 'appointment_time')
+    for apt in appointments.iterator(chunk_size=CURSOR_CHUNK_SIZE):
+        yield (
+            apt.appointment_date.strftime('%d/%m/%Y'),
+            apt.appointment_time.strftime('%H:%M'),
+            apt.patient.full_name,
+            apt.doctor.full_name,
+            apt.get_appointment_type_display(),
+            apt.get_payment_type_display(),
+            apt.value or Decimal('0'),
+            apt.get_status_display(),
+        )
+
+
+class _Echo:
+    """File-like object whose write returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def table_csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header).encode('utf-8')
+    for row in rows:
+        yield writer.writerow(row).encode('utf-8')
+
+
+def csv_lines(rows):
+    return table_csv_lines(EXPORT_COLUMNS, ([row[column] for column in EXPORT_COLUMNS] for row in rows))
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+# ─── XLSX ───────────────────────────────────────────────────────────────────
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+).encode('utf-8')
+_XLSX_SHEET_TAIL = b'</sheetData></worksheet>'
+# Control characters are not allowed in XML 1.0
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _ChunkBuffer:
+    """Write-only, unseekable file that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return ('<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>').encode('utf-8')
+
+
+def xlsx_chunks(header, rows, sheet_name='Planilha'):
+    """A one-sheet XLSX workbook of header + rows, as a stream of bytes chunks."""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(name=escape(sheet_name[:31], {'"': '&quot;'})))
+        yield buffer.drain()
+        # The sheet size is unknown up front, hence zip64 sizes
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(_XLSX_SHEET_HEAD)
+            sheet.write(_xlsx_row(header))
+            for count, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row))
+                if count % XLSX_FLUSH_ROWS == 0:
+                    chunk = buffer.drain()
+                    if chunk:
+                        yield chunk
+            sheet.write(_XLSX_SHEET_TAIL)
+    yield buffer.drain()
@@ -0,0 +1,99 @@
+"""
+In-process background jobs.
+
+Jobs run on a small thread pool owned by each worker process; their state is
+stored in BackgroundJob so status polls can be answered by any process.
+Job functions receive the BackgroundJob instance first and return a
+JSON-serialisable result.
+
+A job dies with its process (restart, deploy, crash). Running jobs touch
+their row as they report progress, so a pending or running job left
+untouched for JOB_STALE_AFTER is taken as orphaned and marked failed: once
+by each process on its first request, and whenever the job is polled.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_JOB_WORKERS', 2),
+    thread_name_prefix='dashboard-job',
+)
+
+JOB_STALE_AFTER = timedelta(minutes=getattr(settings, 'BACKGROUND_JOB_STALE_MINUTES', 15))
+ORPHANED_JOB_ERROR = 'Tarefa interrompida: o servidor foi reiniciado antes de concluí-la. Envie-a novamente.'
+
+
+def submit_job(kind, user, func, params=None, total=0, **kwargs):
+    """
+    Create a BackgroundJob and schedule func(job, **kwargs) once the current
+    transaction commits. Returns the (pending) job.
+    """
+    job = BackgroundJob.objects.create(
+        kind=kind,
+        created_by=user if user and user.is_authenticated else None,
+        params=params or {},
+        total=total,
+    )
+    transaction.on_commit(lambda: _executor.submit(_run_job, job.id, func, kwargs))
+    return job
+
+
+def fail_orphaned_jobs(jobs=None, now=None):
+    """Mark the pending or running jobs (of jobs, default all) that went stale as failed."""
+    now = now or timezone.now()
+    if jobs is None:
+        jobs = BackgroundJob.objects.all()
+    return jobs.filter(status__in=['pending', 'running'], updated_at__lt=now - JOB_STALE_AFTER).update(
+        status='failed', error=ORPHANED_JOB_ERROR, finished_at=now, updated_at=now,
+    )
+
+
+def fail_orphaned_jobs_on_startup(sender, **kwargs):
+    """request_started receiver (see DashboardConfig.ready): runs on a process's first request only."""
+    request_started.disconnect(fail_orphaned_jobs_on_startup)
+    try:
+        failed = fail_orphaned_jobs()
+    except DatabaseError:
+        logger.exception("Could not fail orphaned background jobs")
+        return
+    if failed:
+        logger.warning("Marked %s orphaned background job(s) as failed", failed)
+
+
+def _run_job(job_id, func, kwargs):
+    close_old_connections()
+    job = None
+    try:
+        # A job queued for longer than JOB_STALE_AFTER may have been failed as orphaned meanwhile
+        if not BackgroundJob.objects.filter(id=job_id, status='pending').update(
+            status='running', updated_at=timezone.now()
+        ):
+            logger.warning("Background job %s is no longer pending; skipped", job_id)
+            return
+        job = BackgroundJob.objects.get(id=job_id)
+
+        result = func(job, **kwargs)
+
+        job.status = 'completed'
+        job.result = result or {}
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'finished_at', 'updated_at'])
+    except Exception as exc:
+        logger.exception("Background job %s failed", job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(exc)
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    finally:
+        connection.close()
@@ -0,0 +1,121 @@
+"""
+Patient loyalty metrics (last visit, average interval, completed visits,
+no-show rate and status) computed in bulk.
+
+bulk_loyalty_metrics answers for any number of patients with at most three
+queries: the churn settings, the patients' registration dates (when given a
+queryset) and one grouped aggregate over their PatientVisitSummary rows. Patient.get_loyalty_metrics is the
+single-patient case of the same computation.
+"""
+from dateutil.relativedelta import relativedelta
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from .models import AppointmentSettings
+from .visit_summary_service import visit_totals
+
+
+# Status order used when sorting patients by loyalty
+LOYALTY_STATUSES = ('Novo', 'Ativo', 'Em Risco', 'Churn', 'Inativo')
+# Sort keys accepted by sort_by_loyalty ('-' prefix for descending)
+LOYALTY_SORT_KEYS = ('loyalty', 'last_visit', 'avg_interval', 'total_completed', 'no_show_rate')
+
+
+def loyalty_thresholds():
+    """(churn_months, risk_months) from the appointment settings."""
+    settings = AppointmentSettings.objects.first()
+    churn_months = settings.churn_threshold_months if settings else 12
+    risk_months = settings.churn_risk_months if settings else 6
+    return churn_months, risk_months
+
+
+def loyalty_status(total_completed, first_visit, last_visit, created_at, today, churn_months, risk_months):
+    """'Novo', 'Ativo', 'Em Risco', 'Churn' or 'Inativo' for one patient."""
+    start_of_month = today.replace(day=1)
+    if total_completed == 0:
+        # New registrations count as new until they have a visit
+        return 'Novo' if created_at.date() >= start_of_month else 'Inativo'
+    if first_visit >= start_of_month:
+        return 'Novo'
+    since_last = relativedelta(today, last_visit)
+    months_since_last = since_last.years * 12 + since_last.months
+    if months_since_last >= churn_months:
+        return 'Churn'
+    if months_since_last >= risk_months:
+        return 'Em Risco'
+    return 'Ativo'
+
+
+def bulk_loyalty_metrics(patients, today=None):
+    """
+    {patient_id: metrics} for the patients (a Patient queryset or iterable of
+    patients), with the same keys as Patient.get_loyalty_metrics.
+    The average interval between consecutive completed visits telescopes to
+    (last - first) / (visits - 1), so no per-visit rows are read.
+    """
+    today = today or timezone.now().date()
+    churn_months, risk_months = loyalty_thresholds()
+
+    if isinstance(patients, QuerySet):
+        created = dict(patients.order_by().values_list('id', 'created_at'))
+        scope = Q(patient__in=patients.order_by().values('id'))
+    else:
+        created = {patient.id: patient.created_at for patient in patients}
+        scope = Q(patient_id__in=list(created))
+    if not created:
+        return {}
+
+    counts = visit_totals(scope)
+
+    metrics = {}
+    for patient_id, created_at in created.items():
+        row = counts.get(patient_id)
+        total_completed = row['total_completed'] if row else 0
+        first_visit = row['first_visit'] if row else None
+        last_visit = row['last_visit'] if row else None
+        avg_interval = None
+        if total_completed > 1:
+            avg_interval = (last_visit - first_visit).days / (total_completed - 1)
+        no_show_rate = (row['no_shows'] / row['total'] * 100) if row and row['total'] else 0
+        metrics[patient_id] = {
+            'last_visit': last_visit,
+            'avg_interval': round(avg_interval, 1) if avg_interval is not None else None,
+            'total_completed': total_completed,
+            'status': loyalty_status(
+                total_completed, first_visit, last_visit, created_at, today, churn_months, risk_months
+            ),
+            'no_show_rate': round(no_show_rate, 1),
+        }
+    return metrics
+
+
+def attach_loyalty_metrics(patients, today=None):
+    """Evaluate patients into a list, setting patient.loyalty on each."""
+    patients = list(patients)
+    metrics = bulk_loyalty_metrics(patients, today=today)
+    for patient in patients:
+        patient.loyalty = metrics[patient.id]
+    return patients
+
+
+def sort_by_loyalty(rows, key):
+    """
+    Sort serialized patients (dicts with a 'loyalty' entry) in place by a
+    LOYALTY_SORT_KEYS key, '-key' for descending. Patients without a value
+    for the key go last either way.
+    """
+    descending = key.startswith('-')
+    field = key.lstrip('-')
+    if field == 'loyalty':
+        def value(row):
+            return LOYALTY_STATUSES.index(row['loyalty']['status'])
+    else:
+        def value(row):
+            return row['loyalty'][field]
+    present = [row for row in rows if value(row) is not None]
+    missing = [row for row in rows if value(row) is None]
+    present.sort(key=value, reverse=descending)
+    rows[:] = present + missing
+    return rows
+
@@ -0,0 +1,319 @@
+"""
+Django management command to benchmark the analytics endpoints as data grows.
+
+Runs against a throwaway test database (never the configured one): seeds a
+deterministic clinic at each appointment tier, calls every endpoint through
+the Django test client and records wall time, query count and peak Python
+memory per endpoint. Results are written as JSON; with --compare, the
+timings and query counts are also printed next to those of an earlier run.
+
+Tiers are prefixes of one seeded row stream, so a larger tier only inserts
+the rows it adds. Dates are laid out relative to today, so the "current
+month" endpoints always have data.
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+from math import gcd
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from dashboard.agenda_service import QueryCounter
+from dashboard.models import Appointment, AppointmentSettings, Clinic, Doctor, Expense, Income, Patient
+from dashboard.rollup_service import rebuild_monthly_stats
+from dashboard.visit_summary_service import reconcile_visit_summaries
+
+
+DEFAULT_TIERS = (10_000, 100_000, 1_000_000)
+# Seeded window: three years of history plus three months ahead
+HISTORY_DAYS = 3 * 365
+FUTURE_DAYS = 90
+# 15-minute slots from 07:00
+SLOTS_PER_DAY = 40
+APPOINTMENTS_PER_PATIENT = 8
+BATCH_SIZE = 5000
+
+
+def endpoint_requests(today):
+    """(name, url, params) of every benchmarked request."""
+    month_start = today.replace(day=1)
+    year_ago = today - timedelta(days=365)
+    week_start = today - timedelta(days=today.weekday())
+    report = reverse('dashboard:api_generate_report')
+    requests = [
+        ('indicators', reverse('dashboard:api_indicators'), {'period': 'year'}),
+        ('indicators_month', reverse('dashboard:api_indicators'), {'period': 'month'}),
+        ('quick_stats', reverse('dashboard:api_quick_stats'),
+         {'start_date': month_start.isoformat(), 'end_date': today.isoformat()}),
+        ('finance', reverse('dashboard:finance'), {'year': today.year, 'month': today.month}),
+        ('week_appointments', reverse('dashboard:api_week_appointments'),
+         {'start': week_start.isoformat(), 'end': (week_start + timedelta(days=6)).isoformat()}),
+    ]
+    for report_type in ('appointments', 'payment_methods', 'patient_summary', 'financial_summary', 'monthly_appointments'):
+        requests.append((f'report_{report_type}', report, {
+            'report_type': report_type, 'start_date': year_ago.isoformat(), 'end_date': today.isoformat(),
+        }))
+    return requests
+
+
+class Seeder:
+    """
+    Deterministic data set: row i of the stream always gets the same doctor,
+    slot, patient, status and payment, whatever the tier being built.
+    """
+
+    def __init__(self, doctors, seed, today):
+        self.doctor_count = doctors
+        self.today = today
+        self.first_day = today - timedelta(days=HISTORY_DAYS)
+        self.days = HISTORY_DAYS + FUTURE_DAYS
+        self.capacity = doctors * self.days * SLOTS_PER_DAY
+        # Stepping through the slots by a number coprime with their count
+        # visits every slot once, spread over doctors and days
+        self.step = 1_000_003
+        while gcd(self.step, self.capacity) != 1:
+            self.step += 2
+        self.rng = random.Random(seed)
+        self.seeded = 0
+        self.doctor_ids = []
+        self.patient_ids = []
+
+    def setup(self):
+        clinic = Clinic.objects.create(name='Clínica Benchmark')
+        for index in range(self.doctor_count):
+            user = User.objects.create_user(f'benchmark.dr{index}', first_name='Médico', last_name=str(index))
+            doctor = Doctor.objects.create(
+                user=user, clinic=clinic, medical_license=f'CRM-BENCH {index}',
+                specialization='Clínica Médica', is_clinic_admin=index == 0,
+            )
+            self.doctor_ids.append(doctor.id)
+        Doctor.objects.update(created_at=timezone.now() - timedelta(days=HISTORY_DAYS + 1))
+        AppointmentSettings.get_settings()
+        self.clinic = clinic
+        return Doctor.objects.get(id=self.doctor_ids[0])
+
+    def _add_patients(self, count):
+        patients = [
+            Patient(clinic=self.clinic, first_name='Paciente', last_name=str(index),
+                    date_of_birth=date(1950 + index % 60, index % 12 + 1, 1), gender='MF'[index % 2],
+                    phone=f'+55119{index:08d}')
+            for index in range(len(self.patient_ids), len(self.patient_ids) + count)
+        ]
+        for start in range(0, len(patients), BATCH_SIZE):
+            created = Patient.objects.bulk_create(patients[start:start + BATCH_SIZE])
+            self.patient_ids.extend(patient.id for patient in created)
+
+    def _row(self, index):
+        slot = index * self.step % self.capacity
+        doctor_id = self.doctor_ids[slot % self.doctor_count]
+        rest = slot // self.doctor_count
+        day = self.first_day + timedelta(days=rest % self.days)
+        minutes = 7 * 60 + (rest // self.days) * 15
+        patient_id = self.patient_ids[self.rng.randrange(index // APPOINTMENTS_PER_PATIENT + 1)]
+        roll = self.rng.random()
+        if day < self.today:
+            status = 'completed' if roll < 0.7 else 'no_show' if roll < 0.8 else 'cancelled' if roll < 0.92 else 'scheduled'
+        else:
+            status = 'scheduled' if roll < 0.6 else 'confirmed' if roll < 0.9 else 'cancelled'
+        payment_type = 'particular' if self.rng.random() < 0.45 else 'convenio'
+        duration = self.rng.choice((15, 30, 30, 45, 60))
+        return Appointment(
+            doctor_id=doctor_id, patient_id=patient_id, appointment_date=day,
+            appointment_time=f'{minutes // 60:02d}:{minutes % 60:02d}', duration_minutes=duration,
+            status=status, payment_type=payment_type,
+        )
+
+    def seed_to(self, total):
+        """Grow the data set to `total` appointments (with their incomes and expenses)."""
+        if total > self.capacity:
+            raise CommandError(f'{total} appointments do not fit in {self.capacity} slots; use more --doctors')
+        self._add_patients(total // APPOINTMENTS_PER_PATIENT + 1 - len(self.patient_ids))
+        while self.seeded < total:
+            batch = [self._row(index) for index in range(self.seeded, min(total, self.seeded + BATCH_SIZE))]
+            Appointment.objects.bulk_create(batch)
+            Income.objects.bulk_create([
+                Income(doctor_id=row.doctor_id, patient_id=row.patient_id, amount=Decimal('250.00'),
+                       description='Consulta', category='consultation', income_date=row.appointment_date)
+                for row in batch if row.status == 'completed' and row.payment_type == 'particular'
+            ])
+            self.seeded += len(batch)
+        # One expense per doctor and week of the window, whatever the tier
+        if not Expense.objects.exists():
+            Expense.objects.bulk_create([
+                Expense(doctor_id=doctor_id, amount=Decimal('180.00'), description='Material',
+                        category='medical_supplies', expense_date=self.first_day + timedelta(days=week * 7))
+                for doctor_id in self.doctor_ids for week in range(self.days // 7)
+            ], batch_size=BATCH_SIZE)
+        # bulk_create bypasses the signals that keep the side tables current
+        rebuild_monthly_stats()
+        reconcile_visit_summaries()
+
+
+def _consume(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def measure(client, url, params, repeat):
+    """Timings, query count and peak memory of one request, on a cold result cache."""
+    timings = []
+    for _run in range(repeat):
+        cache.clear()
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            response = client.get(url, params)
+            body = _consume(response)
+            timings.append((time.perf_counter() - started) * 1000)
+    # Peak memory on its own run: tracing slows the code it measures
+    cache.clear()
+    tracemalloc.start()
+    _consume(client.get(url, params))
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    error = None
+    if response.get('Content-Type', '').startswith('application/json'):
+        payload = json.loads(body)
+        if isinstance(payload, dict) and payload.get('success') is False:
+            # The JSON endpoints report failures with status 200
+            error = payload.get('error')
+    return {
+        'status': response.status_code,
+        'error': error,
+        'bytes': len(body),
+        'queries': counter.count,
+        'wall_ms': {
+            'min': round(min(timings), 2),
+            'median': round(statistics.median(timings), 2),
+            'max': round(max(timings), 2),
+        },
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the analytics endpoints (indicators, reports, quick stats, finance, week agenda) '
+            'on seeded data sets of growing size, in a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tiers', default=','.join(map(str, DEFAULT_TIERS)),
+                            help='Comma-separated appointment counts (default: %(default)s)')
+        parser.add_argument('--doctors', type=int, default=40, help='Doctors in the seeded clinic (default: 40)')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per endpoint (default: 3)')
+        parser.add_argument('--seed', type=int, default=2024, help='Random seed of the data set (default: 2024)')
+        parser.add_argument('--only', action='append', dest='only',
+                            help='Only benchmark this endpoint (repeatable), e.g. indicators, report_appointments')
+        parser.add_argument('--output', default='benchmark-results.json',
+                            help='JSON file for the results (default: %(default)s)')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+
+    def handle(self, *args, **options):
+        try:
+            tiers = sorted({int(tier) for tier in options['tiers'].split(',') if tier.strip()})
+        except ValueError:
+            raise CommandError('--tiers must be a comma-separated list of integers')
+        if not tiers or tiers[0] <= 0 or options['doctors'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--tiers, --doctors and --repeat must be positive')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = self._run(tiers, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as handle:
+            json.dump(results, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+        if baseline:
+            self._compare(baseline, results)
+
+    def _run(self, tiers, options):
+        today = timezone.localdate()
+        seeder = Seeder(options['doctors'], options['seed'], today)
+        admin = seeder.setup()
+        client = Client()
+        client.force_login(admin.user)
+        requests = [
+            request for request in endpoint_requests(today)
+            if not options['only'] or request[0] in options['only']
+        ]
+
+        results = {
+            'generated_at': timezone.now().isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'doctors': options['doctors'],
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'tiers': [],
+        }
+        for tier in tiers:
+            self.stdout.write(f'Seeding {tier} appointments...')
+            started = time.perf_counter()
+            seeder.seed_to(tier)
+            tier_result = {
+                'appointments': tier,
+                'patients': len(seeder.patient_ids),
+                'seed_seconds': round(time.perf_counter() - started, 1),
+                'endpoints': {},
+            }
+            for name, url, params in requests:
+                figures = measure(client, url, params, options['repeat'])
+                tier_result['endpoints'][name] = figures
+                self.stdout.write(
+                    f'  {name:<30} {figures["wall_ms"]["median"]:>10.1f} ms {figures["queries"]:>6} queries '
+                    f'{figures["peak_memory_kb"]:>10.0f} KB  [{figures["error"] or figures["status"]}]'
+                )
+            results['tiers'].append(tier_result)
+        return results
+
+    def _compare(self, baseline, results):
+        earlier = {tier['appointments']: tier['endpoints'] for tier in baseline.get('tiers', [])}
+        self.stdout.write(f'\nCompared with {baseline.get("revision") or "baseline"} '
+                          f'({baseline.get("generated_at", "?")}):')
+        for tier in results['tiers']:
+            before = earlier.get(tier['appointments'])
+            if not before:
+                continue
+            self.stdout.write(f'{tier["appointments"]} appointments')
+            for name, figures in tier['endpoints'].items():
+                if name not in before:
+                    continue
+                old_ms = before[name]['wall_ms']['median']
+                new_ms = figures['wall_ms']['median']
+                ratio = new_ms / old_ms if old_ms else float('inf')
+                line = (f'  {name:<30} {old_ms:>10.1f} -> {new_ms:>10.1f} ms (x{ratio:.2f})  '
+                        f'{before[name]["queries"]:>6} -> {figures["queries"]:<6} queries')
+                style = self.style.ERROR if ratio > 1.2 or figures['queries'] > before[name]['queries'] else None
+                self.stdout.write(style(line) if style else line)
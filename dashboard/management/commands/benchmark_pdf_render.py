@@ -0,0 +1,123 @@
+"""
+Django management command to micro-benchmark the PDF renderers.
+
+Renders a prescription and the PDF reports in a throwaway test database
+(never the configured one), twice per document: "cold", with the shared
+ReportLab style registry (see dashboard.pdf_styles) cleared before every
+render, which is what each render used to pay when it built its own styles,
+and "warm", reusing the registry as the endpoints do. Prints the per-PDF
+render time of both, and the time spent building the registry itself.
+"""
+import importlib.util
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+
+from dashboard.models import Appointment, Clinic, Doctor, Patient, Prescription, PrescriptionItem
+from dashboard.pdf_styles import pdf_styles, table_styles
+from dashboard.prescription_pdf_service import render_prescription_pdf
+from dashboard.report_service import render_report_pdf
+
+
+def _clear_registry():
+    pdf_styles.cache_clear()
+    table_styles.cache_clear()
+
+
+def _median_ms(func, repeat, cold):
+    timings = []
+    for _run in range(repeat):
+        if cold:
+            _clear_registry()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = ('Micro-benchmark the prescription and report PDF renderers with the shared ReportLab '
+            'style registry cold (rebuilt per render) and warm, in a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help='Renders per document and mode (default: 50)')
+        parser.add_argument('--items', type=int, default=5, help='Medications on the prescription (default: 5)')
+        parser.add_argument('--appointments', type=int, default=30,
+                            help='Completed appointments listed by the reports (default: 30)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0 or options['items'] <= 0 or options['appointments'] < 0:
+            raise CommandError('--repeat and --items must be positive, --appointments not negative')
+        if importlib.util.find_spec('reportlab') is None:
+            raise CommandError('reportlab is not installed. Run: pip install reportlab')
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self._run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def _seed(self, options):
+        today = timezone.localdate()
+        clinic = Clinic.objects.create(name='Clínica Benchmark')
+        user = User.objects.create_user('benchmark.pdf', first_name='Médico', last_name='Benchmark')
+        doctor = Doctor.objects.create(
+            user=user, clinic=clinic, medical_license='CRM-BENCH 1', specialization='cardiology',
+        )
+        patient = Patient.objects.create(
+            clinic=clinic, first_name='Paciente', last_name='Benchmark', cpf='000.000.000-00',
+            date_of_birth=date(1980, 5, 17), gender='F', phone='+5511900000000',
+        )
+        prescription = Prescription.objects.create(
+            patient=patient, doctor=doctor, notes='Retornar em 30 dias com os exames.',
+        )
+        PrescriptionItem.objects.bulk_create([
+            PrescriptionItem(
+                prescription=prescription, medication_name=f'Medicamento {index + 1} 500mg',
+                quantity='1 caixa', dosage='1 comprimido de 8 em 8 horas por 7 dias', notes='Após as refeições',
+            )
+            for index in range(options['items'])
+        ])
+        Appointment.objects.bulk_create([
+            Appointment(
+                doctor=doctor, patient=patient, appointment_date=today - timedelta(days=index + 1),
+                appointment_time='09:00', duration_minutes=30, status='completed',
+                payment_type='particular' if index % 2 else 'convenio', value=Decimal('250.00'),
+            )
+            for index in range(options['appointments'])
+        ])
+        prescription = Prescription.objects.select_related(
+            'patient', 'doctor', 'doctor__user'
+        ).prefetch_related('items').get(id=prescription.id)
+        return doctor, prescription, today
+
+    def _run(self, options):
+        doctor, prescription, today = self._seed(options)
+        start_date = today - timedelta(days=options['appointments'] + 1)
+        documents = [('prescription', lambda: render_prescription_pdf(prescription))]
+        for report_type in ('appointments', 'financial_summary'):
+            documents.append((
+                f'report_{report_type}',
+                lambda report_type=report_type: render_report_pdf(doctor, report_type, start_date, today),
+            ))
+
+        repeat = options['repeat']
+        self.stdout.write(f'{"document":<28} {"cold ms":>10} {"warm ms":>10} {"saved":>8}')
+        for name, render in documents:
+            # One untimed render loads the fonts and modules both modes share
+            render()
+            cold = _median_ms(render, repeat, cold=True)
+            warm = _median_ms(render, repeat, cold=False)
+            saved = (cold - warm) / cold * 100 if cold else 0
+            self.stdout.write(f'{name:<28} {cold:>10.2f} {warm:>10.2f} {saved:>7.1f}%')
+
+        build = _median_ms(lambda: (pdf_styles(), table_styles()), repeat, cold=True)
+        self.stdout.write(f'\nBuilding the style registry: {build:.2f} ms (median of {repeat})')
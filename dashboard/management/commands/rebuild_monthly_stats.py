@@ -0,0 +1,30 @@
+"""
+Django management command to rebuild the per-(doctor, month) rollups
+(DoctorMonthlyStats) from the appointment and income tables.
+The rollups are normally kept current on every write; run this after bulk
+imports or raw SQL changes that bypass the application.
+"""
+from django.core.management.base import BaseCommand
+
+from dashboard.models import Doctor
+from dashboard.rollup_service import rebuild_monthly_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly doctor KPI rollups (DoctorMonthlyStats) from appointments and incomes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor-id', type=int, action='append', dest='doctor_ids',
+                            help='Only rebuild this doctor (repeatable). Default: all doctors')
+
+    def handle(self, *args, **options):
+        doctor_ids = options.get('doctor_ids')
+        if doctor_ids:
+            missing = set(doctor_ids) - set(Doctor.objects.filter(id__in=doctor_ids).values_list('id', flat=True))
+            if missing:
+                self.stdout.write(self.style.ERROR(f'Doctor(s) not found: {", ".join(map(str, sorted(missing)))}'))
+                return
+
+        rows = rebuild_monthly_stats(doctor_ids)
+        scope = f'{len(doctor_ids)} doctor(s)' if doctor_ids else 'all doctors'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} monthly rollup row(s) for {scope}.'))
@@ -0,0 +1,28 @@
+"""
+Django management command to check the per-(patient, doctor) visit
+summaries (PatientVisitSummary) against the appointment table and repair
+any drift. The summaries are normally kept current on every appointment
+write; run this after bulk imports or raw SQL changes, or periodically.
+"""
+from django.core.management.base import BaseCommand
+
+from dashboard.visit_summary_service import reconcile_visit_summaries
+
+
+class Command(BaseCommand):
+    help = 'Reconcile patient visit summaries (PatientVisitSummary) with the appointments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the differences, without fixing them')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        result = reconcile_visit_summaries(fix=not dry_run)
+        summary = f"{result['missing']} missing, {result['stale']} stale, {result['orphaned']} orphaned"
+        if not any(result.values()):
+            self.stdout.write(self.style.SUCCESS('Visit summaries are in sync.'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'Out of sync: {summary} (dry run, nothing changed).'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired visit summaries: {summary}.'))
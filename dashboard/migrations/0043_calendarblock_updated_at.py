@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0042_appointmentsettings_churn_risk_months_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarblock',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0043_calendarblock_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bulk_cancel', 'Cancelamento em massa')], help_text='Type of job', max_length=30)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('running', 'Em Andamento'), ('completed', 'Concluído'), ('failed', 'Falhou')], default='pending', help_text='Current status of the job', max_length=20)),
+                ('params', models.JSONField(blank=True, default=dict, help_text='Parameters the job was submitted with')),
+                ('progress', models.PositiveIntegerField(default=0, help_text='Items processed so far')),
+                ('total', models.PositiveIntegerField(default=0, help_text='Total items to process')),
+                ('result', models.JSONField(blank=True, default=dict, help_text='Job output (counts, messages, file references)')),
+                ('error', models.TextField(blank=True, help_text='Error message when the job failed', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, help_text='User who submitted the job', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='background_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Background Job',
+                'verbose_name_plural': 'Background Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['kind', 'status'], name='dashboard_b_kind_b01894_idx'), models.Index(fields=['created_by'], name='dashboard_b_created_f5f772_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0044_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('total_appointments', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('no_show_count', models.PositiveIntegerField(default=0)),
+                ('cancelled_count', models.PositiveIntegerField(default=0)),
+                ('particular_count', models.PositiveIntegerField(default=0)),
+                ('convenio_count', models.PositiveIntegerField(default=0)),
+                ('unique_patients', models.PositiveIntegerField(default=0)),
+                ('returning_patients', models.PositiveIntegerField(default=0, help_text='Patients with more than one appointment in the month')),
+                ('completed_particular_count', models.PositiveIntegerField(default=0)),
+                ('completed_convenio_count', models.PositiveIntegerField(default=0)),
+                ('completed_unique_patients', models.PositiveIntegerField(default=0)),
+                ('completed_duration_minutes', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(help_text='Doctor the figures belong to', on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='dashboard.doctor')),
+            ],
+            options={
+                'verbose_name': 'Doctor Monthly Stats',
+                'verbose_name_plural': 'Doctor Monthly Stats',
+                'ordering': ['-month', 'doctor'],
+                'indexes': [models.Index(fields=['month'], name='dashboard_d_month_6aeff1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'month'), name='unique_doctor_month_stats')],
+            },
+        ),
+    ]
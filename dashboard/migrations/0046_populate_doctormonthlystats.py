@@ -0,0 +1,72 @@
+# Data migration: build DoctorMonthlyStats from the existing appointments and incomes
+# (same figures as dashboard.rollup_service.rebuild_monthly_stats, on historical models)
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def _empty():
+    return {
+        'total_appointments': 0, 'completed_count': 0, 'no_show_count': 0, 'cancelled_count': 0,
+        'particular_count': 0, 'convenio_count': 0, 'completed_particular_count': 0,
+        'completed_convenio_count': 0, 'completed_duration_minutes': 0, 'unique_patients': 0,
+        'returning_patients': 0, 'completed_unique_patients': 0, 'revenue': Decimal('0'),
+    }
+
+
+def populate_monthly_stats(apps, schema_editor):
+    Appointment = apps.get_model('dashboard', 'Appointment')
+    Income = apps.get_model('dashboard', 'Income')
+    DoctorMonthlyStats = apps.get_model('dashboard', 'DoctorMonthlyStats')
+
+    completed = Q(status='completed')
+    appointments = Appointment.objects.annotate(month=TruncMonth('appointment_date'))
+    rows = defaultdict(_empty)
+    for row in appointments.values('doctor_id', 'month').annotate(
+        total_appointments=Count('id'),
+        completed_count=Count('id', filter=completed),
+        no_show_count=Count('id', filter=Q(status='no_show')),
+        cancelled_count=Count('id', filter=Q(status='cancelled')),
+        particular_count=Count('id', filter=Q(payment_type='particular')),
+        convenio_count=Count('id', filter=Q(payment_type='convenio')),
+        completed_particular_count=Count('id', filter=completed & Q(payment_type='particular')),
+        completed_convenio_count=Count('id', filter=completed & Q(payment_type='convenio')),
+        completed_duration_minutes=Sum('duration_minutes', filter=completed),
+        unique_patients=Count('patient', distinct=True),
+        completed_unique_patients=Count('patient', distinct=True, filter=completed),
+    ):
+        key = (row.pop('doctor_id'), row.pop('month'))
+        rows[key].update({field: value or 0 for field, value in row.items()})
+    for key in appointments.values('doctor_id', 'month', 'patient_id').annotate(
+        visits=Count('id')
+    ).filter(visits__gt=1).values_list('doctor_id', 'month'):
+        rows[key]['returning_patients'] += 1
+    for doctor_id, month, revenue in Income.objects.annotate(month=TruncMonth('income_date')).values(
+        'doctor_id', 'month'
+    ).annotate(revenue=Sum('amount')).values_list('doctor_id', 'month', 'revenue'):
+        rows[(doctor_id, month)]['revenue'] = revenue or Decimal('0')
+
+    DoctorMonthlyStats.objects.bulk_create(
+        [DoctorMonthlyStats(doctor_id=doctor_id, month=month, **figures)
+         for (doctor_id, month), figures in rows.items()],
+        batch_size=500,
+    )
+
+
+def clear_monthly_stats(apps, schema_editor):
+    apps.get_model('dashboard', 'DoctorMonthlyStats').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0045_doctormonthlystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_monthly_stats, clear_monthly_stats),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0046_populate_doctormonthlystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientVisitSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_visit', models.DateField(blank=True, help_text='First appointment, any status', null=True)),
+                ('first_completed_visit', models.DateField(blank=True, null=True)),
+                ('last_completed_visit', models.DateField(blank=True, null=True)),
+                ('total_appointments', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('no_show_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(help_text='Doctor the appointments were with', on_delete=django.db.models.deletion.CASCADE, related_name='patient_visit_summaries', to='dashboard.doctor')),
+                ('patient', models.ForeignKey(help_text='Patient the summary belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='visit_summaries', to='dashboard.patient')),
+            ],
+            options={
+                'verbose_name': 'Patient Visit Summary',
+                'verbose_name_plural': 'Patient Visit Summaries',
+                'ordering': ['patient', 'doctor'],
+                'indexes': [models.Index(fields=['doctor', 'last_completed_visit'], name='dashboard_p_doctor__dbcc14_idx'), models.Index(fields=['doctor', 'first_visit'], name='dashboard_p_doctor__bfa9c9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'doctor'), name='unique_patient_doctor_visit_summary')],
+            },
+        ),
+    ]
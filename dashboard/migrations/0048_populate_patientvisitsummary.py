@@ -0,0 +1,39 @@
+# Data migration: build PatientVisitSummary from the existing appointments
+# (same figures as dashboard.visit_summary_service.reconcile_visit_summaries, on historical models)
+
+from django.db import migrations
+from django.db.models import Count, Max, Min, Q
+
+
+def populate_visit_summaries(apps, schema_editor):
+    Appointment = apps.get_model('dashboard', 'Appointment')
+    PatientVisitSummary = apps.get_model('dashboard', 'PatientVisitSummary')
+
+    completed = Q(status='completed')
+    rows = Appointment.objects.order_by().values('patient_id', 'doctor_id').annotate(
+        first_visit=Min('appointment_date'),
+        first_completed_visit=Min('appointment_date', filter=completed),
+        last_completed_visit=Max('appointment_date', filter=completed),
+        total_appointments=Count('id'),
+        completed_count=Count('id', filter=completed),
+        no_show_count=Count('id', filter=Q(status='no_show')),
+    )
+    PatientVisitSummary.objects.bulk_create(
+        [PatientVisitSummary(**row) for row in rows],
+        batch_size=500,
+    )
+
+
+def clear_visit_summaries(apps, schema_editor):
+    apps.get_model('dashboard', 'PatientVisitSummary').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0047_patientvisitsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_visit_summaries, clear_visit_summaries),
+    ]
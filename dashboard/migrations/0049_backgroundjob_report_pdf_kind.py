@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0048_populate_patientvisitsummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('bulk_cancel', 'Cancelamento em massa'), ('report_pdf', 'Relatório PDF')], help_text='Type of job', max_length=30),
+        ),
+    ]
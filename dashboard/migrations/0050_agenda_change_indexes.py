@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0049_backgroundjob_report_pdf_kind'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'updated_at'], name='dashboard_a_doctor__6e13af_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calendarblock',
+            index=models.Index(fields=['doctor', 'updated_at'], name='dashboard_c_doctor__1a0c1b_idx'),
+        ),
+    ]
@@ -176,73 +176,8 @@ class Patient(models.Model):
         - total_completed: total number of completed appointments
         - loyalty_status: 'Novo', 'Ativo', 'Em Risco', 'Churn'
         """
-        from datetime import date
-        from django.utils import timezone
-        from dateutil.relativedelta import relativedelta
-        
-        completed_appointments = self.appointments.filter(status='completed').order_by('appointment_date')
-        total_completed = completed_appointments.count()
-        
-        last_visit = None
-        avg_interval = None
-        
-        if total_completed > 0:
-            last_visit = completed_appointments.last().appointment_date
-            
-            if total_completed > 1:
-                intervals = []
-                prev_date = None
-                for appt in completed_appointments:
-                    if prev_date:
-                        intervals.append((appt.appointment_date - prev_date).days)
-                    prev_date = appt.appointment_date
-                if intervals:
-                    avg_interval = sum(intervals) / len(intervals)
-
-        # Get settings for churn
-        settings = AppointmentSettings.objects.first()
-        churn_months = settings.churn_threshold_months if settings else 12
-        risk_months = settings.churn_risk_months if settings else 6
-        
-        today = timezone.now().date()
-        
-        # Determine Status
-        status = 'Inativo' # Default if no appointments
-        
-        if total_completed == 0:
-            # Check if created recently
-            if self.created_at.date() >= today.replace(day=1):
-                status = 'Novo'
-            else:
-                status = 'Inativo'
-        else:
-            # Check if first ever appointment was this month
-            first_visit = completed_appointments.first().appointment_date
-            if first_visit >= today.replace(day=1):
-                status = 'Novo'
-            else:
-                months_since_last = relativedelta(today, last_visit).years * 12 + relativedelta(today, last_visit).months
-                
-                if months_since_last >= churn_months:
-                    status = 'Churn'
-                elif months_since_last >= risk_months:
-                    status = 'Em Risco'
-                else:
-                    status = 'Ativo'
-                    
-        # No-show Rate
-        all_appts = self.appointments.all()
-        total_appts = all_appts.count()
-        no_show_count = all_appts.filter(status='no_show').count()
-        no_show_rate = (no_show_count / total_appts * 100) if total_appts > 0 else 0
-
-        return {
-            'last_visit': last_visit,
-            'avg_interval': round(avg_interval, 1) if avg_interval is not None else None,
-            'total_completed': total_completed,
-            'status': status,
-            'no_show_rate': round(no_show_rate, 1)
-        }
+        from .loyalty_service import bulk_loyalty_metrics
+        return bulk_loyalty_metrics([self])[self.id]
 
     @property
     def age(self):
@@ -733,6 +668,8 @@ class Appointment(models.Model):
             models.Index(fields=['doctor']),
             models.Index(fields=['status']),
             models.Index(fields=['appointment_type']),
+            # Latest change of a doctor's agenda (agenda_service.get_calendar_feed_state)
+            models.Index(fields=['doctor', 'updated_at']),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -833,6 +770,7 @@ class CalendarBlock(models.Model):
         help_text="Optional reason (e.g. Folga, Congresso)"
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Calendar Block"
@@ -841,6 +779,7 @@ class CalendarBlock(models.Model):
         indexes = [
             models.Index(fields=['doctor']),
             models.Index(fields=['start', 'end']),
+            models.Index(fields=['doctor', 'updated_at']),
         ]
 
     def __str__(self):
@@ -2035,4 +1974,199 @@ class WhatsAppConversation(models.Model):
         self.patient = None
         self.appointment = None
         self.context = {}
-        self.save()
\ No newline at end of file
+        self.save()
+
+class BackgroundJob(models.Model):
+    """
+    Long-running task executed outside the request thread (see dashboard.jobs).
+    State is kept in the database so any worker process can answer status polls.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pendente'),
+        ('running', 'Em Andamento'),
+        ('completed', 'Concluído'),
+        ('failed', 'Falhou'),
+    ]
+
+    KIND_CHOICES = [
+        ('bulk_cancel', 'Cancelamento em massa'),
+        ('report_pdf', 'Relatório PDF'),
+    ]
+
+    kind = models.CharField(
+        max_length=30,
+        choices=KIND_CHOICES,
+        help_text="Type of job"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        help_text="Current status of the job"
+    )
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='background_jobs',
+        help_text="User who submitted the job"
+    )
+    params = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Parameters the job was submitted with"
+    )
+    progress = models.PositiveIntegerField(default=0, help_text="Items processed so far")
+    total = models.PositiveIntegerField(default=0, help_text="Total items to process")
+    result = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Job output (counts, messages, file references)"
+    )
+    error = models.TextField(blank=True, null=True, help_text="Error message when the job failed")
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Background Job"
+        verbose_name_plural = "Background Jobs"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['kind', 'status']),
+            models.Index(fields=['created_by']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100 if self.status == 'completed' else 0
+        return round(self.progress * 100 / self.total)
+
+    def set_progress(self, progress, total=None):
+        """Persist progress without touching the other fields."""
+        self.progress = progress
+        fields = ['progress', 'updated_at']
+        if total is not None:
+            self.total = total
+            fields.append('total')
+        self.save(update_fields=fields)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'percent': self.percent,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class DoctorMonthlyStats(models.Model):
+    """
+    Per-(doctor, month) rollup of appointment and income figures.
+    Kept current on every appointment/income write (see dashboard.rollup_service)
+    and rebuilt in full by the rebuild_monthly_stats management command.
+    """
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name='monthly_stats',
+        help_text="Doctor the figures belong to"
+    )
+    month = models.DateField(help_text="First day of the month")
+
+    # Appointments in the month (all statuses)
+    total_appointments = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    no_show_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    particular_count = models.PositiveIntegerField(default=0)
+    convenio_count = models.PositiveIntegerField(default=0)
+    unique_patients = models.PositiveIntegerField(default=0)
+    returning_patients = models.PositiveIntegerField(
+        default=0,
+        help_text="Patients with more than one appointment in the month"
+    )
+
+    # Completed appointments only
+    completed_particular_count = models.PositiveIntegerField(default=0)
+    completed_convenio_count = models.PositiveIntegerField(default=0)
+    completed_unique_patients = models.PositiveIntegerField(default=0)
+    completed_duration_minutes = models.PositiveIntegerField(default=0)
+
+    # Income rows dated in the month
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Doctor Monthly Stats"
+        verbose_name_plural = "Doctor Monthly Stats"
+        ordering = ['-month', 'doctor']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'month'], name='unique_doctor_month_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['month']),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.month.strftime('%m/%Y')}"
+
+
+class PatientVisitSummary(models.Model):
+    """
+    Per-(patient, doctor) visit summary: first visit, first/last completed
+    visit and appointment counts. Kept current on every appointment write
+    (see dashboard.visit_summary_service) and checked/repaired by the
+    reconcile_visit_summaries management command.
+    """
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name='visit_summaries',
+        help_text="Patient the summary belongs to"
+    )
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name='patient_visit_summaries',
+        help_text="Doctor the appointments were with"
+    )
+
+    first_visit = models.DateField(null=True, blank=True, help_text="First appointment, any status")
+    first_completed_visit = models.DateField(null=True, blank=True)
+    last_completed_visit = models.DateField(null=True, blank=True)
+    total_appointments = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    no_show_count = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Patient Visit Summary"
+        verbose_name_plural = "Patient Visit Summaries"
+        ordering = ['patient', 'doctor']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'doctor'], name='unique_patient_doctor_visit_summary'),
+        ]
+        indexes = [
+            # Churn / at-risk lists: range scans on a doctor's last completed visits
+            models.Index(fields=['doctor', 'last_completed_visit']),
+            models.Index(fields=['doctor', 'first_visit']),
+        ]
+
+    def __str__(self):
+        return f"{self.patient} - {self.doctor}"
@@ -0,0 +1,170 @@
+"""
+ReportLab styles shared by the PDF documents (prescriptions and reports).
+
+getSampleStyleSheet() and the documents' own paragraph and table styles are
+built once per process, on first use, instead of on every render. Documents
+only read them. Flowables (paragraphs, tables, spacers) are still created
+per document: they keep layout state while a document is built, and reports
+are rendered concurrently on the job pool.
+
+reportlab is imported on first use, so callers keep raising ImportError when
+it is not installed.
+"""
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def pdf_styles():
+    """
+    The sample stylesheet extended with the documents' paragraph styles,
+    looked up by name (styles['PrescriptionTitle'], styles['Normal'], ...).
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    styles = getSampleStyleSheet()
+
+    # Prescriptions
+    styles.add(ParagraphStyle(
+        'PrescriptionTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1a5490'),
+        spaceAfter=20,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    ))
+    styles.add(ParagraphStyle(
+        'PrescriptionHeader',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#2c3e50'),
+        spaceAfter=10,
+        fontName='Helvetica-Bold'
+    ))
+    styles.add(ParagraphStyle(
+        'PrescriptionInfo',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#333333'),
+        spaceAfter=8,
+        leading=14
+    ))
+    styles.add(ParagraphStyle(
+        'MedicationName',
+        parent=styles['Normal'],
+        fontSize=12,
+        textColor=colors.HexColor('#1a5490'),
+        spaceAfter=5,
+        fontName='Helvetica-Bold',
+        leading=16
+    ))
+    styles.add(ParagraphStyle(
+        'MedicationDetail',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#555555'),
+        spaceAfter=4,
+        leftIndent=20,
+        leading=14
+    ))
+    styles.add(ParagraphStyle(
+        'PrescriptionNotes',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#666666'),
+        spaceAfter=8,
+        alignment=TA_JUSTIFY,
+        leading=14
+    ))
+    styles.add(ParagraphStyle(
+        'DateStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#666666'),
+        spaceAfter=20,
+        alignment=TA_RIGHT
+    ))
+    styles.add(ParagraphStyle(
+        'Signature',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#666666'),
+        alignment=TA_CENTER,
+        spaceAfter=0
+    ))
+
+    # Reports
+    styles.add(ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1a1a1a'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    ))
+    styles.add(ParagraphStyle(
+        'CustomHeader',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#2c3e50'),
+        spaceAfter=12
+    ))
+    return styles
+
+
+@lru_cache(maxsize=None)
+def table_styles():
+    """The documents' TableStyles by name; Table.setStyle copies their commands."""
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return {
+        # Prescriptions: rule under the title, patient/doctor header, signature line
+        'title_rule': TableStyle([
+            ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor('#1a5490')),
+            ('TOPPADDING', (0, 0), (-1, -1), 0),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+        ]),
+        'header_panel': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#fafafa')),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#333333')),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 11),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ('TOPPADDING', (0, 0), (-1, -1), 12),
+            ('LEFTPADDING', (0, 0), (-1, -1), 15),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 15),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LINEBELOW', (0, 0), (-1, -1), 0.5, colors.HexColor('#e0e0e0')),
+            ('LINEBETWEEN', (0, 0), (0, -1), 0.5, colors.HexColor('#e0e0e0')),
+        ]),
+        'signature_line': TableStyle([
+            ('LINEABOVE', (0, 0), (-1, -1), 1, colors.HexColor('#333333')),
+            ('TOPPADDING', (0, 0), (-1, -1), 30),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+        ]),
+        # Reports: appointment list and the two-column amount tables
+        'appointment_list': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ]),
+        'amounts': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ]),
+    }
@@ -0,0 +1,278 @@
+"""
+Prescription PDFs, rendered once per version of the prescription.
+
+A rendered document is kept in the default storage under a digest of
+everything it prints (prescription, items, patient and doctor header) and
+of the template version, so opening, printing or re-sending an unchanged
+prescription reads the stored file instead of running ReportLab again. The
+digest doubles as the ETag of the download. Editing the prescription or its
+items drops its stored files (see signals); other edits, such as a renamed
+patient, simply produce a new digest.
+"""
+import hashlib
+import json
+import logging
+import threading
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .pdf_styles import pdf_styles, table_styles
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the document layout changes so that stored files are not reused
+PRESCRIPTION_PDF_TEMPLATE_VERSION = 1
+PRESCRIPTION_PDF_DIR = 'prescriptions/pdf'
+
+# Specialization labels printed in the doctor header
+SPECIALIZATION_LABELS = {
+    'general_practice': 'Clínica Geral',
+    'cardiology': 'Cardiologia',
+    'dermatology': 'Dermatologia',
+    'gynecology': 'Ginecologia e Obstetrícia',
+    'neurology': 'Neurologia',
+    'orthopedics': 'Ortopedia e Traumatologia',
+    'pediatrics': 'Pediatria',
+    'psychiatry': 'Psiquiatria',
+    'endocrinology': 'Endocrinologia',
+    'gastroenterology': 'Gastroenterologia',
+    'ophthalmology': 'Oftalmologia',
+    'otorhinolaryngology': 'Otorrinolaringologia',
+    'urology': 'Urologia',
+    'rheumatology': 'Reumatologia',
+    'oncology': 'Oncologia',
+    'surgery': 'Cirurgia Geral',
+    'internal_medicine': 'Medicina Interna',
+    'infectology': 'Infectologia',
+    'nephrology': 'Nefrologia',
+    'hematology': 'Hematologia',
+}
+
+
+def prescription_pdf_digest(prescription):
+    """Digest of every value the prescription's PDF prints; items must be prefetched."""
+    patient, doctor = prescription.patient, prescription.doctor
+    fingerprint = [
+        PRESCRIPTION_PDF_TEMPLATE_VERSION,
+        prescription.id, prescription.prescription_date, prescription.notes,
+        # The age is printed, so the document also changes on the patient's birthday
+        patient.full_name, patient.cpf, patient.age if patient.date_of_birth else None,
+        doctor.full_name, doctor.medical_license, doctor.specialization,
+        [(item.medication_name, item.quantity, item.dosage, item.notes) for item in prescription.items.all()],
+    ]
+    return hashlib.sha256(json.dumps(fingerprint, default=str).encode('utf-8')).hexdigest()
+
+
+def prescription_pdf_etag(digest):
+    return f'"{digest}"'
+
+
+def prescription_pdf_filename(prescription):
+    """Download file name of a prescription's PDF."""
+    return f"prescricao_{prescription.patient.full_name.replace(' ', '_')}_{prescription.prescription_date.strftime('%Y%m%d')}.pdf"
+
+
+def render_prescription_pdf(prescription):
+    """The prescription's PDF document as bytes; items must be prefetched."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch, cm
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer, KeepTogether
+    from io import BytesIO
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=2*cm,
+        leftMargin=2*cm,
+        topMargin=2*cm,
+        bottomMargin=2*cm
+    )
+
+    # Container for the PDF elements
+    story = []
+    styles = pdf_styles()
+    title_style = styles['PrescriptionTitle']
+    header_style = styles['PrescriptionHeader']
+    info_style = styles['PrescriptionInfo']
+    medication_name_style = styles['MedicationName']
+    medication_detail_style = styles['MedicationDetail']
+    notes_style = styles['PrescriptionNotes']
+    table_style = table_styles()
+
+    # Header with decorative line
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph("PRESCRIÇÃO MÉDICA", title_style))
+
+    # Decorative line
+    line_data = [['']]
+    line_table = Table(line_data, colWidths=[6*inch])
+    line_table.setStyle(table_style['title_rule'])
+    story.append(line_table)
+    story.append(Spacer(1, 0.25*inch))
+
+    # Date and Prescription Number - Minimalist at top
+    date_text = f"{prescription.prescription_date.strftime('%d/%m/%Y')} • Prescrição Nº {prescription.id}"
+    story.append(Paragraph(date_text, styles['DateStyle']))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Patient and Doctor Information — side-by-side layout
+    patient_info = f"<b>PACIENTE</b><br/>{prescription.patient.full_name}"
+    if prescription.patient.cpf:
+        patient_info += f"<br/><font size='9' color='#999999'>CPF: {prescription.patient.cpf}</font>"
+    if prescription.patient.date_of_birth:
+        age = prescription.patient.age
+        if age is not None:
+            patient_info += f"<br/><font size='9' color='#999999'>Idade: {age} anos</font>"
+
+    spec_raw = prescription.doctor.specialization or ''
+    spec_display = SPECIALIZATION_LABELS.get(spec_raw.lower().replace(' ', '_'), spec_raw)
+
+    doctor_info = f"<b>MÉDICO</b><br/>{prescription.doctor.full_name}"
+    if prescription.doctor.medical_license:
+        doctor_info += f"<br/><font size='9' color='#999999'>CRM: {prescription.doctor.medical_license}</font>"
+    if spec_display:
+        doctor_info += f"<br/><font size='9' color='#999999'>{spec_display}</font>"
+
+    combined_row = Table(
+        [[Paragraph(patient_info, info_style), Paragraph(doctor_info, info_style)]],
+        colWidths=[3*inch, 3*inch]
+    )
+    combined_row.setStyle(table_style['header_panel'])
+    story.append(combined_row)
+    story.append(Spacer(1, 0.4*inch))
+
+    # Medications section
+    story.append(Paragraph("MEDICAMENTOS PRESCRITOS", header_style))
+    story.append(Spacer(1, 0.2*inch))
+
+    # Medication items
+    items = list(prescription.items.all())
+    for idx, item in enumerate(items, 1):
+        medication_block = []
+
+        # Medication name with number
+        med_name = f"{idx}. {item.medication_name}"
+        medication_block.append(Paragraph(med_name, medication_name_style))
+
+        # Quantity
+        if item.quantity:
+            medication_block.append(Paragraph(f"<b>Quantidade:</b> {item.quantity}", medication_detail_style))
+
+        # Dosage
+        if item.dosage:
+            medication_block.append(Paragraph(f"<b>Posologia:</b> {item.dosage}", medication_detail_style))
+
+        # Notes
+        if item.notes:
+            medication_block.append(Paragraph(f"<b>Observações:</b> {item.notes}", medication_detail_style))
+
+        # Add spacing between medications
+        if idx < len(items):
+            medication_block.append(Spacer(1, 0.15*inch))
+
+        # Keep medication together
+        story.append(KeepTogether(medication_block))
+
+    # Additional notes section
+    if prescription.notes:
+        story.append(Spacer(1, 0.3*inch))
+        story.append(Paragraph("OBSERVAÇÕES GERAIS", header_style))
+        story.append(Spacer(1, 0.15*inch))
+        story.append(Paragraph(prescription.notes, notes_style))
+
+    # Footer with signature area
+    story.append(Spacer(1, 0.5*inch))
+
+    # Signature line
+    signature_data = [['']]
+    signature_table = Table(signature_data, colWidths=[6*inch])
+    signature_table.setStyle(table_style['signature_line'])
+    story.append(signature_table)
+
+    signature_text = Paragraph(
+        f"<i>{prescription.doctor.full_name}<br/>CRM: {prescription.doctor.medical_license or 'N/A'}</i>",
+        styles['Signature']
+    )
+    story.append(signature_text)
+
+    # Build PDF
+    doc.build(story)
+
+    # Get PDF data
+    buffer.seek(0)
+    pdf_data = buffer.getvalue()
+    buffer.close()
+
+    return pdf_data
+
+
+def _prescription_dir(prescription_id):
+    return f'{PRESCRIPTION_PDF_DIR}/{prescription_id}'
+
+
+def stored_prescription_pdf(prescription, digest=None):
+    """
+    (digest, pdf_data) of the prescription's PDF: read from the default
+    storage, or rendered and stored (replacing the prescription's older
+    versions) on the first request for this digest. The storage is only a
+    cache: when it fails, the document is rendered and served anyway.
+    """
+    digest = digest or prescription_pdf_digest(prescription)
+    name = f'{_prescription_dir(prescription.id)}/{digest}.pdf'
+    # One storage round trip when the document is stored: open it directly
+    try:
+        with default_storage.open(name, 'rb') as stored:
+            return digest, stored.read()
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception("Could not read the stored prescription PDF %s", name)
+    pdf_data = render_prescription_pdf(prescription)
+    try:
+        purge_prescription_pdfs(prescription.id, keep=f'{digest}.pdf')
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(pdf_data))
+    except Exception:
+        logger.exception("Could not store the prescription PDF %s", name)
+    return digest, pdf_data
+
+
+def purge_prescription_pdfs(prescription_id, keep=None):
+    """Delete the stored PDFs of a prescription, except the file named keep."""
+    directory = _prescription_dir(prescription_id)
+    try:
+        _dirs, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        if filename != keep:
+            default_storage.delete(f'{directory}/{filename}')
+
+
+_pending = threading.local()
+
+
+def _pending_ids():
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    return _pending.ids
+
+
+def schedule_prescription_pdf_purge(prescription_id):
+    """Drop the prescription's stored PDFs once the current transaction commits."""
+    if not prescription_id:
+        return
+    _pending_ids().add(prescription_id)
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def _flush_pending():
+    ids = _pending_ids()
+    batch = set(ids)
+    ids.clear()
+    for prescription_id in batch:
+        purge_prescription_pdfs(prescription_id)
@@ -0,0 +1,306 @@
+"""
+Reports: the aggregates behind api_generate_report and the PDF documents.
+
+The aggregates are computed in the database: every function runs grouped
+queries and reads back aggregated rows only, never the appointment rows
+themselves.
+
+PDF reports are rendered by render_report_pdf and kept in the default
+storage under a name derived from their parameters and a fingerprint of the
+period's appointments (last update, count and total value), so an identical
+request on unchanged data reuses the stored document (stored_report_pdf),
+whichever worker serves it. Storing a new version of a report deletes the
+superseded ones. run_report_pdf_job renders them on the background job pool
+(see jobs).
+"""
+import hashlib
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import Appointment, Doctor
+from .pdf_styles import pdf_styles, table_styles
+
+
+REPORT_TYPES = ('appointments', 'payment_methods', 'patient_summary', 'financial_summary', 'monthly_appointments')
+# Patients listed by the patient summary report
+PATIENT_RANKING_SIZE = 20
+# Stored PDF reports; bump the layout version when the document changes so
+# that older stored files are not reused
+REPORT_PDF_DIR = 'reports/pdf'
+REPORT_PDF_LAYOUT_VERSION = 1
+
+
+def count_by(appointments, field):
+    """{value of field: number of appointments}, from one grouped query."""
+    rows = appointments.order_by().values(field).annotate(count=Count('id')).order_by(field)
+    return dict(rows.values_list(field, 'count'))
+
+
+def monthly_counts(appointments):
+    """{first day of month: number of appointments}, from one TruncMonth-grouped query."""
+    rows = appointments.annotate(month=TruncMonth('appointment_date')).order_by().values('month').annotate(
+        count=Count('id')
+    ).order_by('month')
+    return dict(rows.values_list('month', 'count'))
+
+
+def patient_ranking(appointments, limit=PATIENT_RANKING_SIZE):
+    """
+    (ranking, total_patients): the `limit` patients with the most
+    appointments (ORDER BY count LIMIT, ties by name) as dicts with
+    'patient', 'patient__first_name', 'patient__last_name' and 'total', and
+    the number of distinct patients.
+    """
+    ranking = appointments.order_by().values('patient', 'patient__first_name', 'patient__last_name').annotate(
+        total=Count('id')
+    ).order_by('-total', 'patient__first_name', 'patient__last_name', 'patient')[:limit]
+    total_patients = appointments.order_by().aggregate(total=Count('patient', distinct=True))['total']
+    return list(ranking), total_patients
+
+
+def revenue_breakdown(appointments):
+    """
+    (by_type, by_payment, total): revenue of the appointments that have a
+    value, per appointment_type and per payment_type, from one query grouped
+    by both.
+    """
+    rows = appointments.filter(value__isnull=False).exclude(value=0).order_by().values(
+        'appointment_type', 'payment_type'
+    ).annotate(amount=Sum('value')).order_by('appointment_type', 'payment_type')
+    by_type = {}
+    by_payment = {}
+    total = Decimal('0')
+    for appointment_type, payment_type, amount in rows.values_list('appointment_type', 'payment_type', 'amount'):
+        by_type[appointment_type] = by_type.get(appointment_type, Decimal('0')) + amount
+        by_payment[payment_type] = by_payment.get(payment_type, Decimal('0')) + amount
+        total += amount
+    return by_type, by_payment, total
+
+
+# ─── PDF documents ──────────────────────────────────────────────────────────
+
+def render_report_pdf(doctor, report_type, start_date, end_date):
+    """
+    The PDF document (bytes) of a report over [start_date, end_date] for the
+    doctor, or for every doctor when None. Raises ImportError when
+    reportlab is not installed.
+    """
+    from io import BytesIO
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+
+    base_filter = {
+        'appointment_date__range': [start_date, end_date],
+        'status': 'completed'
+    }
+    if doctor:
+        base_filter['doctor'] = doctor
+
+    # Create PDF buffer
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, 
+                           rightMargin=72, leftMargin=72,
+                           topMargin=72, bottomMargin=18)
+    
+    # Container for the PDF elements
+    story = []
+    styles = pdf_styles()
+    title_style = styles['CustomTitle']
+    header_style = styles['CustomHeader']
+    table_style = table_styles()
+    
+    # Title
+    title_text = "RELATÓRIO DE CONSULTAS" if report_type == 'appointments' else "RELATÓRIO"
+    story.append(Paragraph(title_text, title_style))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Doctor information
+    if doctor:
+        story.append(Paragraph(f"<b>Médico:</b> {doctor.full_name}", styles['Normal']))
+        if hasattr(doctor, 'specialization') and doctor.specialization:
+            story.append(Paragraph(f"<b>Especialização:</b> {doctor.specialization}", styles['Normal']))
+        if hasattr(doctor, 'medical_license') and doctor.medical_license:
+            story.append(Paragraph(f"<b>CRM:</b> {doctor.medical_license}", styles['Normal']))
+        story.append(Spacer(1, 0.2*inch))
+    
+    # Period information
+    story.append(Paragraph(f"<b>Período:</b> {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}", styles['Normal']))
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Get report data and generate content
+    if report_type == 'appointments':
+        appointments = Appointment.objects.filter(**base_filter).select_related('patient', 'doctor').order_by('appointment_date', 'appointment_time')
+        
+        story.append(Paragraph("Lista de Consultas Realizadas", header_style))
+        story.append(Spacer(1, 0.1*inch))
+        
+        # Table data
+        table_data = [['Data', 'Horário', 'Paciente', 'Tipo', 'Pagamento', 'Valor']]
+        
+        for apt in appointments:
+            date_str = apt.appointment_date.strftime('%d/%m/%Y')
+            time_str = apt.appointment_time.strftime('%H:%M')
+            value_str = f"R$ {apt.value:.2f}" if apt.value else "-"
+            table_data.append([
+                date_str,
+                time_str,
+                apt.patient.full_name,
+                apt.get_appointment_type_display(),
+                apt.get_payment_type_display(),
+                value_str
+            ])
+        
+        # Create table
+        table = Table(table_data, colWidths=[1*inch, 0.8*inch, 2*inch, 1*inch, 1*inch, 1*inch])
+        table.setStyle(table_style['appointment_list'])
+        
+        story.append(table)
+        story.append(Spacer(1, 0.2*inch))
+        
+        # Summary
+        total_appointments = len(table_data) - 1
+        total_revenue = sum(float(apt.value) if apt.value else 0 for apt in appointments)
+        story.append(Paragraph(f"<b>Total de Consultas:</b> {total_appointments}", styles['Normal']))
+        story.append(Paragraph(f"<b>Receita Total:</b> R$ {total_revenue:.2f}", styles['Normal']))
+        
+    elif report_type == 'financial_summary':
+        story.append(Paragraph("Resumo Financeiro", header_style))
+        story.append(Spacer(1, 0.1*inch))
+        
+        # Calculate totals in the database, then label them
+        by_type, by_payment, total_revenue = revenue_breakdown(Appointment.objects.filter(**base_filter))
+        type_labels = dict(Appointment.TYPE_CHOICES)
+        payment_labels = dict(Appointment.PAYMENT_TYPE_CHOICES)
+        income_by_category = {}
+        for appointment_type, amount in by_type.items():
+            category = type_labels.get(appointment_type, appointment_type)
+            income_by_category[category] = income_by_category.get(category, 0) + float(amount)
+        income_by_method = {}
+        for payment_type, amount in by_payment.items():
+            method = payment_labels.get(payment_type, payment_type)
+            income_by_method[method] = income_by_method.get(method, 0) + float(amount)
+        total_revenue = float(total_revenue)
+        
+        # Revenue by category table
+        if income_by_category:
+            story.append(Paragraph("Receita por Categoria", styles['Heading3']))
+            table_data = [['Categoria', 'Valor']]
+            for category, amount in sorted(income_by_category.items(), key=lambda x: x[1], reverse=True):
+                table_data.append([category, f"R$ {amount:.2f}"])
+            
+            table = Table(table_data, colWidths=[3*inch, 2*inch])
+            table.setStyle(table_style['amounts'])
+            story.append(table)
+            story.append(Spacer(1, 0.2*inch))
+        
+        # Revenue by payment method table
+        if income_by_method:
+            story.append(Paragraph("Receita por Método de Pagamento", styles['Heading3']))
+            table_data = [['Método', 'Valor']]
+            for method, amount in sorted(income_by_method.items(), key=lambda x: x[1], reverse=True):
+                table_data.append([method, f"R$ {amount:.2f}"])
+            
+            table = Table(table_data, colWidths=[3*inch, 2*inch])
+            table.setStyle(table_style['amounts'])
+            story.append(table)
+            story.append(Spacer(1, 0.2*inch))
+        
+        # Total
+        story.append(Paragraph(f"<b>Receita Total:</b> R$ {total_revenue:.2f}", styles['Heading2']))
+    
+    # Build PDF
+    doc.build(story)
+    
+    # Get PDF data
+    buffer.seek(0)
+    pdf_data = buffer.getvalue()
+    buffer.close()
+    return pdf_data
+
+
+def _report_pdf_dir(doctor):
+    return f'{REPORT_PDF_DIR}/{doctor.id if doctor else "all"}'
+
+
+def _report_pdf_prefix(report_type, start_date, end_date):
+    return f'{report_type}_{start_date}_{end_date}_'
+
+
+def report_pdf_name(doctor, report_type, start_date, end_date):
+    """Storage name of a report's PDF: changes whenever its parameters or data do."""
+    # The reports only read the period's completed appointments. The stamp
+    # catches edits, the count deletions and status changes, the total bulk
+    # value changes (queryset updates leave updated_at alone).
+    appointments = Appointment.objects.filter(appointment_date__range=[start_date, end_date], status='completed')
+    if doctor:
+        appointments = appointments.filter(doctor=doctor)
+    aggregates = {'stamp': Max('updated_at'), 'count': Count('id'), 'total': Sum('value')}
+    if report_type == 'appointments':
+        # Patient names are printed
+        aggregates['patient_stamp'] = Max('patient__updated_at')
+    data = appointments.aggregate(**aggregates)
+
+    fingerprint = [
+        REPORT_PDF_LAYOUT_VERSION, report_type, start_date.isoformat(), end_date.isoformat(),
+        sorted(data.items()),
+    ]
+    if doctor:
+        fingerprint += [doctor.id, doctor.full_name, doctor.specialization, doctor.medical_license]
+    digest = hashlib.sha256(json.dumps(fingerprint, default=str).encode('utf-8')).hexdigest()
+    return f'{_report_pdf_dir(doctor)}/{_report_pdf_prefix(report_type, start_date, end_date)}{digest[:32]}.pdf'
+
+
+def purge_report_pdfs(doctor, report_type, start_date, end_date, keep=None):
+    """Delete the stored versions of a report's PDF, except the file named keep."""
+    directory = _report_pdf_dir(doctor)
+    prefix = _report_pdf_prefix(report_type, start_date, end_date)
+    try:
+        _dirs, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        if filename.startswith(prefix) and filename != keep:
+            default_storage.delete(f'{directory}/{filename}')
+
+
+def stored_report_pdf(doctor, report_type, start_date, end_date):
+    """
+    (name, reused): storage name of the report's PDF, rendered and saved
+    unless an identical document is already stored.
+    """
+    name = report_pdf_name(doctor, report_type, start_date, end_date)
+    if default_storage.exists(name):
+        return name, True
+    pdf_data = render_report_pdf(doctor, report_type, start_date, end_date)
+    # An identical request may have stored the same document meanwhile
+    if default_storage.exists(name):
+        return name, True
+    name = default_storage.save(name, ContentFile(pdf_data))
+    purge_report_pdfs(doctor, report_type, start_date, end_date, keep=name.rsplit('/', 1)[-1])
+    return name, False
+
+
+def report_pdf_filename(report_type, start_date, end_date):
+    """Download file name of a report's PDF."""
+    return f'relatorio_{report_type}_{start_date}_{end_date}.pdf'
+
+
+def run_report_pdf_job(job, doctor_id, report_type, start_date, end_date):
+    """Background job rendering (or reusing) a report's PDF; the result points at the stored file."""
+    doctor = Doctor.objects.select_related('user').get(id=doctor_id) if doctor_id else None
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    job.set_progress(0, total=1)
+    name, reused = stored_report_pdf(doctor, report_type, start_date, end_date)
+    job.set_progress(1)
+    return {
+        'file': name,
+        'filename': report_pdf_filename(report_type, start_date, end_date),
+        'reused': reused,
+    }
@@ -0,0 +1,215 @@
+"""
+Versioned result cache for the indicator and report endpoints.
+
+Those endpoints are pure functions of (doctor set, period, data version).
+Every write to an appointment, income or expense bumps a version counter for
+its doctor-month (and the doctor-wide, all-doctors counters), once the
+transaction commits. A cached result is stored with the version token it was
+computed from and is current while the token still matches.
+
+A result whose token no longer matches is served stale for up to
+RESULT_CACHE_STALE_SECONDS while a background thread recomputes it; older
+entries are recomputed inline. Lookups are counted per endpoint and outcome
+(hit / stale / miss / bypass), see result_cache_stats.
+
+The counters only invalidate what they are shared with, so results are
+cached only in a cache backend shared by every worker process (Redis, see
+settings.CACHES). With a process-local backend (the default memory cache)
+lookups bypass the cache, unless RESULT_CACHE_ALLOW_LOCAL is set for a
+single-process setup.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dashboard:result-cache'
+ALL = '*'
+OUTCOMES = ('hit', 'stale', 'miss', 'bypass')
+CACHED_ENDPOINTS = ('indicators', 'indicators_comparison', 'quick_stats', 'generate_report')
+
+RESULT_CACHE_TIMEOUT = getattr(settings, 'RESULT_CACHE_TIMEOUT', 60 * 60)
+RESULT_CACHE_STALE_SECONDS = getattr(settings, 'RESULT_CACHE_STALE_SECONDS', 60)
+# How long a background recompute holds its lock before another may start
+REVALIDATE_LOCK_SECONDS = 60
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dashboard-result-cache')
+
+
+def result_cache_enabled():
+    """True when results may be cached: the cache is shared by every process, or local caching is allowed."""
+    if getattr(settings, 'RESULT_CACHE_ALLOW_LOCAL', False):
+        return True
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+# ─── Data versions ──────────────────────────────────────────────────────────
+
+def _version_key(doctor_id, month):
+    return f'{KEY_PREFIX}:version:{doctor_id}:{month}'
+
+
+def _month_label(day):
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    return day.strftime('%Y-%m')
+
+
+def bump_data_versions(keys):
+    """Bump the version counters of the given (doctor_id, day) keys."""
+    counters = set()
+    for doctor_id, day in keys:
+        month = _month_label(day)
+        counters.update({
+            _version_key(doctor_id, month), _version_key(doctor_id, ALL),
+            _version_key(ALL, month), _version_key(ALL, ALL),
+        })
+    for key in counters:
+        # Counters start from the clock, so a counter that was evicted and
+        # recreated never repeats a token an older entry was stored with
+        cache.add(key, time.time_ns(), timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+_pending = threading.local()
+
+
+def _pending_keys():
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    return _pending.keys
+
+
+def schedule_version_bump(doctor_id, day):
+    """Bump the doctor-month version of day once the current transaction commits."""
+    if not doctor_id or not day:
+        return
+    _pending_keys().add((doctor_id, day))
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def _flush_pending():
+    keys = _pending_keys()
+    if not keys:
+        return
+    batch = set(keys)
+    keys.clear()
+    bump_data_versions(batch)
+
+
+def _months_between(start_date, end_date):
+    month = date(start_date.year, start_date.month, 1)
+    while month <= end_date:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def data_version(doctor_ids, start_date=None, end_date=None):
+    """
+    Version token of the doctors' data (every doctor when doctor_ids is None)
+    in the months of [start_date, end_date], or in any month when no period
+    is given. Read with one cache round trip.
+    """
+    doctors = sorted(doctor_ids) if doctor_ids is not None else [ALL]
+    if start_date is None or end_date is None:
+        labels = [ALL]
+    else:
+        labels = [_month_label(month) for month in _months_between(start_date, end_date)]
+    keys = [_version_key(doctor_id, label) for doctor_id in doctors for label in labels]
+    versions = cache.get_many(keys)
+    return tuple(versions.get(key, 0) for key in keys)
+
+
+def month_versions(doctor_ids, months):
+    """{(doctor_id, month): version} for each doctor and first-of-month date, in one cache round trip."""
+    keys = {(doctor_id, month): _version_key(doctor_id, _month_label(month)) for doctor_id in doctor_ids for month in months}
+    versions = cache.get_many(list(keys.values()))
+    return {pair: versions.get(key, 0) for pair, key in keys.items()}
+
+
+# ─── Cached results ─────────────────────────────────────────────────────────
+
+def _count(endpoint, outcome):
+    key = f'{KEY_PREFIX}:stats:{endpoint}:{outcome}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def result_cache_stats():
+    """{endpoint: {'hit': n, 'stale': n, 'miss': n}} for every cached endpoint."""
+    keys = {
+        (endpoint, outcome): f'{KEY_PREFIX}:stats:{endpoint}:{outcome}'
+        for endpoint in CACHED_ENDPOINTS for outcome in OUTCOMES
+    }
+    values = cache.get_many(list(keys.values()))
+    return {
+        endpoint: {outcome: values.get(keys[(endpoint, outcome)], 0) for outcome in OUTCOMES}
+        for endpoint in CACHED_ENDPOINTS
+    }
+
+
+def _result_key(endpoint, params):
+    return f'{KEY_PREFIX}:result:{endpoint}:' + ':'.join(str(part) for part in params)
+
+
+def _store(key, version, compute):
+    value = compute()
+    cache.set(key, {'version': version, 'stored_at': time.time(), 'value': value}, RESULT_CACHE_TIMEOUT)
+    return value
+
+
+def _revalidate(key, version_of, compute):
+    close_old_connections()
+    try:
+        _store(key, version_of(), compute)
+    except Exception:
+        logger.exception("Failed to revalidate cached result %s", key)
+    finally:
+        cache.delete(f'{key}:revalidating')
+        close_old_connections()
+
+
+def cached_result(endpoint, params, version_of, compute):
+    """
+    Result of compute() for the endpoint and params (everything besides the
+    data version that the result depends on), cached under the version
+    token returned by version_of(). compute must return a picklable value
+    and must not touch the request, since it may run on a background thread.
+    Returns (value, outcome) with outcome one of OUTCOMES.
+    """
+    if not result_cache_enabled():
+        _count(endpoint, 'bypass')
+        return compute(), 'bypass'
+    key = _result_key(endpoint, params)
+    # Read the version before computing: a write that lands meanwhile leaves
+    # the stored entry behind the counter, so the next lookup recomputes
+    version = version_of()
+    entry = cache.get(key)
+    if entry is not None and entry['version'] == version:
+        outcome = 'hit'
+        value = entry['value']
+    elif entry is not None and time.time() - entry['stored_at'] <= RESULT_CACHE_STALE_SECONDS:
+        outcome = 'stale'
+        value = entry['value']
+        if cache.add(f'{key}:revalidating', True, REVALIDATE_LOCK_SECONDS):
+            _executor.submit(_revalidate, key, version_of, compute)
+    else:
+        outcome = 'miss'
+        value = _store(key, version, compute)
+    _count(endpoint, outcome)
+    return value, outcome
@@ -0,0 +1,298 @@
+"""
+Per-(doctor, month) rollups of appointment and income figures.
+
+DoctorMonthlyStats rows are refreshed only for the doctor-months a write
+touches: the model signals (and the bulk update paths, which bypass
+signals) call schedule_refresh, and the touched keys are recomputed once
+the transaction commits, after which their data versions are bumped (see
+result_cache). rebuild_monthly_stats recomputes every row with a
+few grouped queries (management command rebuild_monthly_stats).
+
+Readers split a period with split_period: whole closed months come from the
+rollup, partial months and the open (current) month are computed live.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Appointment, DoctorMonthlyStats, Income
+from .result_cache import bump_data_versions
+
+
+logger = logging.getLogger(__name__)
+
+# Figures that can be summed across doctors and months
+ADDITIVE_FIELDS = (
+    'total_appointments', 'completed_count', 'no_show_count', 'cancelled_count',
+    'particular_count', 'convenio_count', 'completed_particular_count',
+    'completed_convenio_count', 'completed_duration_minutes', 'revenue',
+)
+# Distinct-patient figures, exact for a single doctor-month only
+DISTINCT_FIELDS = ('unique_patients', 'returning_patients', 'completed_unique_patients')
+
+COMPLETED = Q(status='completed')
+APPOINTMENT_AGGREGATES = {
+    'total_appointments': Count('id'),
+    'completed_count': Count('id', filter=COMPLETED),
+    'no_show_count': Count('id', filter=Q(status='no_show')),
+    'cancelled_count': Count('id', filter=Q(status='cancelled')),
+    'particular_count': Count('id', filter=Q(payment_type='particular')),
+    'convenio_count': Count('id', filter=Q(payment_type='convenio')),
+    'completed_particular_count': Count('id', filter=COMPLETED & Q(payment_type='particular')),
+    'completed_convenio_count': Count('id', filter=COMPLETED & Q(payment_type='convenio')),
+    'completed_duration_minutes': Sum('duration_minutes', filter=COMPLETED),
+    'unique_patients': Count('patient', distinct=True),
+    'completed_unique_patients': Count('patient', distinct=True, filter=COMPLETED),
+}
+
+
+def month_key(day):
+    """First day of the month of a date (or 'YYYY-MM-DD' string)."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def empty_figures():
+    figures = {field: 0 for field in ADDITIVE_FIELDS + DISTINCT_FIELDS}
+    figures['revenue'] = Decimal('0')
+    return figures
+
+
+def _clean(figures):
+    return {key: (value or 0) for key, value in figures.items()}
+
+
+# ─── Write side ─────────────────────────────────────────────────────────────
+
+def compute_month_stats(doctor_id, month):
+    """Figures of one doctor-month straight from Appointment and Income."""
+    month_range = [month, next_month(month) - timedelta(days=1)]
+    appointments = Appointment.objects.filter(doctor_id=doctor_id, appointment_date__range=month_range)
+    figures = empty_figures()
+    figures.update(_clean(appointments.aggregate(**APPOINTMENT_AGGREGATES)))
+    figures['returning_patients'] = appointments.values('patient').annotate(
+        visits=Count('id')
+    ).filter(visits__gt=1).count()
+    figures['revenue'] = Income.objects.filter(
+        doctor_id=doctor_id, income_date__range=month_range
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    return figures
+
+
+def refresh_monthly_stats(keys):
+    """Recompute the DoctorMonthlyStats rows of the given (doctor_id, month) keys."""
+    for doctor_id, month in keys:
+        figures = compute_month_stats(doctor_id, month)
+        if not figures['total_appointments'] and not figures['revenue']:
+            DoctorMonthlyStats.objects.filter(doctor_id=doctor_id, month=month).delete()
+            continue
+        DoctorMonthlyStats.objects.update_or_create(doctor_id=doctor_id, month=month, defaults=figures)
+
+
+_pending = threading.local()
+
+
+def _pending_keys():
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    return _pending.keys
+
+
+def schedule_refresh(doctor_id, day):
+    """
+    Mark the doctor-month of day as changed. Marked keys are recomputed once
+    when the current transaction commits (immediately outside a transaction).
+    """
+    if not doctor_id or not day:
+        return
+    _pending_keys().add((doctor_id, month_key(day)))
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def schedule_refresh_for_appointments(queryset):
+    """schedule_refresh for every doctor-month in an appointment queryset (bulk update paths)."""
+    for doctor_id, day in queryset.values_list('doctor_id', 'appointment_date').distinct():
+        schedule_refresh(doctor_id, day)
+
+
+def _flush_pending():
+    keys = _pending_keys()
+    if not keys:
+        return
+    batch = set(keys)
+    keys.clear()
+    try:
+        refresh_monthly_stats(batch)
+    except Exception:
+        # Never fail the write; the rebuild command repairs missed months
+        logger.exception("Failed to refresh monthly stats for %s", sorted(batch))
+    # Cached endpoint results are keyed by the data version of these months
+    bump_data_versions(batch)
+
+
+def rebuild_monthly_stats(doctor_ids=None):
+    """
+    Recompute every DoctorMonthlyStats row (optionally for some doctors only)
+    with grouped queries. Returns the number of rows written.
+    """
+    appointments = Appointment.objects.all()
+    incomes = Income.objects.all()
+    if doctor_ids is not None:
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+        incomes = incomes.filter(doctor_id__in=doctor_ids)
+    appointments = appointments.annotate(month=TruncMonth('appointment_date'))
+
+    rows = defaultdict(empty_figures)
+    for row in appointments.values('doctor_id', 'month').annotate(**APPOINTMENT_AGGREGATES):
+        key = (row.pop('doctor_id'), row.pop('month'))
+        rows[key].update(_clean(row))
+    repeat_visits = appointments.values('doctor_id', 'month', 'patient_id').annotate(
+        visits=Count('id')
+    ).filter(visits__gt=1).values_list('doctor_id', 'month')
+    for key in repeat_visits:
+        rows[key]['returning_patients'] += 1
+    for doctor_id, month, revenue in incomes.annotate(month=TruncMonth('income_date')).values(
+        'doctor_id', 'month'
+    ).annotate(revenue=Sum('amount')).values_list('doctor_id', 'month', 'revenue'):
+        rows[(doctor_id, month)]['revenue'] = revenue or Decimal('0')
+
+    with transaction.atomic():
+        existing = DoctorMonthlyStats.objects.all()
+        if doctor_ids is not None:
+            existing = existing.filter(doctor_id__in=doctor_ids)
+        changed = set(existing.values_list('doctor_id', 'month')) | set(rows)
+        existing.delete()
+        DoctorMonthlyStats.objects.bulk_create(
+            [DoctorMonthlyStats(doctor_id=doctor_id, month=month, **figures)
+             for (doctor_id, month), figures in rows.items()],
+            batch_size=500,
+        )
+        transaction.on_commit(lambda: bump_data_versions(changed))
+    return len(rows)
+
+
+# ─── Read side ──────────────────────────────────────────────────────────────
+
+def split_period(start_date, end_date, today=None):
+    """
+    Split [start_date, end_date] into the whole months that are already
+    closed (read from the rollup) and the date ranges left to compute live:
+    partial months at either edge and the open month.
+    Returns (months, live_ranges).
+    """
+    today = today or timezone.localtime(timezone.now()).date()
+    open_month = month_key(today)
+    months = []
+    live_ranges = []
+    month = month_key(start_date)
+    while month <= end_date:
+        month_last = next_month(month) - timedelta(days=1)
+        if month < open_month and start_date <= month and month_last <= end_date:
+            months.append(month)
+        else:
+            range_start, range_end = max(month, start_date), min(month_last, end_date)
+            if live_ranges and live_ranges[-1][1] + timedelta(days=1) == range_start:
+                live_ranges[-1] = (live_ranges[-1][0], range_end)
+            else:
+                live_ranges.append((range_start, range_end))
+        month = next_month(month)
+    return months, live_ranges
+
+
+def load_monthly_stats(doctor_ids, months):
+    """
+    {month: figures} for the given months, summed over doctor_ids (every
+    doctor when None), in one query. Months without a row have no data.
+    Distinct-patient figures are only exact when a single doctor is given.
+    """
+    if not months:
+        return {}
+    rows = DoctorMonthlyStats.objects.filter(month__in=months)
+    if doctor_ids is not None:
+        rows = rows.filter(doctor_id__in=doctor_ids)
+    result = {month: empty_figures() for month in months}
+    fields = ADDITIVE_FIELDS + DISTINCT_FIELDS
+    totals = rows.values('month').annotate(**{f'sum_{field}': Sum(field) for field in fields})
+    for row in totals:
+        result[row['month']].update({field: row[f'sum_{field}'] or 0 for field in fields})
+    return result
+
+
+def _ranges_filter(field, ranges):
+    return reduce(or_, (Q(**{f'{field}__range': [start, end]}) for start, end in ranges))
+
+
+def period_figures(doctor_ids, start_date, end_date, today=None):
+    """
+    Additive figures (ADDITIVE_FIELDS) of [start_date, end_date]: closed
+    months from the rollup, the rest live with one appointment and one
+    income query.
+    """
+    months, live_ranges = split_period(start_date, end_date, today=today)
+    figures = {field: 0 for field in ADDITIVE_FIELDS}
+    figures['revenue'] = Decimal('0')
+    for month_figures in load_monthly_stats(doctor_ids, months).values():
+        for field in ADDITIVE_FIELDS:
+            figures[field] += month_figures[field]
+    if live_ranges:
+        appointments = Appointment.objects.filter(_ranges_filter('appointment_date', live_ranges))
+        incomes = Income.objects.filter(_ranges_filter('income_date', live_ranges))
+        if doctor_ids is not None:
+            appointments = appointments.filter(doctor_id__in=doctor_ids)
+            incomes = incomes.filter(doctor_id__in=doctor_ids)
+        live = _clean(appointments.aggregate(**{
+            field: APPOINTMENT_AGGREGATES[field] for field in ADDITIVE_FIELDS if field != 'revenue'
+        }))
+        for field, value in live.items():
+            figures[field] += value
+        figures['revenue'] += incomes.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    return figures
+
+
+def period_figures_by_doctor(doctor_ids, start_date, end_date, today=None):
+    """
+    period_figures for each of doctor_ids, {doctor_id: figures}, with the
+    same three queries grouped by doctor.
+    """
+    months, live_ranges = split_period(start_date, end_date, today=today)
+    result = {}
+    for doctor_id in doctor_ids:
+        result[doctor_id] = {field: 0 for field in ADDITIVE_FIELDS}
+        result[doctor_id]['revenue'] = Decimal('0')
+    if months:
+        rows = DoctorMonthlyStats.objects.filter(doctor_id__in=doctor_ids, month__in=months).values('doctor_id').annotate(
+            **{f'sum_{field}': Sum(field) for field in ADDITIVE_FIELDS}
+        )
+        for row in rows:
+            for field in ADDITIVE_FIELDS:
+                result[row['doctor_id']][field] += row[f'sum_{field}'] or 0
+    if live_ranges:
+        rows = Appointment.objects.filter(
+            _ranges_filter('appointment_date', live_ranges), doctor_id__in=doctor_ids
+        ).order_by().values('doctor_id').annotate(**{
+            field: APPOINTMENT_AGGREGATES[field] for field in ADDITIVE_FIELDS if field != 'revenue'
+        })
+        for row in rows:
+            doctor_id = row.pop('doctor_id')
+            for field, value in _clean(row).items():
+                result[doctor_id][field] += value
+        incomes = Income.objects.filter(
+            _ranges_filter('income_date', live_ranges), doctor_id__in=doctor_ids
+        ).order_by().values('doctor_id').annotate(total=Sum('amount'))
+        for row in incomes:
+            result[row['doctor_id']]['revenue'] += row['total'] or Decimal('0')
+    return result
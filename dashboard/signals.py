@@ -0,0 +1,183 @@
+"""
+Model signal receivers for the dashboard app (connected in DashboardConfig.ready).
+"""
+from datetime import timedelta
+
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .agenda_events import appointment_event_type, publish_agenda_event
+from .models import Appointment, CalendarBlock, Expense, Income, Prescription, PrescriptionItem
+from .prescription_pdf_service import schedule_prescription_pdf_purge
+from .result_cache import schedule_version_bump
+from .rollup_service import schedule_refresh
+from .visit_summary_service import schedule_summary_refresh
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, **kwargs):
+    publish_agenda_event(
+        instance.doctor_id,
+        appointment_event_type(instance, created),
+        appointment_id=instance.id,
+        status=instance.status,
+        date=str(instance.appointment_date),
+    )
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    publish_agenda_event(instance.doctor_id, 'appointment.deleted', appointment_id=instance.id)
+
+
+@receiver(post_save, sender=CalendarBlock)
+def calendar_block_saved(sender, instance, created, **kwargs):
+    publish_agenda_event(
+        instance.doctor_id,
+        'block.created' if created else 'block.updated',
+        block_id=instance.id,
+    )
+
+
+@receiver(post_delete, sender=CalendarBlock)
+def calendar_block_deleted(sender, instance, **kwargs):
+    publish_agenda_event(instance.doctor_id, 'block.deleted', block_id=instance.id)
+
+
+# ─── Monthly rollups (DoctorMonthlyStats) ────────────────────────────────────
+
+def _remember_rollup_key(instance, date_field):
+    # Read from __dict__ so deferred fields are not loaded one query at a time
+    instance._rollup_key = (instance.__dict__.get('doctor_id'), instance.__dict__.get(date_field))
+
+
+def _refresh_rollup(instance, date_field, schedule=schedule_refresh):
+    """Refresh the doctor-month the row is in now and, after a move, the one it left."""
+    current = (instance.doctor_id, getattr(instance, date_field))
+    schedule(*current)
+    previous = getattr(instance, '_rollup_key', None)
+    if previous and previous != current:
+        schedule(*previous)
+    instance._rollup_key = current
+
+
+@receiver(post_init, sender=Appointment)
+def appointment_initialized(sender, instance, **kwargs):
+    _remember_rollup_key(instance, 'appointment_date')
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_rollup_saved(sender, instance, **kwargs):
+    _refresh_rollup(instance, 'appointment_date')
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_rollup_deleted(sender, instance, **kwargs):
+    schedule_refresh(instance.doctor_id, instance.appointment_date)
+
+
+@receiver(post_init, sender=Income)
+def income_initialized(sender, instance, **kwargs):
+    _remember_rollup_key(instance, 'income_date')
+
+
+@receiver(post_save, sender=Income)
+def income_rollup_saved(sender, instance, **kwargs):
+    _refresh_rollup(instance, 'income_date')
+
+
+@receiver(post_delete, sender=Income)
+def income_rollup_deleted(sender, instance, **kwargs):
+    schedule_refresh(instance.doctor_id, instance.income_date)
+
+
+# Expenses are not rolled up, but cached report results depend on them
+# (see result_cache); appointments and incomes bump through the rollup refresh.
+
+@receiver(post_init, sender=Expense)
+def expense_initialized(sender, instance, **kwargs):
+    _remember_rollup_key(instance, 'expense_date')
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, **kwargs):
+    _refresh_rollup(instance, 'expense_date', schedule=schedule_version_bump)
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    schedule_version_bump(instance.doctor_id, instance.expense_date)
+
+
+# Calendar blocks change slot capacity (see capacity_service), which is cached
+# under the data version of every month the block covers.
+
+def _bump_block_months(doctor_id, start, end):
+    if not start or not end:
+        return
+    month = timezone.localtime(start).date().replace(day=1)
+    last_day = timezone.localtime(end).date()
+    while month <= last_day:
+        schedule_version_bump(doctor_id, month)
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+@receiver(post_init, sender=CalendarBlock)
+def calendar_block_initialized(sender, instance, **kwargs):
+    instance._capacity_span = (
+        instance.__dict__.get('doctor_id'), instance.__dict__.get('start'), instance.__dict__.get('end')
+    )
+
+
+@receiver(post_save, sender=CalendarBlock)
+def calendar_block_capacity_saved(sender, instance, **kwargs):
+    current = (instance.doctor_id, instance.start, instance.end)
+    previous = getattr(instance, '_capacity_span', None)
+    _bump_block_months(*current)
+    if previous and previous != current:
+        _bump_block_months(*previous)
+    instance._capacity_span = current
+
+
+@receiver(post_delete, sender=CalendarBlock)
+def calendar_block_capacity_deleted(sender, instance, **kwargs):
+    _bump_block_months(instance.doctor_id, instance.start, instance.end)
+
+
+# ─── Patient visit summaries (PatientVisitSummary) ──────────────────────────
+
+@receiver(post_init, sender=Appointment)
+def appointment_summary_initialized(sender, instance, **kwargs):
+    instance._summary_key = (instance.__dict__.get('patient_id'), instance.__dict__.get('doctor_id'))
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_summary_saved(sender, instance, **kwargs):
+    current = (instance.patient_id, instance.doctor_id)
+    schedule_summary_refresh(*current)
+    previous = getattr(instance, '_summary_key', None)
+    if previous and previous != current:
+        schedule_summary_refresh(*previous)
+    instance._summary_key = current
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_summary_deleted(sender, instance, **kwargs):
+    schedule_summary_refresh(instance.patient_id, instance.doctor_id)
+
+
+# ─── Stored prescription PDFs (see prescription_pdf_service) ────────────────
+
+@receiver(post_save, sender=Prescription)
+@receiver(post_delete, sender=Prescription)
+def prescription_pdf_invalidated(sender, instance, created=False, **kwargs):
+    # A new prescription has nothing stored yet
+    if not created:
+        schedule_prescription_pdf_purge(instance.id)
+
+
+@receiver(post_save, sender=PrescriptionItem)
+@receiver(post_delete, sender=PrescriptionItem)
+def prescription_item_pdf_invalidated(sender, instance, **kwargs):
+    schedule_prescription_pdf_purge(instance.prescription_id)
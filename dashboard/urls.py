@@ -20,11 +20,14 @@ urlpatterns = [
     path('api/patients/<int:patient_id>/', views.api_patient_detail, name='api_patient_detail'),
     path('api/doctors/', views.api_doctors, name='api_doctors'),
     path('api/appointments/', views.api_appointments, name='api_appointments'),
+    path('api/appointments/check-conflicts/', views.api_check_slot_conflicts, name='api_check_slot_conflicts'),
+    path('api/appointments/series/', views.api_appointment_series, name='api_appointment_series'),
     path('api/patients/create/', views.api_create_patient, name='api_create_patient'),
     path('api/week-appointments/', views.api_week_appointments, name='api_week_appointments'),
     path('api/appointments/cancel/', views.api_cancel_appointment, name='api_cancel_appointment'),
     path('api/appointments/count-to-cancel/', views.api_count_appointments_to_cancel, name='api_count_appointments_to_cancel'),
     path('api/appointments/bulk-cancel/', views.api_bulk_cancel_appointments, name='api_bulk_cancel_appointments'),
+    path('api/jobs/<int:job_id>/', views.api_job_status, name='api_job_status'),
     path('api/calendar-block/create/', views.api_create_calendar_block, name='api_create_calendar_block'),
     path('api/calendar-block/<int:block_id>/delete/', views.api_delete_calendar_block, name='api_delete_calendar_block'),
     path('api/appointments/confirm-attendance/', views.api_confirm_attendance, name='api_confirm_attendance'),
@@ -33,6 +36,10 @@ urlpatterns = [
     path('api/appointments/update/', views.api_update_appointment, name='api_update_appointment'),
     path('api/next-appointment/', views.api_next_appointment, name='api_next_appointment'),
     path('api/agenda-stats/', views.api_agenda_stats, name='api_agenda_stats'),
+    path('api/bootstrap/', views.api_bootstrap, name='api_bootstrap'),
+    path('api/available-slots/', views.api_available_slots, name='api_available_slots'),
+    path('api/agenda/stream/', views.api_agenda_stream, name='api_agenda_stream'),
+    path('api/agenda/changes/', views.api_agenda_changes, name='api_agenda_changes'),
     
     # API endpoints for prescriptions
     path('api/prescriptions/', views.api_prescriptions, name='api_prescriptions'),
@@ -71,7 +78,10 @@ urlpatterns = [
     # API endpoints for reports
     path('api/reports/generate/', views.api_generate_report, name='api_generate_report'),
     path('api/reports/generate-pdf/', views.api_generate_pdf_report, name='api_generate_pdf_report'),
+    path('api/reports/pdf-jobs/', views.api_submit_pdf_report_job, name='api_submit_pdf_report_job'),
+    path('api/reports/pdf-jobs/<int:job_id>/download/', views.api_download_pdf_report_job, name='api_download_pdf_report_job'),
     path('api/reports/quick-stats/', views.api_quick_stats, name='api_quick_stats'),
+    path('api/result-cache/stats/', views.api_result_cache_stats, name='api_result_cache_stats'),
     
     # API endpoints for waiting list
     path('api/waiting-list/', views.api_waiting_list, name='api_waiting_list'),
@@ -85,6 +95,8 @@ urlpatterns = [
     
     # API endpoint for indicators
     path('api/indicators/', views.api_indicators, name='api_indicators'),
+    path('api/indicators/comparison/', views.api_indicators_comparison, name='api_indicators_comparison'),
+    path('api/indicators/export/', views.api_indicators_export, name='api_indicators_export'),
 
     # API endpoints for patient files
     path('api/patients/<int:patient_id>/files/', views.api_patient_files, name='api_patient_files'),
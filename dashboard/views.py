@@ -1,15 +1,53 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponse
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.decorators.http import require_http_methods
-from django.db import models
-from django.db.models import Q, Count, Sum, Avg, Min, Max
+from django.urls import reverse
+from django.db import IntegrityError
+from django.db.models import Q, Sum
 from datetime import date, timedelta, datetime
 from decimal import Decimal, InvalidOperation
-from .models import Appointment, Patient, Doctor, Clinic, MedicalRecord, Prescription, PrescriptionItem, PrescriptionTemplate, Expense, Income, Medication, WaitingListEntry, AppointmentSettings, CalendarBlock, PatientFile, ConsultationRecord
+from .models import Appointment, Patient, Doctor, Clinic, MedicalRecord, Prescription, PrescriptionItem, PrescriptionTemplate, Expense, Income, Medication, WaitingListEntry, AppointmentSettings, CalendarBlock, PatientFile, ConsultationRecord, BackgroundJob
+from .agenda_events import agenda_channel, get_broker, live_updates_streaming, sse_stream
+from .agenda_service import (
+    QueryCounter, annotate_first_appointment, day_range_bounds, etag_matches, get_agenda_stats,
+    get_calendar_feed_state, get_doctor_scope, parse_feed_cursor,
+)
+from .analytics_service import (
+    RETENTION_COHORTS, RETENTION_FOLLOW_UP_MONTHS, RETENTION_MAX_COHORTS, RETENTION_MAX_FOLLOW_UP_MONTHS,
+    compare_doctors, compute_indicators,
+)
+from .appointment_service import (
+    BULK_CANCEL_BACKGROUND_THRESHOLD, MAX_SERIES_OCCURRENCES, build_cancellation_queryset,
+    booking_income, bulk_cancel_appointments, create_appointment_series, format_cancel_message, run_bulk_cancel_job,
+    series_dates,
+)
+from .availability_service import CONFLICT_MESSAGES, MAX_CONFLICT_CHECK_SLOTS, Availability, check_slot_conflicts
+from .bootstrap_service import (
+    BOOTSTRAP_QUERY_BUDGET, AccessContext, appointment_settings_data, doctor_list_data, next_appointment_data,
+    patient_list_data,
+)
+from .export_service import (
+    APPOINTMENT_REPORT_COLUMNS, EXPORT_FORMATS, EXPORT_GRANULARITIES, REPORT_EXPORT_FORMATS,
+    appointment_report_rows, csv_lines, daily_kpi_rows, jsonl_lines, monthly_kpi_rows, table_csv_lines,
+    xlsx_chunks,
+)
+from .jobs import fail_orphaned_jobs, submit_job
+from .loyalty_service import LOYALTY_SORT_KEYS, LOYALTY_STATUSES, attach_loyalty_metrics, bulk_loyalty_metrics, sort_by_loyalty
+from .prescription_pdf_service import (
+    prescription_pdf_digest, prescription_pdf_etag, prescription_pdf_filename, stored_prescription_pdf,
+)
+from .report_service import (
+    REPORT_TYPES, count_by, monthly_counts, patient_ranking, report_pdf_filename, revenue_breakdown,
+    run_report_pdf_job, stored_report_pdf,
+)
+from .result_cache import cached_result, data_version, result_cache_enabled, result_cache_stats
+from .rollup_service import load_monthly_stats, period_figures, split_period
 from .waiting_list_views import api_waiting_list, api_waiting_list_entry, api_update_waiting_list_entry, api_convert_waitlist_to_appointment
 from accounts.utils import get_accessible_patients, get_user_role, has_access_to_patient, get_accessible_doctors, can_access_doctor
 
@@ -25,143 +63,27 @@ def home(request):
     # Get accessible doctors for filtering
     accessible_doctors = get_accessible_doctors(request.user)
     
+    # Selected doctor if accessible, otherwise every accessible doctor
+    doctor_scope = get_doctor_scope(current_doctor, accessible_doctors)
+
     # Get today's appointments - filter by accessible doctors and exclude cancelled
-    if current_doctor and current_doctor in accessible_doctors:
-        today_appointments = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today
-        ).exclude(status='cancelled').order_by('appointment_time')
-    else:
-        # For admins without doctor selection or when current_doctor is not accessible, show appointments from accessible doctors
-        today_appointments = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date=today
-        ).exclude(status='cancelled').order_by('appointment_time')
+    today_appointments = Appointment.objects.filter(
+        doctor_scope,
+        appointment_date=today
+    ).exclude(status='cancelled').order_by('appointment_time')
     print("today_appointments", today_appointments)
     # Get this week's appointments for the calendar view (excluding cancelled)
     start_of_week = today - timedelta(days=today.weekday())
     end_of_week = start_of_week + timedelta(days=6)
     
-    if current_doctor and current_doctor in accessible_doctors:
-        week_appointments = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date__range=[start_of_week, end_of_week]
-        ).exclude(status='cancelled').order_by('appointment_date', 'appointment_time')
-    else:
-        # For admins without doctor selection, show appointments from accessible doctors
-        week_appointments = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date__range=[start_of_week, end_of_week]
-        ).exclude(status='cancelled').order_by('appointment_date', 'appointment_time')
+    week_appointments = Appointment.objects.filter(
+        doctor_scope,
+        appointment_date__range=[start_of_week, end_of_week]
+    ).exclude(status='cancelled').order_by('appointment_date', 'appointment_time')
     
     # Calculate stats - always filter by accessible doctors and exclude cancelled
-    if current_doctor and current_doctor in accessible_doctors:
-        total_today = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today
-        ).exclude(status='cancelled').count()
-        
-        completed_today = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today,
-            status='completed'
-        ).count()
-        
-        pending_today = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today,
-            status__in=['scheduled', 'confirmed']
-        ).count()
-        
-        # Get next appointment (from today onwards, including future appointments today)
-        # Use localtime to get Brazil timezone (America/Sao_Paulo)
-        now = timezone.localtime(timezone.now())
-        current_time = now.time()
-        
-        # First, try to find appointments today that haven't happened yet
-        today_future_appointments = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today,
-            appointment_time__gt=current_time,
-            status__in=['scheduled', 'confirmed']
-        ).exclude(
-            status='cancelled'
-        ).order_by('appointment_time').first()
-        
-        if today_future_appointments:
-            # Next appointment is today
-            next_appointment_time = f"Hoje às {today_future_appointments.appointment_time.strftime('%H:%M')}"
-        else:
-            # Look for appointments from tomorrow onwards
-            tomorrow = today + timedelta(days=1)
-            next_appointment = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date__gte=tomorrow,
-                status__in=['scheduled', 'confirmed']
-            ).exclude(
-                status='cancelled'
-            ).order_by('appointment_date', 'appointment_time').first()
-            
-            if next_appointment:
-                if next_appointment.appointment_date == tomorrow:
-                    next_appointment_time = f"Amanhã às {next_appointment.appointment_time.strftime('%H:%M')}"
-                else:
-                    next_appointment_time = f"{next_appointment.appointment_date.strftime('%d/%m')} às {next_appointment.appointment_time.strftime('%H:%M')}"
-            else:
-                next_appointment_time = 'sem consultas próximas'
-    else:
-        # For admins without doctor selection, show aggregated stats for accessible doctors
-        total_today = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date=today
-        ).exclude(status='cancelled').count()
-        
-        completed_today = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date=today,
-            status='completed'
-        ).count()
-        
-        pending_today = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date=today,
-            status__in=['scheduled', 'confirmed']
-        ).count()
-        
-        # Get next appointment from accessible doctors
-        # Use localtime to get Brazil timezone (America/Sao_Paulo)
-        now = timezone.localtime(timezone.now())
-        current_time = now.time()
-        
-        today_future_appointments = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            appointment_date=today,
-            appointment_time__gt=current_time,
-            status__in=['scheduled', 'confirmed']
-        ).exclude(
-            status='cancelled'
-        ).order_by('appointment_time').first()
-        
-        if today_future_appointments:
-            next_appointment_time = f"Hoje às {today_future_appointments.appointment_time.strftime('%H:%M')}"
-        else:
-            tomorrow = today + timedelta(days=1)
-            next_appointment = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date__gte=tomorrow,
-                status__in=['scheduled', 'confirmed']
-            ).exclude(
-                status='cancelled'
-            ).order_by('appointment_date', 'appointment_time').first()
-            
-            if next_appointment:
-                if next_appointment.appointment_date == tomorrow:
-                    next_appointment_time = f"Amanhã às {next_appointment.appointment_time.strftime('%H:%M')}"
-                else:
-                    next_appointment_time = f"{next_appointment.appointment_date.strftime('%d/%m')} às {next_appointment.appointment_time.strftime('%H:%M')}"
-            else:
-                next_appointment_time = 'sem consultas próximas'
-    
+    stats, _ = get_agenda_stats(doctor_scope)
+
     # Get all patients for the patients tab (will be filtered by JavaScript)
     # Use utility function to filter by user role
     all_patients = get_accessible_patients(request.user).order_by('last_name', 'first_name')
@@ -180,17 +102,10 @@ def home(request):
     new_this_month = patients.filter(created_at__gte=start_of_month).count()
     
     # Pending appointments - always filter by accessible doctors
-    if current_doctor and current_doctor in accessible_doctors:
-        pending_appointments = Appointment.objects.filter(
-            doctor=current_doctor,
-            status__in=['scheduled', 'confirmed']
-        ).count()
-    else:
-        # For admins without doctor selection, show aggregated count for accessible doctors
-        pending_appointments = Appointment.objects.filter(
-            doctor__in=accessible_doctors,
-            status__in=['scheduled', 'confirmed']
-        ).count()
+    pending_appointments = Appointment.objects.filter(
+        doctor_scope,
+        status__in=['scheduled', 'confirmed']
+    ).count()
     
     # Get active tab from URL parameter, default to 'agenda'
     active_tab = request.GET.get('tab', 'agenda')
@@ -206,19 +121,15 @@ def home(request):
         'start_of_week': start_of_week,
         'end_of_week': end_of_week,
         'patients': patients,
-        'all_patients': all_patients,
+        # Loyalty status per row, computed for the whole list at once
+        'all_patients': attach_loyalty_metrics(all_patients),
         'patient_stats': {
             'total_patients': total_patients,
             'active_patients': active_patients,
             'new_this_month': new_this_month,
             'pending_appointments': pending_appointments,
         },
-        'stats': {
-            'consultas_hoje': total_today,
-            'pacientes_atendidos': completed_today,
-            'consultas_pendentes': pending_today,
-            'proxima_consulta': next_appointment_time,
-        }
+        'stats': stats,
     }
     return render(request, 'dashboard/home.html', context)
 
@@ -522,20 +433,32 @@ def api_patients(request):
         current_doctor = get_selected_doctor(request)
         
         # Patients are shared within a clinic — return all accessible patients
-        patients = get_accessible_patients(request.user).order_by('first_name', 'last_name')
+        patients_data = patient_list_data(request.user)
 
-        patients_data = []
-
-        for patient in patients:
-            patients_data.append({
-                'id': patient.id,
-                'first_name': patient.first_name,
-                'last_name': patient.last_name,
-                'email': patient.email,
-                'phone': patient.phone,
-                'cpf': patient.cpf or '',
-                'full_name': patient.full_name
+        # Optional loyalty metrics, with server-side filtering and sorting by them
+        loyalty_status = request.GET.get('loyalty_status')
+        sort = request.GET.get('sort')
+        if loyalty_status and loyalty_status not in LOYALTY_STATUSES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Status de fidelidade inválido: {loyalty_status}'
             })
+        if sort and sort.lstrip('-') not in LOYALTY_SORT_KEYS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Ordenação inválida: {sort}'
+            })
+        if request.GET.get('loyalty') or loyalty_status or sort:
+            loyalty = bulk_loyalty_metrics(get_accessible_patients(request.user))
+            for patient in patients_data:
+                patient['loyalty'] = dict(loyalty[patient['id']])
+            if loyalty_status:
+                patients_data = [patient for patient in patients_data if patient['loyalty']['status'] == loyalty_status]
+            if sort:
+                sort_by_loyalty(patients_data, sort)
+            for patient in patients_data:
+                last_visit = patient['loyalty']['last_visit']
+                patient['loyalty']['last_visit'] = last_visit.strftime('%d/%m/%Y') if last_visit else None
 
         response_data = {
             'success': True,
@@ -622,20 +545,11 @@ def api_doctors(request):
     """API endpoint to get all doctors for the appointment modal"""
     try:
         # Get only accessible doctors
-        doctors = get_accessible_doctors(request.user).filter(is_active=True).order_by('user__last_name', 'user__first_name')
-        doctors_data = []
-        
-        for doctor in doctors:
-            doctors_data.append({
-                'id': doctor.id,
-                'full_name': doctor.full_name,
-                'specialization': doctor.specialization,
-                'medical_license': doctor.medical_license
-            })
+        doctors = get_accessible_doctors(request.user).filter(is_active=True).select_related('user').order_by('user__last_name', 'user__first_name')
         
         return JsonResponse({
             'success': True,
-            'doctors': doctors_data
+            'doctors': doctor_list_data(doctors)
         })
     except Exception as e:
         return JsonResponse({
@@ -693,42 +607,23 @@ def api_appointments(request):
                 'error': 'Você não tem permissão para criar consulta para este paciente'
             })
         
-        # Check for appointment conflicts (excluding cancelled appointments)
-        existing_appointment = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=appointment_date,
-            appointment_time=appointment_time
-        ).exclude(status='cancelled').exists()
-        
-        if existing_appointment:
-            return JsonResponse({
-                'success': False,
-                'error': 'Já existe uma consulta agendada para este médico no horário selecionado'
-            })
-
-        # Check for overlap with calendar blocks
+        # Check for overlaps with other appointments and calendar blocks
         try:
             appt_date = datetime.strptime(appointment_date, '%Y-%m-%d').date()
             appt_time = datetime.strptime(appointment_time, '%H:%M').time()
-        except ValueError:
-            appt_date = None
-            appt_time = None
-        if appt_date is not None and appt_time is not None:
             duration_min = int(duration_minutes) if duration_minutes else 30
-            appt_start = timezone.make_aware(
-                datetime.combine(appt_date, appt_time),
-                timezone.get_current_timezone()
-            )
-            appt_end = appt_start + timedelta(minutes=duration_min)
-            if CalendarBlock.objects.filter(
-                doctor=current_doctor,
-                start__lt=appt_end,
-                end__gt=appt_start
-            ).exists():
-                return JsonResponse({
-                    'success': False,
-                    'error': 'Este horário está dentro de um período bloqueado na agenda. Escolha outro horário.'
-                })
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Data, horário ou duração inválidos'
+            })
+        conflict, = check_slot_conflicts([(current_doctor.id, appt_date, appt_time, duration_min)])
+        if conflict:
+            return JsonResponse({
+                'success': False,
+                'error': CONFLICT_MESSAGES[conflict['kind']],
+                'conflict': conflict
+            })
         
         # Convert value to decimal if provided
         appointment_value = None
@@ -745,9 +640,9 @@ def api_appointments(request):
         appointment = Appointment.objects.create(
             patient=patient,
             doctor=current_doctor,
-            appointment_date=appointment_date,
-            appointment_time=appointment_time,
-            duration_minutes=int(duration_minutes),
+            appointment_date=appt_date,
+            appointment_time=appt_time,
+            duration_minutes=duration_min,
             appointment_type=appointment_type,
             payment_type=payment_type,
             insurance_operator=insurance_operator if insurance_operator else None,
@@ -759,21 +654,9 @@ def api_appointments(request):
         )
         
         # Create income record if value is provided, appointment is confirmed/completed, and date is today or in the past
-        if appointment_value and appointment_value > 0 and status in ['confirmed', 'completed']:
-            from datetime import date
-            today = date.today()
-            if appointment_date <= today:
-                from .models import Income
-                Income.objects.create(
-                    doctor=current_doctor,
-                    appointment=appointment,
-                    patient=patient,
-                    amount=appointment_value,
-                    description=f"Consulta - {patient.full_name}",
-                    category=appointment_type,
-                    income_date=appointment_date,
-                    notes=f"Receita gerada pela consulta agendada para {appointment_date} às {appointment_time}"
-                )
+        income = booking_income(appointment)
+        if income:
+            income.save()
         
         return JsonResponse({
             'success': True,
@@ -787,10 +670,159 @@ def api_appointments(request):
             'error': f'Erro ao criar consulta: {str(e)}'
         })
 
+@login_required
+@require_POST
+def api_appointment_series(request):
+    """
+    API endpoint to book a recurring series (e.g. every Tuesday 14:00 for 12 weeks).
+    Conflicting occurrences are reported and skipped; the rest are created together.
+    Send dry_run=true to only check conflicts.
+    """
+    try:
+        # Get current doctor (from selection for admins, or user's doctor)
+        current_doctor = get_selected_doctor(request)
+        if not current_doctor:
+            return JsonResponse({
+                'success': False,
+                'error': 'Médico não encontrado ou sem permissão'
+            })
+        
+        # Get form data
+        patient_id = request.POST.get('patient')
+        start_date_str = request.POST.get('start_date') or request.POST.get('appointment_date')
+        appointment_time_str = request.POST.get('appointment_time')
+        payment_type = request.POST.get('payment_type')
+        dry_run = request.POST.get('dry_run', '').lower() == 'true'
+        
+        # Validate required fields
+        if not all([patient_id, start_date_str, appointment_time_str, payment_type]):
+            return JsonResponse({
+                'success': False,
+                'error': 'Paciente, data inicial, horário e tipo de pagamento são obrigatórios'
+            })
+        
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            appointment_time = datetime.strptime(appointment_time_str, '%H:%M').time()
+            occurrences = int(request.POST.get('occurrences', 1))
+            interval_weeks = int(request.POST.get('interval_weeks', 1))
+            duration_minutes = int(request.POST.get('duration_minutes') or 30)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Data, horário ou recorrência inválidos'
+            })
+        
+        if not 1 <= occurrences <= MAX_SERIES_OCCURRENCES or not 1 <= interval_weeks <= 4 or duration_minutes <= 0:
+            return JsonResponse({
+                'success': False,
+                'error': f'A série deve ter de 1 a {MAX_SERIES_OCCURRENCES} ocorrências, a cada 1 a 4 semanas'
+            })
+        
+        # Get patient object
+        try:
+            patient = Patient.objects.get(id=patient_id)
+        except Patient.DoesNotExist:
+            return JsonResponse({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            })
+        
+        # Check if user has access to this patient
+        if not has_access_to_patient(request.user, patient):
+            return JsonResponse({
+                'success': False,
+                'error': 'Você não tem permissão para criar consulta para este paciente'
+            })
+        
+        # Convert value to decimal if provided
+        value = request.POST.get('value', '')
+        appointment_value = None
+        if value and value.strip():
+            try:
+                appointment_value = Decimal(value)
+            except (ValueError, InvalidOperation):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Valor da consulta inválido'
+                })
+        
+        status = request.POST.get('status', 'scheduled')
+        if status not in ('scheduled', 'confirmed'):
+            status = 'scheduled'
+        
+        dates = series_dates(start_date, occurrences, interval_weeks)
+        try:
+            created, conflicts = create_appointment_series(
+                current_doctor,
+                patient,
+                dates,
+                appointment_time,
+                duration_minutes,
+                dry_run=dry_run,
+                appointment_type=request.POST.get('appointment_type', 'consultation'),
+                payment_type=payment_type,
+                insurance_operator=request.POST.get('insurance_operator') or None,
+                status=status,
+                reason=request.POST.get('reason', ''),
+                notes=request.POST.get('notes', ''),
+                location=request.POST.get('location', ''),
+                value=appointment_value,
+            )
+        except IntegrityError:
+            # Another booking took one of the slots between the check and the insert
+            return JsonResponse({
+                'success': False,
+                'error': 'Um dos horários da série acabou de ser ocupado. Verifique e tente novamente.'
+            })
+        
+        conflict_labels = {
+            'appointment': 'Já existe uma consulta neste horário',
+            'block': 'Horário dentro de um período bloqueado',
+        }
+        occurrences_data = [
+            {
+                'date': day.strftime('%Y-%m-%d'),
+                'time': appointment_time.strftime('%H:%M'),
+                'available': day not in conflicts,
+                'conflict': conflicts.get(day),
+                'conflict_label': conflict_labels.get(conflicts.get(day)),
+            }
+            for day in dates
+        ]
+        
+        if dry_run:
+            message = f'{occurrences - len(conflicts)} de {occurrences} ocorrência(s) disponível(is)'
+        else:
+            message = f'{len(created)} consulta(s) agendada(s) para {patient.full_name} com {current_doctor.full_name}'
+            if conflicts:
+                message += f'; {len(conflicts)} ocorrência(s) com conflito não foram agendadas'
+        
+        return JsonResponse({
+            'success': True,
+            'dry_run': dry_run,
+            'appointment_ids': [appointment.id for appointment in created],
+            'occurrences': occurrences_data,
+            'conflict_count': len(conflicts),
+            'message': message
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao criar série de consultas: {str(e)}'
+        })
+
 @login_required
 @require_http_methods(["GET"])
 def api_week_appointments(request):
-    """API endpoint to get appointments for a date range (week or month)"""
+    """
+    API endpoint to get appointments for a date range (week or month).
+
+    Responses carry an ETag (honoured through If-None-Match) and a cursor;
+    passing the cursor back as ?since= returns only the events created,
+    changed or removed since then.
+    """
     try:
         # Get current doctor (from selection for admins, or user's doctor)
         current_doctor = get_selected_doctor(request)
@@ -821,24 +853,55 @@ def api_week_appointments(request):
                 'error': 'Formato de data inválido'
             })
         
-        # Get appointments for the week (excluding cancelled)
-        # If current_doctor is set, filter by doctor; otherwise show all appointments for admins
+        # Doctor scope: the selected doctor, otherwise all appointments for admins
         if current_doctor:
-            appointments = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date__range=[start_date, end_date]
-            ).exclude(status='cancelled').order_by('appointment_date', 'appointment_time')
+            scope_tag = f'd{current_doctor.id}'
+            appointment_scope = Q(doctor=current_doctor)
+            block_scope = Q(doctor=current_doctor)
+        else:
+            scope_tag = 'all'
+            appointment_scope = Q()
+            block_scope = Q()
+
+        # Conditional GET: unchanged ranges cost four small aggregate queries and a 304
+        feed_state = get_calendar_feed_state(scope_tag, appointment_scope, block_scope, start_date, end_date)
+        if etag_matches(request, feed_state['etag']):
+            response = HttpResponseNotModified()
+            response['ETag'] = feed_state['etag']
+            return response
+
+        # Delta mode: only events changed since the client's cursor
+        since = parse_feed_cursor(request.GET.get('since'), scope_tag) if request.GET.get('since') else None
+
+        if since:
+            appointments_since, blocks_since = since
+            changed = Appointment.objects.filter(appointment_scope, updated_at__gte=appointments_since)
+            # Events whose first-appointment flag may have flipped are resent too
+            appointments = Appointment.objects.filter(appointment_scope).filter(
+                Q(updated_at__gte=appointments_since) |
+                Q(appointment_date__range=[start_date, end_date],
+                  patient__in=changed.values('patient'))
+            ).order_by('appointment_date', 'appointment_time')
         else:
-            # For admins without doctor selection, show all appointments
+            # Get appointments for the range (excluding cancelled)
             appointments = Appointment.objects.filter(
+                appointment_scope,
                 appointment_date__range=[start_date, end_date]
             ).exclude(status='cancelled').order_by('appointment_date', 'appointment_time')
         
         # Format appointments for frontend
         appointments_data = []
+        removed_ids = []  # Delta mode: cancelled or moved out of the range
         problematic_appointments = []  # Track appointments with missing patients
         
-        for appointment in appointments.select_related('patient', 'doctor'):
+        appointments = annotate_first_appointment(
+            appointments.select_related('patient', 'doctor__user')
+        )
+        for appointment in appointments:
+            if appointment.status == 'cancelled' or not (start_date <= appointment.appointment_date <= end_date):
+                removed_ids.append(appointment.id)
+                continue
+
             try:
                 # Try to access patient - this will raise DoesNotExist if patient is missing
                 patient_name = appointment.patient.full_name
@@ -862,17 +925,6 @@ def api_week_appointments(request):
                 # Skip this appointment
                 continue
             
-            # Check if this is the patient's first appointment with this doctor
-            # Count previous appointments (excluding cancelled) before this appointment date/time
-            previous_appointments_count = Appointment.objects.filter(
-                patient=appointment.patient,
-                doctor=appointment.doctor
-            ).exclude(status='cancelled').filter(
-                Q(appointment_date__lt=appointment.appointment_date) |
-                Q(appointment_date=appointment.appointment_date, appointment_time__lt=appointment.appointment_time)
-            ).count()
-            is_first_appointment = previous_appointments_count == 0
-            
             appointments_data.append({
                 'id': appointment.id,
                 'patient_name': patient_name,
@@ -888,29 +940,20 @@ def api_week_appointments(request):
                 'reason': appointment.reason,
                 'notes': appointment.notes,
                 'location': appointment.location,
-                'is_first_appointment': is_first_appointment
+                'is_first_appointment': appointment.is_first_appointment
             })
         
         # Calendar blocks in the same date range (for the selected doctor(s))
-        range_start = timezone.make_aware(
-            datetime.combine(start_date, datetime.min.time()),
-            timezone.get_current_timezone()
-        )
-        range_end = timezone.make_aware(
-            datetime.combine(end_date, datetime.max.time().replace(microsecond=0)),
-            timezone.get_current_timezone()
-        )
-        if current_doctor:
-            blocks_qs = CalendarBlock.objects.filter(
-                doctor=current_doctor,
-                start__lt=range_end,
-                end__gt=range_start
-            ).order_by('start')
-        else:
-            blocks_qs = CalendarBlock.objects.filter(
-                start__lt=range_end,
-                end__gt=range_start
-            ).order_by('start')
+        range_start, range_end = day_range_bounds(start_date, end_date)
+        blocks_qs = CalendarBlock.objects.filter(
+            block_scope,
+            start__lt=range_end,
+            end__gt=range_start
+        ).order_by('start')
+        if since:
+            # Blocks are hard-deleted, so the client also gets the ids still present
+            block_ids = [f'block-{block_id}' for block_id in blocks_qs.values_list('id', flat=True)]
+            blocks_qs = blocks_qs.filter(updated_at__gte=blocks_since)
         blocks_data = [
             {
                 'id': f'block-{b.id}',
@@ -924,6 +967,8 @@ def api_week_appointments(request):
 
         response_data = {
             'success': True,
+            'delta': bool(since),
+            'cursor': feed_state['cursor'],
             'appointments': appointments_data,
             'blocks': blocks_data,
             'start_date': start_date.strftime('%Y-%m-%d'),
@@ -931,13 +976,19 @@ def api_week_appointments(request):
             'week_start': start_date.strftime('%Y-%m-%d'),  # Keep for backward compatibility
             'week_end': end_date.strftime('%Y-%m-%d')  # Keep for backward compatibility
         }
+        if since:
+            response_data['removed_ids'] = removed_ids
+            response_data['block_ids'] = block_ids
         
         # Include problematic appointments info if any
         if problematic_appointments:
             response_data['problematic_appointments'] = problematic_appointments
             response_data['warning'] = f'Found {len(problematic_appointments)} appointment(s) with missing patients'
         
-        return JsonResponse(response_data)
+        response = JsonResponse(response_data)
+        response['ETag'] = feed_state['etag']
+        response['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         return JsonResponse({
@@ -1117,40 +1168,10 @@ def api_count_appointments_to_cancel(request):
                 'error': 'Formato de horário inválido. Use HH:MM'
             })
         
-        # Build query for appointments in date and time range (same logic as cancel)
-        if from_date == until_date:
-            # Same day: filter by time range
-            appointments_query = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=from_date,
-                appointment_time__gte=from_time,
-                appointment_time__lte=until_time
-            )
-        else:
-            # Different days: use Q objects for complex filtering
-            from django.db.models import Q
-            
-            appointments_query = Appointment.objects.filter(
-                doctor__in=accessible_doctors
-            ).filter(
-                Q(
-                    # Appointments on start date with time >= from_time
-                    appointment_date=from_date,
-                    appointment_time__gte=from_time
-                ) | Q(
-                    # Appointments on end date with time <= until_time
-                    appointment_date=until_date,
-                    appointment_time__lte=until_time
-                ) | Q(
-                    # Appointments between start and end dates (all times)
-                    appointment_date__gt=from_date,
-                    appointment_date__lt=until_date
-                )
-            )
-        
-        # Exclude completed appointments if requested
-        if exclude_completed:
-            appointments_query = appointments_query.exclude(status='completed')
+        # Same query builder as the bulk cancellation itself
+        appointments_query = build_cancellation_queryset(
+            accessible_doctors, from_date, until_date, from_time, until_time, exclude_completed
+        )
         
         # Count appointments
         count = appointments_query.count()
@@ -1279,87 +1300,56 @@ def api_bulk_cancel_appointments(request):
                 'error': 'O horário final não pode ser no passado para o dia de hoje.'
             })
         
-        # Build query for appointments in date and time range
-        # For appointments on the start date, filter by time >= from_time
-        # For appointments on the end date, filter by time <= until_time
-        # For appointments in between, include all times
-        
-        if from_date == until_date:
-            # Same day: filter by time range
-            appointments_query = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=from_date,
-                appointment_time__gte=from_time,
-                appointment_time__lte=until_time
-            )
-        else:
-            # Different days: use Q objects for complex filtering
-            from django.db.models import Q
-            
-            appointments_query = Appointment.objects.filter(
-                doctor__in=accessible_doctors
-            ).filter(
-                Q(
-                    # Appointments on start date with time >= from_time
-                    appointment_date=from_date,
-                    appointment_time__gte=from_time
-                ) | Q(
-                    # Appointments on end date with time <= until_time
-                    appointment_date=until_date,
-                    appointment_time__lte=until_time
-                ) | Q(
-                    # Appointments between start and end dates (all times)
-                    appointment_date__gt=from_date,
-                    appointment_date__lt=until_date
-                )
-            )
-        
-        # Exclude completed appointments if requested
-        if exclude_completed:
-            appointments_query = appointments_query.exclude(status='completed')
-        
-        # Get appointments to cancel
-        appointments = appointments_query.all()
+        appointments_query = build_cancellation_queryset(
+            accessible_doctors, from_date, until_date, from_time, until_time, exclude_completed
+        )
         
-        if not appointments.exists():
+        appointment_ids = list(appointments_query.values_list('id', flat=True))
+        if not appointment_ids:
             return JsonResponse({
                 'success': False,
                 'error': 'Nenhuma consulta encontrada no período selecionado para cancelar'
             })
         
-        # Cancel all appointments
-        cancelled_count = 0
-        income_deleted_count = 0
-        errors = []
-        
-        for appointment in appointments:
-            try:
-                # Remove any associated income records
-                associated_incomes = Income.objects.filter(appointment=appointment)
-                if associated_incomes.exists():
-                    income_deleted_count += associated_incomes.count()
-                    associated_incomes.delete()
-                
-                # Cancel the appointment
-                appointment.cancel(cancellation_reason)
-                cancelled_count += 1
-            except Exception as e:
-                errors.append(f'Erro ao cancelar consulta {appointment.id}: {str(e)}')
-        
-        # Build response message
-        message = f'{cancelled_count} consulta(s) cancelada(s) com sucesso'
-        if income_deleted_count > 0:
-            message += f' e {income_deleted_count} receita(s) removida(s)'
+        # Very large ranges run as a background job; the client polls api_job_status
+        run_in_background = request.POST.get('background', '').lower() == 'true'
+        if run_in_background or len(appointment_ids) > BULK_CANCEL_BACKGROUND_THRESHOLD:
+            job = submit_job(
+                'bulk_cancel',
+                request.user,
+                run_bulk_cancel_job,
+                params={
+                    'from_date': from_date_str,
+                    'until_date': until_date_str,
+                    'from_time': from_time_str,
+                    'until_time': until_time_str,
+                    'exclude_completed': exclude_completed,
+                },
+                total=len(appointment_ids),
+                appointment_ids=appointment_ids,
+                reason=cancellation_reason,
+                exclude_completed=exclude_completed,
+            )
+            return JsonResponse({
+                'success': True,
+                'background': True,
+                'job_id': job.id,
+                'total': len(appointment_ids),
+                'status_url': reverse('dashboard:api_job_status', args=[job.id]),
+                'message': f'Cancelamento de {len(appointment_ids)} consulta(s) iniciado em segundo plano'
+            })
         
-        if errors:
-            message += f'. {len(errors)} erro(s) ocorreram durante o processo.'
+        # One transactional bulk update plus one bulk income delete
+        cancelled_count, income_deleted_count = bulk_cancel_appointments(
+            Appointment.objects.filter(id__in=appointment_ids), cancellation_reason
+        )
         
         return JsonResponse({
             'success': True,
-            'message': message,
+            'message': format_cancel_message(cancelled_count, income_deleted_count),
             'cancelled_count': cancelled_count,
             'income_deleted_count': income_deleted_count,
-            'errors': errors if errors else None
+            'errors': None
         })
         
     except Exception as e:
@@ -1369,6 +1359,25 @@ def api_bulk_cancel_appointments(request):
         })
 
 
+@login_required
+@require_http_methods(["GET"])
+def api_job_status(request, job_id):
+    """API endpoint to poll the status/progress of a background job"""
+    jobs = BackgroundJob.objects.filter(id=job_id, created_by=request.user)
+    # A job whose process was restarted would otherwise stay pending forever
+    fail_orphaned_jobs(jobs)
+    job = jobs.first()
+    if not job:
+        return JsonResponse({
+            'success': False,
+            'error': 'Tarefa não encontrada'
+        }, status=404)
+    return JsonResponse({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+
 @login_required
 @require_POST
 def api_create_calendar_block(request):
@@ -1799,12 +1808,32 @@ def api_update_appointment(request):
             })
         
         # Update appointment fields if provided
-        if appointment_date:
-            appointment.appointment_date = appointment_date
-        if appointment_time:
-            appointment.appointment_time = appointment_time
-        if duration_minutes:
-            appointment.duration_minutes = int(duration_minutes)
+        try:
+            if appointment_date:
+                appointment.appointment_date = datetime.strptime(appointment_date, '%Y-%m-%d').date()
+            if appointment_time:
+                appointment.appointment_time = datetime.strptime(appointment_time[:5], '%H:%M').time()
+            if duration_minutes:
+                appointment.duration_minutes = int(duration_minutes)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Data, horário ou duração inválidos'
+            })
+        
+        # Moving or resizing must not overlap other appointments or calendar blocks
+        if (appointment_date or appointment_time or duration_minutes) and (status or appointment.status) != 'cancelled':
+            conflict, = check_slot_conflicts(
+                [(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time, appointment.duration_minutes)],
+                exclude_appointment_ids=[appointment.id]
+            )
+            if conflict:
+                return JsonResponse({
+                    'success': False,
+                    'error': CONFLICT_MESSAGES[conflict['kind']],
+                    'conflict': conflict
+                })
+        
         if status:
             # Validate status
             valid_statuses = [choice[0] for choice in Appointment.STATUS_CHOICES]
@@ -1849,48 +1878,11 @@ def api_next_appointment(request):
             })
         
         # Get next appointment using the same logic as in home view
-        # Use localtime to get Brazil timezone (America/Sao_Paulo)
-        now = timezone.localtime(timezone.now())
-        today = now.date()
-        current_time = now.time()
-        
-        # First, try to find appointments today that haven't happened yet
-        today_future_appointments = Appointment.objects.filter(
-            doctor=current_doctor,
-            appointment_date=today,
-            appointment_time__gt=current_time,
-            status__in=['scheduled', 'confirmed']
-        ).exclude(
-            status='cancelled'
-        ).order_by('appointment_time').first()
-        
-        if today_future_appointments:
-            next_appointment = today_future_appointments
-        else:
-            # Look for appointments from tomorrow onwards
-            tomorrow = today + timedelta(days=1)
-            next_appointment = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date__gte=tomorrow,
-                status__in=['scheduled', 'confirmed']
-            ).exclude(
-                status='cancelled'
-            ).order_by('appointment_date', 'appointment_time').first()
-        
-        if next_appointment:
+        appointment_data = next_appointment_data(current_doctor)
+        if appointment_data:
             return JsonResponse({
                 'success': True,
-                'appointment': {
-                    'id': next_appointment.id,
-                    'patient_name': next_appointment.patient.full_name,
-                    'appointment_date': next_appointment.appointment_date.strftime('%d/%m/%Y'),
-                    'appointment_time': next_appointment.appointment_time.strftime('%H:%M'),
-                    'appointment_type': next_appointment.get_appointment_type_display(),
-                    'status': next_appointment.status,
-                    'location': next_appointment.location or 'Consultório',
-                    'reason': next_appointment.reason or 'Consulta médica',
-                    'notes': next_appointment.notes or 'Nenhuma observação'
-                }
+                'appointment': appointment_data
             })
         else:
             return JsonResponse({
@@ -1912,126 +1904,280 @@ def api_agenda_stats(request):
         # Get current doctor (from selection for admins, or user's doctor)
         current_doctor = get_selected_doctor(request)
         
-        # Use localtime to get Brazil timezone (America/Sao_Paulo)
-        now = timezone.localtime(timezone.now())
-        today = now.date()
-        current_time = now.time()
-
         # Get accessible doctors for filtering
         accessible_doctors = get_accessible_doctors(request.user)
+        doctor_scope = get_doctor_scope(current_doctor, accessible_doctors)
+
+        stats, query_count = get_agenda_stats(doctor_scope)
+
+        return JsonResponse({
+            'success': True,
+            'stats': stats,
+            'query_count': query_count,
+        })
         
-        # Calculate stats - always filter by accessible doctors
-        if current_doctor and current_doctor in accessible_doctors:
-            total_today = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date=today
-            ).exclude(status='cancelled').count()
-            completed_today = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date=today,
-                status='completed'
-            ).count()
-            
-            pending_today = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date=today,
-                status__in=['scheduled', 'confirmed']
-            ).count()
-            
-            # Get next appointment (from today onwards, including future appointments today)
-            # First, try to find appointments today that haven't happened yet
-            today_future_appointments = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date=today,
-                appointment_time__gt=current_time,
-                status__in=['scheduled', 'confirmed']
-            ).exclude(
-                status='cancelled'
-            ).order_by('appointment_time').first()
-            
-            if today_future_appointments:
-                # Next appointment is today
-                next_appointment_time = f"Hoje às {today_future_appointments.appointment_time.strftime('%H:%M')}"
-            else:
-                # Look for appointments from tomorrow onwards
-                tomorrow = today + timedelta(days=1)
-                next_appointment = Appointment.objects.filter(
-                    doctor=current_doctor,
-                    appointment_date__gte=tomorrow,
-                    status__in=['scheduled', 'confirmed']
-                ).exclude(
-                    status='cancelled'
-                ).order_by('appointment_date', 'appointment_time').first()
-                
-                if next_appointment:
-                    if next_appointment.appointment_date == tomorrow:
-                        next_appointment_time = f"Amanhã às {next_appointment.appointment_time.strftime('%H:%M')}"
-                    else:
-                        next_appointment_time = f"{next_appointment.appointment_date.strftime('%d/%m')} às {next_appointment.appointment_time.strftime('%H:%M')}"
-                else:
-                    next_appointment_time = 'sem consultas próximas'
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao buscar estatísticas: {str(e)}'
+        })
+
+@login_required
+@require_http_methods(["GET"])
+def api_bootstrap(request):
+    """
+    API endpoint with everything the dashboard needs for its first paint:
+    agenda stats, next appointment, appointment settings, patients and
+    doctors, resolved with a single access context.
+    """
+    try:
+        with QueryCounter() as counter:
+            context = AccessContext(request.user, get_selected_doctor(request))
+            stats, _ = get_agenda_stats(context.doctor_scope)
+            selected_doctor = context.selected_doctor
+            payload = {
+                'success': True,
+                'role': context.role,
+                'selected_doctor': {
+                    'id': selected_doctor.id,
+                    'full_name': selected_doctor.full_name
+                } if selected_doctor else None,
+                'stats': stats,
+                'next_appointment': next_appointment_data(context.own_doctor),
+                'settings': appointment_settings_data(AppointmentSettings.get_settings()),
+                'patients': patient_list_data(request.user),
+                'doctors': doctor_list_data(context.accessible_doctors),
+            }
+        payload['patient_count'] = len(payload['patients'])
+        payload['query_count'] = counter.count
+        if counter.count > BOOTSTRAP_QUERY_BUDGET:
+            import logging
+            logging.getLogger(__name__).warning(
+                "Dashboard bootstrap used %s queries (budget %s)", counter.count, BOOTSTRAP_QUERY_BUDGET
+            )
+        return JsonResponse(payload)
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao carregar painel: {str(e)}'
+        })
+
+def _agenda_doctor_ids(request):
+    """Doctors whose agenda is open: the selected doctor, or every accessible doctor."""
+    current_doctor = get_selected_doctor(request)
+    accessible_doctors = get_accessible_doctors(request.user)
+    if current_doctor and current_doctor in accessible_doctors:
+        return [current_doctor.id]
+    return list(accessible_doctors.values_list('id', flat=True))
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_agenda_stream(request):
+    """
+    Server-sent-events stream of live agenda changes (appointments and
+    calendar blocks) for the selected doctor, or every accessible doctor
+    when none is selected. Replaces client-side polling.
+    """
+    if not live_updates_streaming():
+        # 204 tells EventSource not to reconnect; the dashboard polls api_agenda_changes
+        return HttpResponse(status=204)
+
+    doctor_ids = _agenda_doctor_ids(request)
+    if not doctor_ids:
+        return JsonResponse({
+            'success': False,
+            'error': 'Médico não encontrado ou sem permissão'
+        }, status=403)
+
+    subscription = get_broker().subscribe([agenda_channel(doctor_id) for doctor_id in doctor_ids])
+    response = StreamingHttpResponse(sse_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # disable proxy buffering (nginx)
+    return response
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_agenda_changes(request):
+    """
+    Polling counterpart of api_agenda_stream: a state token that changes
+    whenever an appointment or calendar block of the open agenda does
+    (optionally counting rows in the ?start=&end= range, to catch deletes).
+    Unchanged agendas cost four small aggregate queries and a 304.
+    """
+    doctor_ids = _agenda_doctor_ids(request)
+    if not doctor_ids:
+        return JsonResponse({
+            'success': False,
+            'error': 'Médico não encontrado ou sem permissão'
+        }, status=403)
+
+    today = timezone.localdate()
+    try:
+        start_date = datetime.strptime(request.GET.get('start') or today.isoformat(), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.GET.get('end') or start_date.isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Formato de data inválido'
+        })
+
+    scope = Q(doctor_id__in=doctor_ids)
+    state = get_calendar_feed_state(
+        'd' + '-'.join(map(str, doctor_ids)), scope, scope, start_date, end_date
+    )
+    if etag_matches(request, state['etag']):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({
+            'success': True,
+            'state': state['etag'],
+        })
+    response['ETag'] = state['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+def api_available_slots(request):
+    """
+    API endpoint to get free appointment slots for a doctor over a date range.
+    Uses working hours/days from AppointmentSettings and skips calendar blocks.
+    """
+    try:
+        doctor_id = request.GET.get('doctor_id')
+        if doctor_id:
+            doctor = Doctor.objects.filter(id=doctor_id).first()
+            if not doctor or not can_access_doctor(request.user, doctor):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Médico não encontrado ou sem permissão'
+                })
         else:
-            # For admins without doctor selection, show aggregated stats for accessible doctors
-            total_today = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=today
-            ).exclude(status='cancelled').count()
-            completed_today = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=today,
-                status='completed'
-            ).count()
-            
-            pending_today = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=today,
-                status__in=['scheduled', 'confirmed']
-            ).count()
-            
-            # Get next appointment from accessible doctors
-            today_future_appointments = Appointment.objects.filter(
-                doctor__in=accessible_doctors,
-                appointment_date=today,
-                appointment_time__gt=current_time,
-                status__in=['scheduled', 'confirmed']
-            ).exclude(
-                status='cancelled'
-            ).order_by('appointment_time').first()
-            
-            if today_future_appointments:
-                next_appointment_time = f"Hoje às {today_future_appointments.appointment_time.strftime('%H:%M')}"
-            else:
-                tomorrow = today + timedelta(days=1)
-                next_appointment = Appointment.objects.filter(
-                    doctor__in=accessible_doctors,
-                    appointment_date__gte=tomorrow,
-                    status__in=['scheduled', 'confirmed']
-                ).exclude(
-                    status='cancelled'
-                ).order_by('appointment_date', 'appointment_time').first()
-                
-                if next_appointment:
-                    if next_appointment.appointment_date == tomorrow:
-                        next_appointment_time = f"Amanhã às {next_appointment.appointment_time.strftime('%H:%M')}"
-                    else:
-                        next_appointment_time = f"{next_appointment.appointment_date.strftime('%d/%m')} às {next_appointment.appointment_time.strftime('%H:%M')}"
-                else:
-                    next_appointment_time = 'sem consultas próximas'
-        
+            doctor = get_selected_doctor(request)
+            if not doctor:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Médico não encontrado ou sem permissão'
+                })
+
+        today = timezone.localtime(timezone.now()).date()
+        try:
+            start_date = datetime.strptime(request.GET.get('start') or today.isoformat(), '%Y-%m-%d').date()
+            end_date = datetime.strptime(
+                request.GET.get('end') or (start_date + timedelta(days=6)).isoformat(), '%Y-%m-%d'
+            ).date()
+            duration = int(request.GET.get('duration') or 30)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parâmetros inválidos'
+            })
+        if end_date < start_date or (end_date - start_date).days > 92 or duration <= 0:
+            return JsonResponse({
+                'success': False,
+                'error': 'Intervalo de datas inválido (máximo 92 dias)'
+            })
+
+        availability = Availability([doctor], start_date, end_date)
+        slots = availability.slots_by_day(doctor.id, duration=duration, now=timezone.now())
+
         return JsonResponse({
             'success': True,
-            'stats': {
-                'consultas_hoje': total_today,
-                'pacientes_atendidos': completed_today,
-                'consultas_pendentes': pending_today,
-                'proxima_consulta': next_appointment_time,
+            'doctor_id': doctor.id,
+            'duration_minutes': duration,
+            'slots': {
+                day.isoformat(): [slot.strftime('%H:%M') for slot in day_slots]
+                for day, day_slots in slots.items()
             }
         })
-        
+
     except Exception as e:
         return JsonResponse({
             'success': False,
-            'error': f'Erro ao buscar estatísticas: {str(e)}'
+            'error': f'Erro ao buscar horários disponíveis: {str(e)}'
+        })
+
+@login_required
+@require_http_methods(["POST"])
+def api_check_slot_conflicts(request):
+    """
+    API endpoint to check many candidate slots in one call. JSON body:
+    {"doctor_id": optional, "exclude_appointment_id": optional,
+     "slots": [{"date": "YYYY-MM-DD", "time": "HH:MM", "duration_minutes": 30, "doctor_id": optional}]}
+    Each slot is answered with free=true, or the appointment/block it overlaps
+    and the message the booking endpoints would reject it with.
+    """
+    try:
+        import json
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'JSON inválido'
+            })
+        slots = data.get('slots') or []
+        if not isinstance(slots, list) or not slots or len(slots) > MAX_CONFLICT_CHECK_SLOTS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Informe entre 1 e {MAX_CONFLICT_CHECK_SLOTS} horários'
+            })
+
+        accessible_doctor_ids = set(get_accessible_doctors(request.user).values_list('id', flat=True))
+        default_doctor_id = data.get('doctor_id')
+        if not default_doctor_id:
+            selected_doctor = get_selected_doctor(request)
+            default_doctor_id = selected_doctor.id if selected_doctor else None
+
+        candidates = []
+        try:
+            for slot in slots:
+                doctor_id = int(slot.get('doctor_id') or default_doctor_id or 0)
+                if doctor_id not in accessible_doctor_ids:
+                    return JsonResponse({
+                        'success': False,
+                        'error': 'Médico não encontrado ou sem permissão'
+                    })
+                candidates.append((
+                    doctor_id,
+                    datetime.strptime(slot['date'], '%Y-%m-%d').date(),
+                    datetime.strptime(str(slot['time'])[:5], '%H:%M').time(),
+                    int(slot.get('duration_minutes') or 30),
+                ))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return JsonResponse({
+                'success': False,
+                'error': 'Horários inválidos'
+            })
+
+        exclude_ids = [data['exclude_appointment_id']] if data.get('exclude_appointment_id') else []
+        conflicts = check_slot_conflicts(candidates, exclude_appointment_ids=exclude_ids)
+
+        results = []
+        for (doctor_id, day, start, duration), conflict in zip(candidates, conflicts):
+            results.append({
+                'doctor_id': doctor_id,
+                'date': day.isoformat(),
+                'time': start.strftime('%H:%M'),
+                'duration_minutes': duration,
+                'free': conflict is None,
+                'conflict': conflict,
+                'message': CONFLICT_MESSAGES[conflict['kind']] if conflict else None,
+            })
+
+        return JsonResponse({
+            'success': True,
+            'results': results,
+            'free_count': sum(1 for result in results if result['free'])
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao verificar conflitos: {str(e)}'
         })
 
 # Prescription Views
@@ -2443,14 +2589,6 @@ def api_print_prescription(request):
 def api_generate_prescription_pdf(request):
     """API endpoint to generate a professional PDF prescription"""
     try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib import colors
-        from reportlab.lib.units import inch, cm
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, KeepTogether
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT, TA_JUSTIFY
-        from io import BytesIO
-        
         prescription_id = request.GET.get('prescription_id')
         
         if not prescription_id:
@@ -2475,246 +2613,21 @@ def api_generate_prescription_pdf(request):
                 'error': 'Você não tem permissão para acessar esta prescrição'
             })
         
-        # Create PDF buffer
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=2*cm,
-            leftMargin=2*cm,
-            topMargin=2*cm,
-            bottomMargin=2*cm
-        )
-        
-        # Container for the PDF elements
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'PrescriptionTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1a5490'),
-            spaceAfter=20,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
-        
-        header_style = ParagraphStyle(
-            'PrescriptionHeader',
-            parent=styles['Heading2'],
-            fontSize=14,
-            textColor=colors.HexColor('#2c3e50'),
-            spaceAfter=10,
-            fontName='Helvetica-Bold'
-        )
-        
-        info_style = ParagraphStyle(
-            'PrescriptionInfo',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#333333'),
-            spaceAfter=8,
-            leading=14
-        )
-        
-        medication_name_style = ParagraphStyle(
-            'MedicationName',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.HexColor('#1a5490'),
-            spaceAfter=5,
-            fontName='Helvetica-Bold',
-            leading=16
-        )
-        
-        medication_detail_style = ParagraphStyle(
-            'MedicationDetail',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#555555'),
-            spaceAfter=4,
-            leftIndent=20,
-            leading=14
-        )
-        
-        notes_style = ParagraphStyle(
-            'PrescriptionNotes',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#666666'),
-            spaceAfter=8,
-            alignment=TA_JUSTIFY,
-            leading=14
-        )
-        
-        # Header with decorative line
-        story.append(Spacer(1, 0.3*inch))
-        story.append(Paragraph("PRESCRIÇÃO MÉDICA", title_style))
-        
-        # Decorative line
-        line_data = [['']]
-        line_table = Table(line_data, colWidths=[6*inch])
-        line_table.setStyle(TableStyle([
-            ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor('#1a5490')),
-            ('TOPPADDING', (0, 0), (-1, -1), 0),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ]))
-        story.append(line_table)
-        story.append(Spacer(1, 0.25*inch))
-        
-        # Date and Prescription Number - Minimalist at top
-        date_style = ParagraphStyle(
-            'DateStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#666666'),
-            spaceAfter=20,
-            alignment=TA_RIGHT
-        )
-        date_text = f"{prescription.prescription_date.strftime('%d/%m/%Y')} • Prescrição Nº {prescription.id}"
-        story.append(Paragraph(date_text, date_style))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Patient and Doctor Information — side-by-side layout
-        SPECIALIZATION_PT = {
-            'general_practice': 'Clínica Geral',
-            'cardiology': 'Cardiologia',
-            'dermatology': 'Dermatologia',
-            'gynecology': 'Ginecologia e Obstetrícia',
-            'neurology': 'Neurologia',
-            'orthopedics': 'Ortopedia e Traumatologia',
-            'pediatrics': 'Pediatria',
-            'psychiatry': 'Psiquiatria',
-            'endocrinology': 'Endocrinologia',
-            'gastroenterology': 'Gastroenterologia',
-            'ophthalmology': 'Oftalmologia',
-            'otorhinolaryngology': 'Otorrinolaringologia',
-            'urology': 'Urologia',
-            'rheumatology': 'Reumatologia',
-            'oncology': 'Oncologia',
-            'surgery': 'Cirurgia Geral',
-            'internal_medicine': 'Medicina Interna',
-            'infectology': 'Infectologia',
-            'nephrology': 'Nefrologia',
-            'hematology': 'Hematologia',
-        }
+        # Conditional GET: the content digest is the ETag, so a client holding
+        # the current version gets a 304 without the file being read
+        digest = prescription_pdf_digest(prescription)
+        etag = prescription_pdf_etag(digest)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        _digest, pdf_data = stored_prescription_pdf(prescription, digest)
 
-        patient_info = f"<b>PACIENTE</b><br/>{prescription.patient.full_name}"
-        if prescription.patient.cpf:
-            patient_info += f"<br/><font size='9' color='#999999'>CPF: {prescription.patient.cpf}</font>"
-        if prescription.patient.date_of_birth:
-            age = prescription.patient.age
-            if age is not None:
-                patient_info += f"<br/><font size='9' color='#999999'>Idade: {age} anos</font>"
-
-        spec_raw = prescription.doctor.specialization or ''
-        spec_display = SPECIALIZATION_PT.get(spec_raw.lower().replace(' ', '_'), spec_raw)
-
-        doctor_info = f"<b>MÉDICO</b><br/>{prescription.doctor.full_name}"
-        if prescription.doctor.medical_license:
-            doctor_info += f"<br/><font size='9' color='#999999'>CRM: {prescription.doctor.medical_license}</font>"
-        if spec_display:
-            doctor_info += f"<br/><font size='9' color='#999999'>{spec_display}</font>"
-
-        combined_row = Table(
-            [[Paragraph(patient_info, info_style), Paragraph(doctor_info, info_style)]],
-            colWidths=[3*inch, 3*inch]
-        )
-        combined_row.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#fafafa')),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#333333')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 12),
-            ('LEFTPADDING', (0, 0), (-1, -1), 15),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LINEBELOW', (0, 0), (-1, -1), 0.5, colors.HexColor('#e0e0e0')),
-            ('LINEBETWEEN', (0, 0), (0, -1), 0.5, colors.HexColor('#e0e0e0')),
-        ]))
-        story.append(combined_row)
-        story.append(Spacer(1, 0.4*inch))
-        
-        # Medications section
-        story.append(Paragraph("MEDICAMENTOS PRESCRITOS", header_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Medication items
-        for idx, item in enumerate(prescription.items.all(), 1):
-            medication_block = []
-            
-            # Medication name with number
-            med_name = f"{idx}. {item.medication_name}"
-            medication_block.append(Paragraph(med_name, medication_name_style))
-            
-            # Quantity
-            if item.quantity:
-                medication_block.append(Paragraph(f"<b>Quantidade:</b> {item.quantity}", medication_detail_style))
-            
-            # Dosage
-            if item.dosage:
-                medication_block.append(Paragraph(f"<b>Posologia:</b> {item.dosage}", medication_detail_style))
-            
-            # Notes
-            if item.notes:
-                medication_block.append(Paragraph(f"<b>Observações:</b> {item.notes}", medication_detail_style))
-            
-            # Add spacing between medications
-            if idx < prescription.items.count():
-                medication_block.append(Spacer(1, 0.15*inch))
-            
-            # Keep medication together
-            story.append(KeepTogether(medication_block))
-        
-        # Additional notes section
-        if prescription.notes:
-            story.append(Spacer(1, 0.3*inch))
-            story.append(Paragraph("OBSERVAÇÕES GERAIS", header_style))
-            story.append(Spacer(1, 0.15*inch))
-            story.append(Paragraph(prescription.notes, notes_style))
-        
-        # Footer with signature area
-        story.append(Spacer(1, 0.5*inch))
-        
-        # Signature line
-        signature_data = [['']]
-        signature_table = Table(signature_data, colWidths=[6*inch])
-        signature_table.setStyle(TableStyle([
-            ('LINEABOVE', (0, 0), (-1, -1), 1, colors.HexColor('#333333')),
-            ('TOPPADDING', (0, 0), (-1, -1), 30),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-        ]))
-        story.append(signature_table)
-        
-        signature_text = Paragraph(
-            f"<i>{prescription.doctor.full_name}<br/>CRM: {prescription.doctor.medical_license or 'N/A'}</i>",
-            ParagraphStyle(
-                'Signature',
-                parent=styles['Normal'],
-                fontSize=10,
-                textColor=colors.HexColor('#666666'),
-                alignment=TA_CENTER,
-                spaceAfter=0
-            )
-        )
-        story.append(signature_text)
-        
-        # Build PDF
-        doc.build(story)
-        
-        # Get PDF data
-        buffer.seek(0)
-        pdf_data = buffer.getvalue()
-        buffer.close()
-        
-        # Create HTTP response
         response = HttpResponse(pdf_data, content_type='application/pdf')
-        filename = f"prescricao_{prescription.patient.full_name.replace(' ', '_')}_{prescription.prescription_date.strftime('%Y%m%d')}.pdf"
-        response['Content-Disposition'] = f'inline; filename="{filename}"'
+        response['Content-Disposition'] = f'inline; filename="{prescription_pdf_filename(prescription)}"'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
         
     except ImportError:
@@ -2791,19 +2704,7 @@ def api_get_appointment_settings(request):
         settings = AppointmentSettings.get_settings()
         return JsonResponse({
             'success': True,
-            'settings': {
-                'duration_options': settings.duration_options,
-                'type_choices': settings.type_choices,
-                'status_choices': settings.status_choices,
-                'status_colors': settings.status_colors if settings.status_colors else {},
-                'location_options': settings.location_options,
-                'insurance_operators': settings.insurance_operators if settings.insurance_operators else [],
-                'cancellation_reasons': settings.cancellation_reasons if settings.cancellation_reasons else [],
-                'convenio_prices': settings.convenio_prices if settings.convenio_prices is not None else {},
-                'work_start_time': settings.work_start_time or '08:00',
-                'work_end_time': settings.work_end_time or '18:00',
-                'work_days': settings.work_days if settings.work_days else [1, 2, 3, 4, 5],
-            }
+            'settings': appointment_settings_data(settings)
         })
     except Exception as e:
         return JsonResponse({
@@ -2962,6 +2863,46 @@ def _month_label_to_date(label):
         return date(2000, 1, 1)
 
 
+def _indicators_period(request, today):
+    """(start_date, end_date) from the year + month or period GET parameters of the indicator endpoints."""
+    year_param = request.GET.get('year')
+    month_param = request.GET.get('month')
+    period = request.GET.get('period', 'month')
+
+    if year_param is not None and month_param is not None:
+        try:
+            y, m = int(year_param), int(month_param)
+            if 1 <= m <= 12 and y >= 2020:
+                start_date = date(y, m, 1)
+                if m == 12:
+                    end_date = date(y, 12, 31)
+                else:
+                    end_date = date(y, m + 1, 1) - timedelta(days=1)
+            else:
+                start_date = date(today.year, today.month, 1)
+                end_date = today
+        except (ValueError, TypeError):
+            start_date = date(today.year, today.month, 1)
+            end_date = today
+    elif period == '30':
+        start_date = today - timedelta(days=30)
+        end_date = today
+    elif period == 'month':
+        start_date = date(today.year, today.month, 1)
+        end_date = today
+    elif period == 'quarter':
+        quarter = (today.month - 1) // 3
+        start_date = date(today.year, quarter * 3 + 1, 1)
+        end_date = today
+    elif period == 'year':
+        start_date = date(today.year, 1, 1)
+        end_date = today
+    else:
+        start_date = date(today.year, today.month, 1)
+        end_date = today
+    return start_date, end_date
+
+
 @login_required
 @require_http_methods(["GET"])
 def api_indicators(request):
@@ -2982,331 +2923,200 @@ def api_indicators(request):
                 'error': 'Nenhum médico selecionado ou use Todos para ver os indicadores'
             })
 
-        # Get period: optional year + month for specific month selection
-        from datetime import date, timedelta
         from django.utils import timezone
 
         today = timezone.now().date()
-        year_param = request.GET.get('year')
-        month_param = request.GET.get('month')
-        period = request.GET.get('period', 'month')
+        start_date, end_date = _indicators_period(request, today)
 
-        if year_param is not None and month_param is not None:
-            try:
-                y, m = int(year_param), int(month_param)
-                if 1 <= m <= 12 and y >= 2020:
-                    start_date = date(y, m, 1)
-                    if m == 12:
-                        end_date = date(y, 12, 31)
-                    else:
-                        end_date = date(y, m + 1, 1) - timedelta(days=1)
-                else:
-                    start_date = date(today.year, today.month, 1)
-                    end_date = today
-            except (ValueError, TypeError):
-                start_date = date(today.year, today.month, 1)
-                end_date = today
-        elif period == '30':
-            start_date = today - timedelta(days=30)
-            end_date = today
-        elif period == 'month':
-            start_date = date(today.year, today.month, 1)
-            end_date = today
-        elif period == 'quarter':
-            quarter = (today.month - 1) // 3
-            start_date = date(today.year, quarter * 3 + 1, 1)
-            end_date = today
-        elif period == 'year':
-            start_date = date(today.year, 1, 1)
-            end_date = today
-        else:
-            start_date = date(today.year, today.month, 1)
-            end_date = today
+        from accounts.utils import get_clinic_for_user
+        user_clinic = get_clinic_for_user(request.user)
+        total_patients = Patient.objects.filter(clinic=user_clinic, is_active=True).count() if user_clinic else 0
 
-        appointments = Appointment.objects.filter(
-            doctor__in=doctors_filter,
-            appointment_date__gte=start_date,
-            appointment_date__lte=end_date
+        settings = AppointmentSettings.objects.first()
+        churn_months = settings.churn_threshold_months if settings else 12
+        risk_months = settings.churn_risk_months if settings else 6
+
+        # Retention matrix size: cohorts (rows) x follow-up months (columns)
+        try:
+            retention_cohorts = int(request.GET.get('cohorts', RETENTION_COHORTS))
+            retention_months = int(request.GET.get('cohort_months', RETENTION_FOLLOW_UP_MONTHS))
+        except (ValueError, TypeError):
+            retention_cohorts, retention_months = RETENTION_COHORTS, RETENTION_FOLLOW_UP_MONTHS
+        retention_cohorts = min(max(retention_cohorts, 1), RETENTION_MAX_COHORTS)
+        retention_months = min(max(retention_months, 1), RETENTION_MAX_FOLLOW_UP_MONTHS)
+
+        def build_indicators():
+            # Every metric, series and cohort comes from one scan of the appointment rows
+            metrics = compute_indicators(
+                doctors_filter, start_date, end_date, today,
+                churn_months=churn_months, risk_months=risk_months,
+                retention_cohorts=retention_cohorts, retention_months=retention_months,
+                settings=settings
+            )
+
+            # Determine doctor start date (earliest created_at across doctors in filter)
+            doctor_start_str = ''
+            earliest = min((d.created_at.date() for d in doctors_filter), default=None)
+            if earliest:
+                doctor_start_str = earliest.strftime('%Y-%m')
+                # Remove monthly series entries that pre-date the doctor's join date
+                for series in ('monthly_agenda', 'monthly_patients'):
+                    metrics[series] = [
+                        m for m in metrics[series]
+                        if _month_label_to_date(m['month']) >= date(earliest.year, earliest.month, 1)
+                    ]
+            return doctor_start_str, metrics
+
+        # Patient history spans every month, so any change to the doctors' data invalidates
+        doctor_ids = sorted(d.id for d in doctors_filter)
+        (doctor_start_str, metrics), cache_outcome = cached_result(
+            'indicators',
+            (doctor_ids, start_date, end_date, today, churn_months, risk_months, retention_cohorts, retention_months,
+             settings.work_start_time if settings else None, settings.work_end_time if settings else None,
+             settings.work_days if settings else None),
+            lambda: data_version(doctor_ids), build_indicators
+        )
+        metrics = dict(metrics, total_patients=total_patients)
+
+        response = JsonResponse({
+            'success': True,
+            'doctor_start': doctor_start_str,
+            'metrics': metrics
+        })
+        response['X-Result-Cache'] = cache_outcome
+        return response
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao calcular indicadores: {str(e)}'
+        })
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_indicators_comparison(request):
+    """API endpoint comparing the period KPIs of every accessible doctor side by side."""
+    try:
+        doctors = list(get_accessible_doctors(request.user).select_related('user'))
+        if not doctors:
+            return JsonResponse({
+                'success': False,
+                'error': 'Nenhum médico disponível para comparação'
+            })
+
+        from django.utils import timezone
+
+        today = timezone.now().date()
+        start_date, end_date = _indicators_period(request, today)
+        settings = AppointmentSettings.objects.first()
+
+        # New and active patients look at every month, so any change to the doctors' data invalidates
+        doctor_ids = sorted(d.id for d in doctors)
+        comparison, cache_outcome = cached_result(
+            'indicators_comparison',
+            (doctor_ids, start_date, end_date, today,
+             settings.work_start_time if settings else None, settings.work_end_time if settings else None,
+             settings.work_days if settings else None),
+            lambda: data_version(doctor_ids),
+            lambda: compare_doctors(doctor_ids, start_date, end_date, today, settings=settings)
         )
 
-        total_appointments = appointments.count()
-        completed_count = appointments.filter(status='completed').count()
-        no_show_count = appointments.filter(status='no_show').count()
-        cancelled_count = appointments.filter(status='cancelled').count()
-        attended_count = completed_count
+        response = JsonResponse({
+            'success': True,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'doctors': [
+                dict(comparison[doctor.id], doctor_id=doctor.id, doctor_name=doctor.full_name)
+                for doctor in doctors
+            ]
+        })
+        response['X-Result-Cache'] = cache_outcome
+        return response
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao comparar médicos: {str(e)}'
+        })
+
 
-        show_rate = round((attended_count / total_appointments * 100) if total_appointments > 0 else 0, 1)
-        no_show_rate = round((no_show_count / total_appointments * 100) if total_appointments > 0 else 0, 1)
-        cancelled_rate = round((cancelled_count / total_appointments * 100) if total_appointments > 0 else 0, 1)
-        # "Vago" = empty slots (we don't have slot data; use 0 or remainder)
-        vago_rate = max(0, 100 - show_rate - no_show_rate - cancelled_rate)
+@login_required
+@require_http_methods(["GET"])
+def api_indicators_export(request):
+    """
+    Streaming export of the daily or monthly KPI series per doctor, as CSV
+    or JSON lines (?granularity=day|month&format=csv|jsonl&start_date=&end_date=).
+    Covers the selected doctor, or every accessible doctor with ?scope=all.
+    """
+    try:
+        accessible_doctors = get_accessible_doctors(request.user).select_related('user')
+        if request.GET.get('scope') == 'all':
+            doctors = list(accessible_doctors)
+        else:
+            current_doctor = get_selected_doctor(request)
+            if current_doctor and current_doctor not in accessible_doctors:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Você não tem permissão para exportar os indicadores deste médico'
+                })
+            doctors = [current_doctor] if current_doctor else list(accessible_doctors)
+        if not doctors:
+            return JsonResponse({
+                'success': False,
+                'error': 'Nenhum médico disponível para exportação'
+            })
+
+        export_format = request.GET.get('format', 'csv')
+        granularity = request.GET.get('granularity', 'day')
+        if export_format not in EXPORT_FORMATS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Formato inválido. Use: {", ".join(EXPORT_FORMATS)}'
+            })
+        if granularity not in EXPORT_GRANULARITIES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Granularidade inválida. Use: {", ".join(EXPORT_GRANULARITIES)}'
+            })
 
-        from accounts.utils import get_clinic_for_user
-        user_clinic = get_clinic_for_user(request.user)
-        total_patients = Patient.objects.filter(clinic=user_clinic, is_active=True).count() if user_clinic else 0
-        particular_count = appointments.filter(payment_type='particular').count()
-        convenio_count = appointments.filter(payment_type='convenio').count()
-        total_payment_appointments = particular_count + convenio_count
-        private_pct = round((particular_count / total_payment_appointments * 100) if total_payment_appointments > 0 else 0, 1)
-        insurance_pct = round((convenio_count / total_payment_appointments * 100) if total_payment_appointments > 0 else 0, 1)
-
-        patients_with_multiple = appointments.values('patient').annotate(
-            appointment_count=Count('id')
-        ).filter(appointment_count__gt=1).count()
-        total_unique_patients = appointments.values('patient').distinct().count()
-        retention_rate = round((patients_with_multiple / total_unique_patients * 100) if total_unique_patients > 0 else 0, 1)
-        total_retornos = max(0, total_appointments - total_unique_patients)
-
-        days_in_period = (end_date - start_date).days + 1
-        avg_consultations_per_day = round(total_appointments / days_in_period, 1) if days_in_period > 0 else 0
-        duration_agg = appointments.filter(status='completed').aggregate(avg_dur=Avg('duration_minutes'))
-        avg_duration_minutes = int(duration_agg['avg_dur'] or 0)
-        occupation_rate = round(show_rate, 0)  # proxy: same as show rate when no slot data
-
-        # New patients in period (first appointment ever was in this period)
-        patient_ids_in_period = list(appointments.values_list('patient_id', flat=True).distinct())
-        new_patients_count = 0
-        if patient_ids_in_period:
-            first_dates = Appointment.objects.filter(
-                patient_id__in=patient_ids_in_period,
-                doctor__in=doctors_filter
-            ).values('patient_id').annotate(first_ever=Min('appointment_date'))
-            for fd in first_dates:
-                if fd['first_ever'] and start_date <= fd['first_ever'] <= end_date:
-                    new_patients_count += 1
-
-        avg_consultations_per_patient = round(
-            total_appointments / total_unique_patients, 1
-        ) if total_unique_patients > 0 else 0
-
-        # Monthly series for charts (5 months ending with selected month)
-        ref_date = end_date
-        monthly_agenda = []
-        monthly_patients = []
-        for i in range(4, -1, -1):
-            d = ref_date
-            for _ in range(i):
-                if d.month == 1:
-                    d = date(d.year - 1, 12, 1)
-                else:
-                    d = date(d.year, d.month - 1, 1)
-            month_start = date(d.year, d.month, 1)
-            if month_start.month == 12:
-                month_end = date(month_start.year, 12, 31)
-            else:
-                month_end = date(month_start.year, month_start.month + 1, 1) - timedelta(days=1)
-            month_appts = Appointment.objects.filter(
-                doctor__in=doctors_filter,
-                appointment_date__gte=month_start,
-                appointment_date__lte=month_end
-            )
-            tot = month_appts.count()
-            ac = month_appts.filter(status='completed').count()
-            nc = month_appts.filter(status='no_show').count()
-            cc = month_appts.filter(status='cancelled').count()
-            oc = (ac / tot * 100) if tot else 0
-            ns = (nc / tot * 100) if tot else 0
-            ca = (cc / tot * 100) if tot else 0
-            vg = max(0, 100 - oc - ns - ca)
-            monthly_agenda.append({
-                'month': month_start.strftime('%b-%y'),
-                'ocupacao': round(oc, 1),
-                'vago': round(vg, 1),
-                'no_show': round(ns, 1),
-                'cancelamento': round(ca, 1),
-            })
-            pc = month_appts.filter(payment_type='particular').count()
-            cv = month_appts.filter(payment_type='convenio').count()
-            monthly_patients.append({
-                'month': month_start.strftime('%b-%y'),
-                'particular': pc,
-                'convenio': cv,
-            })
-
-        # Previous month for trends (comparison vs month before selected period)
-        ref_year, ref_month = start_date.year, start_date.month
-        if ref_month == 1:
-            prev_start = date(ref_year - 1, 12, 1)
-            prev_end = date(ref_year - 1, 12, 31)
-        else:
-            prev_start = date(ref_year, ref_month - 1, 1)
-            prev_end = date(ref_year, ref_month, 1) - timedelta(days=1)
-        prev_appointments = Appointment.objects.filter(
-            doctor__in=doctors_filter,
-            appointment_date__gte=prev_start,
-            appointment_date__lte=prev_end
-        )
-        prev_total = prev_appointments.count()
-        prev_attended = prev_appointments.filter(status='completed').count()
-        prev_no_show = prev_appointments.filter(status='no_show').count()
-        prev_cancelled = prev_appointments.filter(status='cancelled').count()
-        prev_show_rate = round((prev_attended / prev_total * 100) if prev_total else 0, 1)
-        prev_no_show_rate = round((prev_no_show / prev_total * 100) if prev_total else 0, 1)
-        prev_cancelled_rate = round((prev_cancelled / prev_total * 100) if prev_total else 0, 1)
-        prev_unique = prev_appointments.values('patient').distinct().count()
-        prev_new = 0
-        if prev_total:
-            pid_prev = list(prev_appointments.values_list('patient_id', flat=True).distinct())
-            first_prev = Appointment.objects.filter(
-                patient_id__in=pid_prev,
-                doctor__in=doctors_filter
-            ).values('patient_id').annotate(first_ever=Min('appointment_date'))
-            for fd in first_prev:
-                if fd['first_ever'] and prev_start <= fd['first_ever'] <= prev_end:
-                    prev_new += 1
-        prev_retention = 0
-        if prev_unique:
-            prev_multi = prev_appointments.values('patient').annotate(
-                appointment_count=Count('id')
-            ).filter(appointment_count__gt=1).count()
-            prev_retention = round(prev_multi / prev_unique * 100, 1)
-        prev_avg_per_patient = round(prev_total / prev_unique, 2) if prev_unique else 0
-
-        def pct_pt(a, b):
-            return round(a - b, 1)
-
-        trend_ocupacao_pp = pct_pt(show_rate, prev_show_rate)
-        trend_cancelamento_pp = pct_pt(cancelled_rate, prev_cancelled_rate)
-        trend_noshow_pp = pct_pt(no_show_rate, prev_no_show_rate)
-        trend_novos_pct = round(((new_patients_count - prev_new) / prev_new * 100) if prev_new else 0, 0)
-        trend_retencao_pp = pct_pt(retention_rate, prev_retention)
-        trend_media_consultas_pct = round(
-            ((avg_consultations_per_patient - prev_avg_per_patient) / prev_avg_per_patient * 100) if prev_avg_per_patient else 0, 0
-        )
+        start_param = request.GET.get('start_date')
+        end_param = request.GET.get('end_date')
+        if not start_param or not end_param:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parâmetros obrigatórios: start_date, end_date'
+            })
+        try:
+            start_date = datetime.strptime(start_param, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_param, '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Formato de data inválido (use YYYY-MM-DD)'
+            })
+        if start_date > end_date:
+            return JsonResponse({
+                'success': False,
+                'error': 'A data inicial deve ser anterior à data final'
+            })
 
-        # Determine doctor start date (earliest created_at across doctors in filter)
-        doctor_start_str = ''
-        if doctors_filter:
-            earliest = min((d.created_at.date() for d in doctors_filter), default=None)
-            if earliest:
-                doctor_start_str = earliest.strftime('%Y-%m')
-                # Remove monthly series entries that pre-date the doctor's join date
-                monthly_agenda = [
-                    m for m in monthly_agenda
-                    if _month_label_to_date(m['month']) >= date(earliest.year, earliest.month, 1)
-                ]
-                monthly_patients = [
-                    m for m in monthly_patients
-                    if _month_label_to_date(m['month']) >= date(earliest.year, earliest.month, 1)
-                ]
-
-        # --- LOYALTY METRICS & RETENTION CURVE ---
+        names = {doctor.id: doctor.full_name for doctor in doctors}
         settings = AppointmentSettings.objects.first()
-        churn_months = settings.churn_threshold_months if settings else 12
-        risk_months = settings.churn_risk_months if settings else 6
-        
-        # 1. Total Active Patients (consulted at least 1x in last 12 months)
-        active_cutoff = today - timedelta(days=365)
-        total_active_patients = Appointment.objects.filter(
-            doctor__in=doctors_filter,
-            status='completed',
-            appointment_date__gte=active_cutoff
-        ).values('patient').distinct().count()
-        
-        # 2. Patients at Risk (last visit between risk_months and churn_months)
-        risk_cutoff = today - timedelta(days=risk_months * 30)
-        churn_cutoff = today - timedelta(days=churn_months * 30)
-        
-        patients_last_visit = Appointment.objects.filter(
-            doctor__in=doctors_filter,
-            status='completed'
-        ).values('patient').annotate(last_visit=Max('appointment_date'))
-        
-        risk_count = 0
-        for p in patients_last_visit:
-            if p['last_visit'] and churn_cutoff <= p['last_visit'] <= risk_cutoff:
-                risk_count += 1
-                
-        # 3. Retention Curve (Cohort Analysis)
-        # We'll take 6 cohorts (last 6 months) and track their return in Month 1, 2, 3
-        from dateutil.relativedelta import relativedelta
-        retention_data = []
-        for i in range(5, -1, -1):
-            d = today
-            for _ in range(i):
-                if d.month == 1: d = date(d.year - 1, 12, 1)
-                else: d = date(d.year, d.month - 1, 1)
-            c_start = date(d.year, d.month, 1)
-            if c_start.month == 12: c_end = date(c_start.year, 12, 31)
-            else: c_end = date(c_start.year, c_start.month + 1, 1) - timedelta(days=1)
-            
-            # Find patients whose FIRST appointment EVER with these doctors was in this cohort
-            cohort_patients = Appointment.objects.filter(
-                doctor__in=doctors_filter
-            ).values('patient').annotate(first_visit=Min('appointment_date')).filter(
-                first_visit__gte=c_start, first_visit__lte=c_end
-            ).values_list('patient_id', flat=True)
-            
-            cohort_size = len(cohort_patients)
-            returns = [100] # Month 0 is always 100%
-            
-            if cohort_size > 0:
-                for m_offset in range(1, 4):
-                    # Check if they had ANY appointment in the subsequent months
-                    r_start = c_start + relativedelta(months=m_offset)
-                    r_end = r_start + relativedelta(months=1) - timedelta(days=1)
-                    
-                    returned_count = Appointment.objects.filter(
-                        doctor__in=doctors_filter,
-                        patient_id__in=cohort_patients,
-                        appointment_date__gte=r_start,
-                        appointment_date__lte=r_end,
-                        status='completed'
-                    ).values('patient').distinct().count()
-                    
-                    returns.append(round((returned_count / cohort_size * 100), 1))
-            else:
-                returns = [0, 0, 0, 0]
-                
-            retention_data.append({
-                'cohort': c_start.strftime('%b-%y'),
-                'returns': returns
-            })
+        series = daily_kpi_rows if granularity == 'day' else monthly_kpi_rows
+        rows = series(names, start_date, end_date, settings=settings)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(csv_lines(rows), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(jsonl_lines(rows), content_type='application/x-ndjson; charset=utf-8')
+        filename = f'indicadores_{granularity}_{start_date}_{end_date}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-        return JsonResponse({
-            'success': True,
-            'doctor_start': doctor_start_str,
-            'metrics': {
-                'total_appointments': total_appointments,
-                'total_retornos': total_retornos,
-                'show_rate': show_rate,
-                'no_show_rate': no_show_rate,
-                'cancelled_rate': cancelled_rate,
-                'vago_rate': vago_rate,
-                'total_patients': total_patients,
-                'private_pct': private_pct,
-                'insurance_pct': insurance_pct,
-                'retention_rate': retention_rate,
-                'attended_count': attended_count,
-                'no_show_count': no_show_count,
-                'cancelled_count': cancelled_count,
-                'particular_count': particular_count,
-                'convenio_count': convenio_count,
-                'avg_consultations_per_day': avg_consultations_per_day,
-                'avg_duration_minutes': avg_duration_minutes,
-                'occupation_rate': occupation_rate,
-                'new_patients_count': new_patients_count,
-                'total_unique_patients': total_unique_patients,
-                'avg_consultations_per_patient': avg_consultations_per_patient,
-                'monthly_agenda': monthly_agenda,
-                'monthly_patients': monthly_patients,
-                'trend_ocupacao_pp': trend_ocupacao_pp,
-                'trend_cancelamento_pp': trend_cancelamento_pp,
-                'trend_noshow_pp': trend_noshow_pp,
-                'trend_novos_pct': trend_novos_pct,
-                'trend_retencao_pp': trend_retencao_pp,
-                'trend_media_consultas_pct': trend_media_consultas_pct,
-                # New Loyalty Metrics
-                'total_active_patients': total_active_patients,
-                'risk_count': risk_count,
-                'retention_curve': retention_data,
-            }
-        })
-        
     except Exception as e:
         return JsonResponse({
             'success': False,
-            'error': f'Erro ao calcular indicadores: {str(e)}'
+            'error': f'Erro ao exportar indicadores: {str(e)}'
         })
 
 
@@ -4519,48 +4329,37 @@ def api_quick_stats(request):
         else:
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
-        # Get stats
-        if current_doctor:
-            completed_appointments = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date__range=[start_date, end_date],
-                status='completed'
-            ).count()
-            
-            total_revenue = Income.objects.filter(
-                doctor=current_doctor,
-                income_date__range=[start_date, end_date]
-            ).aggregate(total=models.Sum('amount'))['total'] or 0
-            
-            unique_patients = Appointment.objects.filter(
-                doctor=current_doctor,
-                appointment_date__range=[start_date, end_date],
-                status='completed'
-            ).values('patient').distinct().count()
-        else:
-            # For admins without doctor selection, show aggregated stats
-            completed_appointments = Appointment.objects.filter(
-                appointment_date__range=[start_date, end_date],
-                status='completed'
-            ).count()
-            
-            total_revenue = Income.objects.filter(
-                income_date__range=[start_date, end_date]
-            ).aggregate(total=models.Sum('amount'))['total'] or 0
+        # Get stats: closed months from the monthly rollup, the rest live
+        # (admins without doctor selection see aggregated stats)
+        doctor_ids = [current_doctor.id] if current_doctor else None
+        
+        def build_stats():
+            figures = period_figures(doctor_ids, start_date, end_date)
             
-            unique_patients = Appointment.objects.filter(
+            # Distinct patients do not add up across months, so they are always counted live
+            completed_in_period = Appointment.objects.filter(
                 appointment_date__range=[start_date, end_date],
                 status='completed'
-            ).values('patient').distinct().count()
+            )
+            if doctor_ids is not None:
+                completed_in_period = completed_in_period.filter(doctor_id__in=doctor_ids)
+            return {
+                'completed_appointments': figures['completed_count'],
+                'total_revenue': float(figures['revenue']),
+                'unique_patients': completed_in_period.values('patient').distinct().count(),
+            }
         
-        return JsonResponse({
+        stats, cache_outcome = cached_result(
+            'quick_stats', (doctor_ids or 'all', start_date, end_date),
+            lambda: data_version(doctor_ids, start_date, end_date), build_stats
+        )
+        
+        response = JsonResponse({
             'success': True,
-            'stats': {
-                'completed_appointments': completed_appointments,
-                'total_revenue': float(total_revenue),
-                'unique_patients': unique_patients,
-            }
+            'stats': stats
         })
+        response['X-Result-Cache'] = cache_outcome
+        return response
         
     except Exception as e:
         return JsonResponse({
@@ -4569,6 +4368,10 @@ def api_quick_stats(request):
         })
 
 
+# Report types served through the result cache (aggregates only)
+CACHED_REPORT_TYPES = ('payment_methods', 'financial_summary', 'monthly_appointments')
+
+
 @login_required
 @require_http_methods(["GET"])
 def api_generate_report(request):
@@ -4606,165 +4409,210 @@ def api_generate_report(request):
         
         if current_doctor:
             base_filter['doctor'] = current_doctor
-        
-        # Generate report based on type
-        if report_type == 'appointments':
-            # Appointments report
-            appointments = Appointment.objects.filter(**base_filter).select_related('patient', 'doctor')
-            
-            data = []
-            for apt in appointments:
-                data.append({
-                    'date': apt.appointment_date.strftime('%d/%m/%Y'),
-                    'time': apt.appointment_time.strftime('%H:%M'),
-                    'patient': apt.patient.full_name,
-                    'doctor': apt.doctor.full_name,
-                    'type': apt.get_appointment_type_display(),
-                    'payment': apt.get_payment_type_display(),
-                    'value': float(apt.value) if apt.value else 0,
-                    'status': apt.get_status_display(),
+        report_doctor_ids = [current_doctor.id] if current_doctor else None
+
+        # Streaming download (?export=csv|xlsx) of the appointments report
+        export_format = request.GET.get('export')
+        if export_format:
+            if export_format not in REPORT_EXPORT_FORMATS:
+                return JsonResponse({
+                    'success': False,
+                    'error': f'Formato de exportação inválido. Use: {", ".join(REPORT_EXPORT_FORMATS)}'
                 })
-            
-            return JsonResponse({
-                'success': True,
-                'report_type': 'appointments',
-                'data': data,
-                'summary': {
-                    'total_appointments': len(data),
-                    'total_revenue': sum(item['value'] for item in data),
-                    'start_date': start_date.strftime('%d/%m/%Y'),
-                    'end_date': end_date.strftime('%d/%m/%Y'),
-                }
-            })
-            
-        elif report_type == 'payment_methods':
-            # Payment methods report
-            appointments = Appointment.objects.filter(**base_filter).values('payment_type')
-            payment_methods = {}
-            
-            for apt in appointments:
-                payment_type = apt['payment_type']
-                payment_methods[payment_type] = payment_methods.get(payment_type, 0) + 1
-            
-            data = []
-            for method, count in payment_methods.items():
-                data.append({
-                    'payment_method': method,
-                    'count': count,
+            if report_type != 'appointments':
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Exportação disponível apenas para o relatório de consultas'
                 })
-            
-            return JsonResponse({
-                'success': True,
-                'report_type': 'payment_methods',
-                'data': data,
-                'summary': {
-                    'total_appointments': sum(item['count'] for item in data),
-                    'start_date': start_date.strftime('%d/%m/%Y'),
-                    'end_date': end_date.strftime('%d/%m/%Y'),
+            rows = appointment_report_rows(Appointment.objects.filter(**base_filter))
+            if export_format == 'csv':
+                response = StreamingHttpResponse(
+                    table_csv_lines(APPOINTMENT_REPORT_COLUMNS, rows), content_type='text/csv; charset=utf-8'
+                )
+            else:
+                response = StreamingHttpResponse(
+                    xlsx_chunks(APPOINTMENT_REPORT_COLUMNS, rows, sheet_name='Consultas'),
+                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                )
+            response['Content-Disposition'] = (
+                f'attachment; filename="relatorio_{report_type}_{start_date}_{end_date}.{export_format}"'
+            )
+            return response
+        
+        def live_completed_appointments(live_ranges):
+            """Completed appointments of the report's doctor within the given date ranges."""
+            if not live_ranges:
+                return Appointment.objects.none()
+            live_filter = Q()
+            for range_start, range_end in live_ranges:
+                live_filter |= Q(appointment_date__range=[range_start, range_end])
+            queryset = Appointment.objects.filter(live_filter, status='completed')
+            if current_doctor:
+                queryset = queryset.filter(doctor=current_doctor)
+            return queryset
+        
+        def build_report():
+            """Payload of the requested report type (None when the type is unknown)."""
+            if report_type == 'appointments':
+                # Appointments report
+                appointments = Appointment.objects.filter(**base_filter).select_related('patient', 'doctor__user')
+                
+                data = []
+                for apt in appointments:
+                    data.append({
+                        'date': apt.appointment_date.strftime('%d/%m/%Y'),
+                        'time': apt.appointment_time.strftime('%H:%M'),
+                        'patient': apt.patient.full_name,
+                        'doctor': apt.doctor.full_name,
+                        'type': apt.get_appointment_type_display(),
+                        'payment': apt.get_payment_type_display(),
+                        'value': float(apt.value) if apt.value else 0,
+                        'status': apt.get_status_display(),
+                    })
+                
+                return {
+                    'success': True,
+                    'report_type': 'appointments',
+                    'data': data,
+                    'summary': {
+                        'total_appointments': len(data),
+                        'total_revenue': sum(item['value'] for item in data),
+                        'start_date': start_date.strftime('%d/%m/%Y'),
+                        'end_date': end_date.strftime('%d/%m/%Y'),
+                    }
                 }
-            })
-            
-        elif report_type == 'patient_summary':
-            # Patient summary report
-            appointments = Appointment.objects.filter(**base_filter).values('patient', 'patient__first_name', 'patient__last_name')
-            patient_counts = {}
-            
-            for apt in appointments:
-                patient_id = apt['patient']
-                patient_name = f"{apt['patient__first_name']} {apt['patient__last_name']}"
-                patient_counts[patient_id] = {
-                    'name': patient_name,
-                    'count': patient_counts.get(patient_id, {}).get('count', 0) + 1
+                
+            elif report_type == 'payment_methods':
+                # Payment methods report: closed months from the monthly rollup, the rest live
+                months, live_ranges = split_period(start_date, end_date)
+                payment_methods = {}
+                for figures in load_monthly_stats(report_doctor_ids, months).values():
+                    for method, field in (('particular', 'completed_particular_count'), ('convenio', 'completed_convenio_count')):
+                        if figures[field]:
+                            payment_methods[method] = payment_methods.get(method, 0) + figures[field]
+                
+                for payment_type, count in count_by(live_completed_appointments(live_ranges), 'payment_type').items():
+                    payment_methods[payment_type] = payment_methods.get(payment_type, 0) + count
+                
+                data = []
+                for method, count in payment_methods.items():
+                    data.append({
+                        'payment_method': method,
+                        'count': count,
+                    })
+                
+                return {
+                    'success': True,
+                    'report_type': 'payment_methods',
+                    'data': data,
+                    'summary': {
+                        'total_appointments': sum(item['count'] for item in data),
+                        'start_date': start_date.strftime('%d/%m/%Y'),
+                        'end_date': end_date.strftime('%d/%m/%Y'),
+                    }
                 }
-            
-            data = []
-            for patient_id, info in patient_counts.items():
-                data.append({
-                    'patient_name': info['name'],
-                    'total_appointments': info['count'],
-                })
-            
-            # Sort by appointment count (descending)
-            data.sort(key=lambda x: x['total_appointments'], reverse=True)
-            
-            return JsonResponse({
-                'success': True,
-                'report_type': 'patient_summary',
-                'data': data[:20],  # Limit to top 20
-                'summary': {
-                    'total_patients': len(patient_counts),
-                    'start_date': start_date.strftime('%d/%m/%Y'),
-                    'end_date': end_date.strftime('%d/%m/%Y'),
+                
+            elif report_type == 'patient_summary':
+                # Patient summary report: top patients by appointment count (ORDER BY ... LIMIT)
+                ranking, total_patients = patient_ranking(Appointment.objects.filter(**base_filter))
+                data = [{
+                    'patient_name': f"{row['patient__first_name']} {row['patient__last_name']}",
+                    'total_appointments': row['total'],
+                } for row in ranking]
+                
+                return {
+                    'success': True,
+                    'report_type': 'patient_summary',
+                    'data': data,
+                    'summary': {
+                        'total_patients': total_patients,
+                        'start_date': start_date.strftime('%d/%m/%Y'),
+                        'end_date': end_date.strftime('%d/%m/%Y'),
+                    }
                 }
-            })
-            
-        elif report_type == 'financial_summary':
-            # Financial summary report
-            appointments = Appointment.objects.filter(**base_filter)
-            
-            income_by_category = {}
-            income_by_method = {}
-            total_revenue = 0
-            
-            for apt in appointments:
-                if apt.value:
-                    category = apt.appointment_type
-                    method = apt.payment_type
-                    
-                    income_by_category[category] = income_by_category.get(category, 0) + float(apt.value)
-                    income_by_method[method] = income_by_method.get(method, 0) + float(apt.value)
-                    total_revenue += float(apt.value)
-            
-            data = {
-                'by_category': [{'category': k, 'amount': v} for k, v in income_by_category.items()],
-                'by_method': [{'method': k, 'amount': v} for k, v in income_by_method.items()],
-                'total_revenue': total_revenue,
-            }
-            
-            return JsonResponse({
-                'success': True,
-                'report_type': 'financial_summary',
-                'data': data,
-                'summary': {
+                
+            elif report_type == 'financial_summary':
+                # Financial summary report: revenue summed per type and payment method in the database
+                income_by_category, income_by_method, total_revenue = revenue_breakdown(
+                    Appointment.objects.filter(**base_filter)
+                )
+                total_revenue = float(total_revenue)
+                
+                data = {
+                    'by_category': [{'category': k, 'amount': float(v)} for k, v in income_by_category.items()],
+                    'by_method': [{'method': k, 'amount': float(v)} for k, v in income_by_method.items()],
                     'total_revenue': total_revenue,
-                    'start_date': start_date.strftime('%d/%m/%Y'),
-                    'end_date': end_date.strftime('%d/%m/%Y'),
                 }
-            })
-            
-        elif report_type == 'monthly_appointments':
-            # Monthly appointments report
-            monthly_data = {}
-            
-            # Get all completed appointments in the date range
-            appointments = Appointment.objects.filter(**base_filter)
-            
-            for apt in appointments:
-                month_key = apt.appointment_date.strftime('%Y-%m')
-                if month_key not in monthly_data:
-                    monthly_data[month_key] = {
-                        'month': apt.appointment_date.strftime('%m/%Y'),
-                        'count': 0
+                
+                return {
+                    'success': True,
+                    'report_type': 'financial_summary',
+                    'data': data,
+                    'summary': {
+                        'total_revenue': total_revenue,
+                        'start_date': start_date.strftime('%d/%m/%Y'),
+                        'end_date': end_date.strftime('%d/%m/%Y'),
+                    }
+                }
+                
+            elif report_type == 'monthly_appointments':
+                # Monthly appointments report
+                monthly_data = {}
+                
+                # Closed months come from the monthly rollup...
+                months, live_ranges = split_period(start_date, end_date)
+                for month, figures in load_monthly_stats(report_doctor_ids, months).items():
+                    if figures['completed_count']:
+                        monthly_data[month.strftime('%Y-%m')] = {
+                            'month': month.strftime('%m/%Y'),
+                            'count': figures['completed_count']
+                        }
+                
+                # ...and the completed appointments of the remaining days are counted live, per month
+                for month, count in monthly_counts(live_completed_appointments(live_ranges)).items():
+                    month_key = month.strftime('%Y-%m')
+                    if month_key not in monthly_data:
+                        monthly_data[month_key] = {
+                            'month': month.strftime('%m/%Y'),
+                            'count': 0
+                        }
+                    monthly_data[month_key]['count'] += count
+                
+                # Chronological order (the 'MM/YYYY' labels do not sort across years)
+                data = [monthly_data[month_key] for month_key in sorted(monthly_data)]
+                
+                return {
+                    'success': True,
+                    'report_type': 'monthly_appointments',
+                    'data': data,
+                    'summary': {
+                        'total_appointments': sum(item['count'] for item in data),
+                        'start_date': start_date.strftime('%d/%m/%Y'),
+                        'end_date': end_date.strftime('%d/%m/%Y'),
                     }
-                monthly_data[month_key]['count'] += 1
+                }
             
-            data = sorted(monthly_data.values(), key=lambda x: x['month'])
+            return None
             
+        # Report types made only of counts and sums are cached; the row-level
+        # ones carry patient names, which change without a data version bump
+        if report_type in CACHED_REPORT_TYPES:
+            payload, cache_outcome = cached_result(
+                'generate_report', (report_type, report_doctor_ids or 'all', start_date, end_date),
+                lambda: data_version(report_doctor_ids, start_date, end_date), build_report
+            )
+        else:
+            payload, cache_outcome = build_report(), None
+        
+        if payload is None:
             return JsonResponse({
-                'success': True,
-                'report_type': 'monthly_appointments',
-                'data': data,
-                'summary': {
-                    'total_appointments': sum(item['count'] for item in data),
-                    'start_date': start_date.strftime('%d/%m/%Y'),
-                    'end_date': end_date.strftime('%d/%m/%Y'),
-                }
+                'success': False,
+                'error': f'Tipo de relatório inválido: {report_type}'
             })
-        
-        return JsonResponse({
-            'success': False,
-            'error': f'Tipo de relatório inválido: {report_type}'
-        })
+        response = JsonResponse(payload)
+        if cache_outcome:
+            response['X-Result-Cache'] = cache_outcome
+        return response
         
     except Exception as e:
         return JsonResponse({
@@ -4778,14 +4626,6 @@ def api_generate_report(request):
 def api_generate_pdf_report(request):
     """API endpoint to generate a PDF report"""
     try:
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.lib import colors
-        from reportlab.lib.units import inch
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-        from io import BytesIO
-        
         # Get current doctor (from selection for admins, or user's doctor)
         current_doctor = get_selected_doctor(request)
         
@@ -4799,6 +4639,11 @@ def api_generate_pdf_report(request):
                 'success': False,
                 'error': 'Parâmetros obrigatórios: report_type, start_date, end_date'
             })
+        if report_type not in REPORT_TYPES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Tipo de relatório inválido: {report_type}'
+            })
         
         # Parse dates
         try:
@@ -4810,182 +4655,14 @@ def api_generate_pdf_report(request):
                 'error': 'Formato de data inválido (use YYYY-MM-DD)'
             })
         
-        # Build base query
-        base_filter = {
-            'appointment_date__range': [start_date, end_date],
-            'status': 'completed'
-        }
-        
-        if current_doctor:
-            base_filter['doctor'] = current_doctor
-        
-        # Create PDF buffer
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, 
-                               rightMargin=72, leftMargin=72,
-                               topMargin=72, bottomMargin=18)
-        
-        # Container for the PDF elements
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title style
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1a1a1a'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
-        
-        # Header style
-        header_style = ParagraphStyle(
-            'CustomHeader',
-            parent=styles['Heading2'],
-            fontSize=14,
-            textColor=colors.HexColor('#2c3e50'),
-            spaceAfter=12
-        )
-        
-        # Title
-        title_text = "RELATÓRIO DE CONSULTAS" if report_type == 'appointments' else "RELATÓRIO"
-        story.append(Paragraph(title_text, title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Doctor information
-        if current_doctor:
-            story.append(Paragraph(f"<b>Médico:</b> {current_doctor.full_name}", styles['Normal']))
-            if hasattr(current_doctor, 'specialization') and current_doctor.specialization:
-                story.append(Paragraph(f"<b>Especialização:</b> {current_doctor.specialization}", styles['Normal']))
-            if hasattr(current_doctor, 'medical_license') and current_doctor.medical_license:
-                story.append(Paragraph(f"<b>CRM:</b> {current_doctor.medical_license}", styles['Normal']))
-            story.append(Spacer(1, 0.2*inch))
-        
-        # Period information
-        story.append(Paragraph(f"<b>Período:</b> {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}", styles['Normal']))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Get report data and generate content
-        if report_type == 'appointments':
-            appointments = Appointment.objects.filter(**base_filter).select_related('patient', 'doctor').order_by('appointment_date', 'appointment_time')
-            
-            story.append(Paragraph("Lista de Consultas Realizadas", header_style))
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Table data
-            table_data = [['Data', 'Horário', 'Paciente', 'Tipo', 'Pagamento', 'Valor']]
-            
-            for apt in appointments:
-                date_str = apt.appointment_date.strftime('%d/%m/%Y')
-                time_str = apt.appointment_time.strftime('%H:%M')
-                value_str = f"R$ {apt.value:.2f}" if apt.value else "-"
-                table_data.append([
-                    date_str,
-                    time_str,
-                    apt.patient.full_name,
-                    apt.get_appointment_type_display(),
-                    apt.get_payment_type_display(),
-                    value_str
-                ])
-            
-            # Create table
-            table = Table(table_data, colWidths=[1*inch, 0.8*inch, 2*inch, 1*inch, 1*inch, 1*inch])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ]))
-            
-            story.append(table)
-            story.append(Spacer(1, 0.2*inch))
-            
-            # Summary
-            total_appointments = len(table_data) - 1
-            total_revenue = sum(float(apt.value) if apt.value else 0 for apt in appointments)
-            story.append(Paragraph(f"<b>Total de Consultas:</b> {total_appointments}", styles['Normal']))
-            story.append(Paragraph(f"<b>Receita Total:</b> R$ {total_revenue:.2f}", styles['Normal']))
-            
-        elif report_type == 'financial_summary':
-            appointments = Appointment.objects.filter(**base_filter)
-            
-            story.append(Paragraph("Resumo Financeiro", header_style))
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Calculate totals
-            income_by_category = {}
-            income_by_method = {}
-            total_revenue = 0
-            
-            for apt in appointments:
-                if apt.value:
-                    category = apt.get_appointment_type_display()
-                    method = apt.get_payment_type_display()
-                    
-                    income_by_category[category] = income_by_category.get(category, 0) + float(apt.value)
-                    income_by_method[method] = income_by_method.get(method, 0) + float(apt.value)
-                    total_revenue += float(apt.value)
-            
-            # Revenue by category table
-            if income_by_category:
-                story.append(Paragraph("Receita por Categoria", styles['Heading3']))
-                table_data = [['Categoria', 'Valor']]
-                for category, amount in sorted(income_by_category.items(), key=lambda x: x[1], reverse=True):
-                    table_data.append([category, f"R$ {amount:.2f}"])
-                
-                table = Table(table_data, colWidths=[3*inch, 2*inch])
-                table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ]))
-                story.append(table)
-                story.append(Spacer(1, 0.2*inch))
-            
-            # Revenue by payment method table
-            if income_by_method:
-                story.append(Paragraph("Receita por Método de Pagamento", styles['Heading3']))
-                table_data = [['Método', 'Valor']]
-                for method, amount in sorted(income_by_method.items(), key=lambda x: x[1], reverse=True):
-                    table_data.append([method, f"R$ {amount:.2f}"])
-                
-                table = Table(table_data, colWidths=[3*inch, 2*inch])
-                table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ]))
-                story.append(table)
-                story.append(Spacer(1, 0.2*inch))
-            
-            # Total
-            story.append(Paragraph(f"<b>Receita Total:</b> R$ {total_revenue:.2f}", styles['Heading2']))
-        
-        # Build PDF
-        doc.build(story)
-        
-        # Get PDF data
-        buffer.seek(0)
-        pdf_data = buffer.getvalue()
-        buffer.close()
+        # Rendered once per parameter set and data version, then read back from storage
+        name, _reused = stored_report_pdf(current_doctor, report_type, start_date, end_date)
+        with default_storage.open(name, 'rb') as stored:
+            pdf_data = stored.read()
         
         # Create HTTP response
         response = HttpResponse(pdf_data, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="relatorio_{report_type}_{start_date}_{end_date}.pdf"'
+        response['Content-Disposition'] = f'attachment; filename="{report_pdf_filename(report_type, start_date, end_date)}"'
         return response
         
     except ImportError:
@@ -5000,6 +4677,88 @@ def api_generate_pdf_report(request):
         })
 
 
+@login_required
+@require_POST
+def api_submit_pdf_report_job(request):
+    """
+    API endpoint to render a PDF report in the background. Returns a job to
+    poll through api_job_status; once completed, the document is served by
+    api_download_pdf_report_job. An identical report on unchanged data reuses
+    the stored document.
+    """
+    try:
+        current_doctor = get_selected_doctor(request)
+        report_type = request.POST.get('report_type')
+        start_date_str = request.POST.get('start_date')
+        end_date_str = request.POST.get('end_date')
+
+        if not all([report_type, start_date_str, end_date_str]):
+            return JsonResponse({
+                'success': False,
+                'error': 'Parâmetros obrigatórios: report_type, start_date, end_date'
+            })
+        if report_type not in REPORT_TYPES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Tipo de relatório inválido: {report_type}'
+            })
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Formato de data inválido (use YYYY-MM-DD)'
+            })
+
+        params = {
+            'doctor_id': current_doctor.id if current_doctor else None,
+            'report_type': report_type,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+        }
+        job = submit_job('report_pdf', request.user, run_report_pdf_job, params=params, total=1, **params)
+        return JsonResponse({
+            'success': True,
+            'job_id': job.id,
+            'status_url': reverse('dashboard:api_job_status', args=[job.id]),
+            'download_url': reverse('dashboard:api_download_pdf_report_job', args=[job.id]),
+            'message': 'Geração do relatório PDF iniciada em segundo plano'
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Erro ao iniciar a geração do PDF: {str(e)}'
+        })
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_download_pdf_report_job(request, job_id):
+    """API endpoint to download the PDF rendered by a report job"""
+    job = BackgroundJob.objects.filter(id=job_id, kind='report_pdf', created_by=request.user).first()
+    if not job:
+        return JsonResponse({
+            'success': False,
+            'error': 'Tarefa não encontrada'
+        }, status=404)
+    if job.status != 'completed':
+        return JsonResponse({
+            'success': False,
+            'error': 'O relatório ainda não está pronto' if job.status in ('pending', 'running') else 'A geração do relatório falhou',
+            'job': job.to_dict()
+        }, status=409)
+    try:
+        stored = default_storage.open(job.result['file'], 'rb')
+    except (KeyError, FileNotFoundError):
+        return JsonResponse({
+            'success': False,
+            'error': 'Arquivo do relatório não encontrado'
+        }, status=404)
+    return FileResponse(stored, as_attachment=True, filename=job.result.get('filename'), content_type='application/pdf')
+
+
 def get_selected_doctor(request):
     """Helper function to get the selected doctor from session"""
     role = get_user_role(request.user)
@@ -5479,4 +5238,20 @@ def api_ai_autofill(request, appointment_id):
         fields = json.loads(completion.choices[0].message.content)
         return JsonResponse({'success': True, 'fields': fields})
     except (openai.OpenAIError, json.JSONDecodeError, KeyError) as e:
-        return JsonResponse({'error': f'Erro ao processar com IA: {str(e)}'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': f'Erro ao processar com IA: {str(e)}'}, status=500)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_result_cache_stats(request):
+    """Staff only: result cache lookups per endpoint and outcome (hit / stale / miss / bypass)."""
+    if not (request.user.is_superuser or request.user.is_staff):
+        return JsonResponse({'success': False, 'error': 'Acesso negado'}, status=403)
+
+    backend = caches['default']
+    return JsonResponse({
+        'success': True,
+        'enabled': result_cache_enabled(),
+        'backend': f'{type(backend).__module__}.{type(backend).__name__}',
+        'stats': result_cache_stats(),
+    })
@@ -0,0 +1,179 @@
+"""
+Per-(patient, doctor) visit summaries (PatientVisitSummary).
+
+Appointment writes mark their (patient, doctor) pair through
+schedule_summary_refresh (model signals, plus the bulk update paths, which
+bypass signals); marked pairs are recomputed once the transaction commits.
+reconcile_visit_summaries compares every summary with the appointment table
+and repairs the differences (management command reconcile_visit_summaries).
+
+Readers get first/last visit data without grouping the appointment
+history: load_visit_history for a set of doctors, visit_totals per patient
+across doctors, first_and_active_by_doctor per doctor.
+"""
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .models import Appointment, PatientVisitSummary
+
+
+logger = logging.getLogger(__name__)
+
+COMPLETED = Q(status='completed')
+SUMMARY_AGGREGATES = {
+    'first_visit': Min('appointment_date'),
+    'first_completed_visit': Min('appointment_date', filter=COMPLETED),
+    'last_completed_visit': Max('appointment_date', filter=COMPLETED),
+    'total_appointments': Count('id'),
+    'completed_count': Count('id', filter=COMPLETED),
+    'no_show_count': Count('id', filter=Q(status='no_show')),
+}
+SUMMARY_FIELDS = tuple(SUMMARY_AGGREGATES)
+
+
+def compute_visit_summaries(appointments):
+    """{(patient_id, doctor_id): figures} for an appointment queryset, in one grouped query."""
+    rows = appointments.order_by().values('patient_id', 'doctor_id').annotate(**SUMMARY_AGGREGATES)
+    return {(row.pop('patient_id'), row.pop('doctor_id')): row for row in rows}
+
+
+# ─── Write side ─────────────────────────────────────────────────────────────
+
+def refresh_visit_summaries(keys):
+    """Recompute the PatientVisitSummary rows of the given (patient_id, doctor_id) keys."""
+    keys = set(keys)
+    if not keys:
+        return
+    patient_ids = {patient_id for patient_id, _doctor_id in keys}
+    doctor_ids = {doctor_id for _patient_id, doctor_id in keys}
+    figures = compute_visit_summaries(
+        Appointment.objects.filter(patient_id__in=patient_ids, doctor_id__in=doctor_ids)
+    )
+    for patient_id, doctor_id in keys:
+        values = figures.get((patient_id, doctor_id))
+        if values is None:
+            PatientVisitSummary.objects.filter(patient_id=patient_id, doctor_id=doctor_id).delete()
+            continue
+        PatientVisitSummary.objects.update_or_create(patient_id=patient_id, doctor_id=doctor_id, defaults=values)
+
+
+_pending = threading.local()
+
+
+def _pending_keys():
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    return _pending.keys
+
+
+def schedule_summary_refresh(patient_id, doctor_id):
+    """
+    Mark a (patient, doctor) pair as changed. Marked pairs are recomputed once
+    when the current transaction commits (immediately outside a transaction).
+    """
+    if not patient_id or not doctor_id:
+        return
+    _pending_keys().add((patient_id, doctor_id))
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def schedule_summary_refresh_for_appointments(queryset):
+    """schedule_summary_refresh for every pair in an appointment queryset (bulk update paths)."""
+    for patient_id, doctor_id in queryset.order_by().values_list('patient_id', 'doctor_id').distinct():
+        schedule_summary_refresh(patient_id, doctor_id)
+
+
+def _flush_pending():
+    keys = _pending_keys()
+    if not keys:
+        return
+    batch = set(keys)
+    keys.clear()
+    try:
+        refresh_visit_summaries(batch)
+    except Exception:
+        # Never fail the write; reconcile_visit_summaries repairs missed pairs
+        logger.exception("Failed to refresh visit summaries for %s", sorted(batch))
+
+
+def reconcile_visit_summaries(fix=True):
+    """
+    Compare every PatientVisitSummary with the appointment table. Returns
+    {'missing': n, 'stale': n, 'orphaned': n}; with fix, missing rows are
+    created, stale ones rewritten and orphaned ones (no appointments left)
+    deleted.
+    """
+    expected = compute_visit_summaries(Appointment.objects.all())
+    existing = {
+        (row['patient_id'], row['doctor_id']): row
+        for row in PatientVisitSummary.objects.values('id', 'patient_id', 'doctor_id', *SUMMARY_FIELDS)
+    }
+    missing = [key for key in expected if key not in existing]
+    orphaned = [row['id'] for key, row in existing.items() if key not in expected]
+    stale = [
+        (existing[key]['id'], values)
+        for key, values in expected.items()
+        if key in existing and any(existing[key][field] != values[field] for field in SUMMARY_FIELDS)
+    ]
+
+    if fix:
+        with transaction.atomic():
+            PatientVisitSummary.objects.filter(id__in=orphaned).delete()
+            PatientVisitSummary.objects.bulk_create(
+                [PatientVisitSummary(patient_id=patient_id, doctor_id=doctor_id, **expected[(patient_id, doctor_id)])
+                 for patient_id, doctor_id in missing],
+                batch_size=500,
+            )
+            PatientVisitSummary.objects.bulk_update(
+                [PatientVisitSummary(id=summary_id, **values) for summary_id, values in stale],
+                SUMMARY_FIELDS,
+                batch_size=500,
+            )
+    return {'missing': len(missing), 'stale': len(stale), 'orphaned': len(orphaned)}
+
+
+# ─── Read side ──────────────────────────────────────────────────────────────
+
+def load_visit_history(doctors):
+    """
+    {patient_id: (first_visit, last_completed_visit)} over the doctors'
+    appointments (any status for the first visit), from the summaries.
+    """
+    rows = PatientVisitSummary.objects.filter(doctor__in=doctors).order_by().values('patient_id').annotate(
+        first=Min('first_visit'),
+        last_completed=Max('last_completed_visit'),
+    ).values_list('patient_id', 'first', 'last_completed')
+    return {patient_id: (first_visit, last_completed) for patient_id, first_visit, last_completed in rows}
+
+
+def visit_totals(patient_filter):
+    """
+    {patient_id: {'total', 'no_shows', 'total_completed', 'first_visit',
+    'last_visit'}} across all doctors, for summaries matching patient_filter
+    (a Q on PatientVisitSummary). first/last_visit are completed visits.
+    """
+    rows = PatientVisitSummary.objects.filter(patient_filter).order_by().values('patient_id').annotate(
+        total=Sum('total_appointments'),
+        no_shows=Sum('no_show_count'),
+        total_completed=Sum('completed_count'),
+        first_visit=Min('first_completed_visit'),
+        last_visit=Max('last_completed_visit'),
+    )
+    return {row['patient_id']: row for row in rows}
+
+
+
+def first_and_active_by_doctor(doctor_ids, start_date, end_date, active_since):
+    """
+    {doctor_id: (new_patients, active_patients)}: patients whose first visit
+    with the doctor falls in [start_date, end_date], and patients with a
+    completed visit with the doctor since active_since. One grouped query.
+    """
+    rows = PatientVisitSummary.objects.filter(doctor_id__in=doctor_ids).order_by().values('doctor_id').annotate(
+        new_patients=Count('id', filter=Q(first_visit__range=[start_date, end_date])),
+        active_patients=Count('id', filter=Q(last_completed_visit__gte=active_since)),
+    ).values_list('doctor_id', 'new_patients', 'active_patients')
+    return {doctor_id: (new_patients, active_patients) for doctor_id, new_patients, active_patients in rows}
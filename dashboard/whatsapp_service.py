@@ -10,6 +10,7 @@ from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q
 from .models import Doctor, Appointment, Patient, FAQEntry, WhatsAppConversation, AppointmentSettings
+from .availability_service import Availability, check_slot_conflicts, next_free_slots
 
 # Get BASE_DIR (go up from dashboard to project root)
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -183,19 +184,14 @@ def get_available_dates_for_week(doctor, start_date=None):
     if start_date is None:
         start_date = timezone.localtime(timezone.now()).date()
     
+    # Check up to 14 days (working days from AppointmentSettings) in one load
+    availability = Availability([doctor], start_date, start_date + timedelta(days=13))
+    now = timezone.now()
     available_dates = []
-    current_date = start_date
-    
-    # Get dates for the next 7 days (excluding weekends)
-    for i in range(14):  # Check up to 14 days to get 7 weekdays
-        if current_date.weekday() < 5:  # Monday to Friday (0-4)
-            # Check if there are any available time slots for this date
-            if has_available_slots(doctor, current_date):
-                available_dates.append(current_date)
-        
-        current_date += timedelta(days=1)
-        
-        # Stop when we have 7 weekdays
+    for day in availability.days():
+        if availability.has_free_slot(doctor.id, day, now=now):
+            available_dates.append(day)
+        # Stop when we have 7 working days
         if len(available_dates) >= 7:
             break
     
@@ -204,35 +200,8 @@ def get_available_dates_for_week(doctor, start_date=None):
 
 def has_available_slots(doctor, date):
     """Check if a doctor has available time slots on a given date"""
-    # Business hours: 8:00 to 18:00
-    start_time = dt_time(8, 0)
-    end_time = dt_time(18, 0)
-    
-    # Get existing appointments for this date
-    existing_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        appointment_date=date
-    ).exclude(status='cancelled')
-    
-    # Get all booked times
-    booked_times = set()
-    for appointment in existing_appointments:
-        booked_times.add(appointment.appointment_time)
-        # Also mark the end time as booked
-        end_datetime = datetime.combine(date, appointment.appointment_time) + timedelta(minutes=appointment.duration_minutes)
-        booked_times.add(end_datetime.time())
-    
-    # Check if there's at least one available slot (30-minute intervals)
-    current_time = datetime.combine(date, start_time)
-    end_datetime = datetime.combine(date, end_time)
-    
-    while current_time < end_datetime:
-        time_slot = current_time.time()
-        if time_slot not in booked_times:
-            return True
-        current_time += timedelta(minutes=30)
-    
-    return False
+    availability = Availability([doctor], date, date)
+    return availability.has_free_slot(doctor.id, date, now=timezone.now())
 
 
 def get_available_times(doctor, date):
@@ -246,45 +215,11 @@ def get_available_times(doctor, date):
     Returns:
         list: List of available time strings (HH:MM format)
     """
-    # Business hours: 8:00 to 18:00
-    start_time = dt_time(8, 0)
-    end_time = dt_time(18, 0)
-    
-    # Get existing appointments for this date
-    existing_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        appointment_date=date
-    ).exclude(status='cancelled')
-    
-    # Get all booked time ranges
-    booked_ranges = []
-    for appointment in existing_appointments:
-        start = appointment.appointment_time
-        end_datetime = datetime.combine(date, start) + timedelta(minutes=appointment.duration_minutes)
-        end = end_datetime.time()
-        booked_ranges.append((start, end))
-    
-    # Generate available time slots (30-minute intervals)
-    available_times = []
-    current_time = datetime.combine(date, start_time)
-    end_datetime = datetime.combine(date, end_time)
-    
-    while current_time < end_datetime:
-        time_slot = current_time.time()
-        
-        # Check if this time slot conflicts with any existing appointment
-        is_available = True
-        for booked_start, booked_end in booked_ranges:
-            if booked_start <= time_slot < booked_end:
-                is_available = False
-                break
-        
-        if is_available:
-            available_times.append(time_slot.strftime('%H:%M'))
-        
-        current_time += timedelta(minutes=30)
-    
-    return available_times
+    availability = Availability([doctor], date, date)
+    return [
+        slot.strftime('%H:%M')
+        for slot in availability.free_slots(doctor.id, date, now=timezone.now())
+    ]
 
 
 def format_date_br(date):
@@ -382,28 +317,15 @@ def get_next_available_slots(limit=10, start_date=None):
     if start_date is None:
         start_date = timezone.localtime(timezone.now()).date()
     doctors = get_available_doctors()
-    results = []
-    current = start_date
-    for _ in range(60):  # até 60 dias
-        if current.weekday() >= 5:
-            current += timedelta(days=1)
-            continue
-        for doctor in doctors:
-            if has_available_slots(doctor, current):
-                times = get_available_times(doctor, current)
-                for t in times[:3]:
-                    results.append({
-                        'doctor': doctor,
-                        'date': current,
-                        'time': t,
-                        'date_label': format_date_br(current),
-                    })
-                    if len(results) >= limit:
-                        return results
-            if len(results) >= limit:
-                break
-        current += timedelta(days=1)
-    return results
+    return [
+        {
+            'doctor': doctor,
+            'date': day,
+            'time': slot.strftime('%H:%M'),
+            'date_label': format_date_br(day),
+        }
+        for day, slot, doctor in next_free_slots(doctors, start_date, limit, now=timezone.now())
+    ]
 
 
 def search_faq(query, limit=5):
@@ -979,8 +901,38 @@ def _send_schedule_confirm_final_message(conversation):
     )
 
 
+def _selected_slot_taken(conversation, duration_minutes=30):
+    """O horário escolhido pode ter sido ocupado durante a conversa; verificar antes de agendar."""
+    if not (conversation.selected_doctor_id and conversation.selected_date and conversation.selected_time):
+        return False
+    conflict, = check_slot_conflicts([(
+        conversation.selected_doctor_id,
+        conversation.selected_date,
+        conversation.selected_time,
+        duration_minutes,
+    )])
+    return conflict is not None
+
+
+def _handle_selected_slot_taken(conversation):
+    conversation.state = 'schedule_search_type'
+    conversation.context = {}
+    conversation.selected_doctor = None
+    conversation.selected_date = None
+    conversation.selected_time = None
+    conversation.save()
+    _send(
+        conversation.phone_number,
+        "⚠️ Esse horário acabou de ser ocupado. Por favor, escolha outro horário."
+    )
+    _send_schedule_search_options(conversation)
+
+
 def _handle_schedule_confirm_final(conversation, msg_lower):
     if msg_lower in ("conf_final_sim", "sim", "1"):
+        if _selected_slot_taken(conversation):
+            _handle_selected_slot_taken(conversation)
+            return
         if conversation.patient_id:
             try:
                 patient = conversation.patient
@@ -1665,6 +1617,9 @@ def _handle_schedule_list(conversation, msg):
             conversation.selected_doctor_id = slot['doctor_id']
             conversation.selected_date = datetime.strptime(slot['date'], '%Y-%m-%d').date()
             conversation.selected_time = datetime.strptime(slot['time'], '%H:%M').time()
+            if _selected_slot_taken(conversation):
+                _handle_selected_slot_taken(conversation)
+                return
             conversation.state = 'patient_cpf'
             conversation.context['from_schedule_confirm'] = True
             conversation.save()
@@ -1687,6 +1642,9 @@ def _handle_schedule_list(conversation, msg):
 
 def _handle_schedule_confirm(conversation, msg_lower):
     if msg_lower in ('conf_sim', 'sim', '1'):
+        if _selected_slot_taken(conversation):
+            _handle_selected_slot_taken(conversation)
+            return
         if conversation.patient_id:
             try:
                 patient = conversation.patient
@@ -1760,6 +1718,9 @@ def _handle_schedule_collecting_patient(conversation, msg):
     conversation.patient_phone = msg.strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
     conversation.context['patient_step'] = None
     conversation.save()
+    if _selected_slot_taken(conversation):
+        _handle_selected_slot_taken(conversation)
+        return
     # Criar paciente e agendamento
     try:
         patient = Patient.objects.filter(phone__icontains=conversation.patient_phone).first()
@@ -200,6 +200,34 @@ else:
         },
     }
 
+# ─── Redis / cache ───────────────────────────────────────────────────────────
+# The dashboard's result and capacity caches (dashboard.result_cache) are
+# invalidated through version counters kept in the cache, so every worker
+# process must share it: set REDIS_URL (e.g. redis://localhost:6379/0) in
+# production. Without it Django's per-process memory cache is used and those
+# caches are bypassed, unless RESULT_CACHE_ALLOW_LOCAL is set (single-process
+# setups only).
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+RESULT_CACHE_ALLOW_LOCAL = os.environ.get('RESULT_CACHE_ALLOW_LOCAL', '').lower() == 'true'
+
+# ─── Live agenda updates (see dashboard.agenda_events) ──────────────────────
+# 'stream' pushes changes over server-sent events. Each open agenda then holds
+# a worker for up to 5 minutes, so it requires an async or threaded worker
+# class (gunicorn -k gevent, or --threads N) and, with more than one process,
+# AGENDA_EVENT_BROKER=dashboard.agenda_events.RedisBroker.
+# 'poll' (default, safe with gunicorn's sync workers) has open agendas check
+# for changes with a conditional request, every 15 seconds and backing off to
+# 2 minutes while nothing changes; unchanged agendas cost four index lookups.
+AGENDA_LIVE_UPDATES = os.environ.get('AGENDA_LIVE_UPDATES', 'poll')
+AGENDA_EVENT_BROKER = os.environ.get('AGENDA_EVENT_BROKER', 'dashboard.agenda_events.InProcessBroker')
+
 # Signed URL expiry for patient files (minutes)
 GCS_SIGNED_URL_EXPIRY_MINUTES = int(os.environ.get('GCS_SIGNED_URL_EXPIRY_MINUTES', '60'))
 
@@ -1107,8 +1107,8 @@ document.addEventListener('DOMContentLoaded', function() {
     attachProntuarioEventListeners();
     
     
-    // Load patients and doctors for appointment modal
-    loadPatientsAndDoctors();
+    // Patients, doctors, settings and agenda stats arrive in one bootstrap request
+    loadDashboardBootstrap();
     
     // Initialize prescription form
     initializePrescriptionForm();
@@ -1131,8 +1131,8 @@ document.addEventListener('DOMContentLoaded', function() {
             .catch(err => console.error('Error loading patient from URL:', err));
     }
 
-    // Refresh agenda stats on page load
-    refreshAgendaStats();
+    // Keep the agenda current through server-sent events instead of polling
+    startAgendaLiveUpdates();
     
     // Initialize reports tab with default dates
     initializeReportsTab();
@@ -1192,6 +1192,8 @@ function showNewAppointmentModal() {
     const modalElement = document.getElementById('newAppointmentModal');
     modalElement.addEventListener('shown.bs.modal', function() {
         setupPatientSearch();
+        loadAvailableSlots();
+        checkAppointmentSlotConflict();
         // Load and apply settings to the modal
         if (typeof updateAppointmentModalWithSettings === 'function') {
             // If settings are already loaded, update immediately
@@ -1209,6 +1211,104 @@ function showNewAppointmentModal() {
     modal.show();
 }
 
+// Free slots for the new appointment modal, from the availability engine
+// (working hours, calendar blocks and existing appointments)
+function loadAvailableSlots() {
+    const container = document.getElementById('appointment-slot-suggestions');
+    const date = document.getElementById('appointment-date').value;
+    const duration = document.getElementById('appointment-duration').value || '30';
+    if (!container) return;
+    if (!date) {
+        container.innerHTML = '';
+        return;
+    }
+
+    const params = new URLSearchParams({ start: date, end: date, duration: duration });
+    const doctorId = document.getElementById('appointment-doctor').value;
+    if (doctorId) params.append('doctor_id', doctorId);
+
+    container.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Buscando horários livres...';
+    fetch(`/dashboard/api/available-slots/?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            // The date may have changed while the request was in flight
+            if (document.getElementById('appointment-date').value !== date) return;
+            if (!data.success) {
+                container.innerHTML = '';
+                return;
+            }
+            const slots = data.slots[date] || [];
+            if (slots.length === 0) {
+                container.innerHTML = '<i class="fas fa-calendar-times me-1"></i>Nenhum horário livre nesta data';
+                return;
+            }
+            const current = document.getElementById('appointment-time').value;
+            container.innerHTML = '<div class="mb-1"><i class="fas fa-clock me-1"></i>Horários livres:</div>' +
+                slots.map(slot => `<button type="button" class="btn btn-sm ${slot === current ? 'btn-primary' : 'btn-outline-primary'} me-1 mb-1 appointment-slot-option" data-time="${slot}">${slot}</button>`).join('');
+            container.querySelectorAll('.appointment-slot-option').forEach(button => {
+                button.addEventListener('click', function() {
+                    document.getElementById('appointment-time').value = this.dataset.time;
+                    checkAppointmentSlotConflict();
+                    container.querySelectorAll('.appointment-slot-option').forEach(other => {
+                        other.classList.toggle('btn-primary', other === this);
+                        other.classList.toggle('btn-outline-primary', other !== this);
+                    });
+                });
+            });
+        })
+        .catch(error => {
+            console.error('Error loading available slots:', error);
+            container.innerHTML = '';
+        });
+}
+
+// Warn, before saving, when the chosen time overlaps an appointment or a
+// calendar block, through the batch conflict check
+function checkAppointmentSlotConflict() {
+    const warning = document.getElementById('appointment-slot-conflict');
+    if (!warning) return;
+    const date = document.getElementById('appointment-date').value;
+    const time = document.getElementById('appointment-time').value;
+    const duration = document.getElementById('appointment-duration').value || '30';
+    warning.innerHTML = '';
+    if (!date || !time) return;
+
+    const body = { slots: [{ date: date, time: time, duration_minutes: parseInt(duration, 10) }] };
+    const doctorId = document.getElementById('appointment-doctor').value;
+    if (doctorId) body.doctor_id = doctorId;
+
+    fetch('/dashboard/api/appointments/check-conflicts/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCookie('csrftoken')
+        },
+        body: JSON.stringify(body)
+    })
+    .then(response => response.json())
+    .then(data => {
+        // The slot may have changed while the request was in flight
+        if (document.getElementById('appointment-date').value !== date ||
+            document.getElementById('appointment-time').value !== time ||
+            (document.getElementById('appointment-duration').value || '30') !== duration) return;
+        if (data.success && !data.results[0].free) {
+            warning.innerHTML = `<i class="fas fa-exclamation-triangle me-1"></i>${data.results[0].message}`;
+        }
+    })
+    .catch(error => console.error('Error checking slot conflicts:', error));
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    ['appointment-date', 'appointment-duration'].forEach(id => {
+        const field = document.getElementById(id);
+        if (field) field.addEventListener('change', loadAvailableSlots);
+    });
+    ['appointment-date', 'appointment-time', 'appointment-duration'].forEach(id => {
+        const field = document.getElementById(id);
+        if (field) field.addEventListener('change', checkAppointmentSlotConflict);
+    });
+});
+
 // Track which modal was open when "Add new patient" was clicked
 let _patientCreationSource = null;
 
@@ -1235,17 +1335,20 @@ function showNewPatientModal() {
     modal.show();
 }
 
+function applyPatientsList(patients) {
+    window.allPatients = (patients || []).slice().sort((a, b) =>
+        (a.full_name || '').localeCompare(b.full_name || '', 'pt-BR', { sensitivity: 'base' })
+    );
+    setupPatientSearch();
+}
+
 function loadPatientsAndDoctors() {
     // Load patients and return the promise
     return fetch('/dashboard/api/patients/')
         .then(response => response.json())
         .then(data => {
             console.log('Patients loaded:', data);
-            const raw = data.success ? data.patients : [];
-            window.allPatients = raw.slice().sort((a, b) =>
-                (a.full_name || '').localeCompare(b.full_name || '', 'pt-BR', { sensitivity: 'base' })
-            );
-            setupPatientSearch();
+            applyPatientsList(data.success ? data.patients : []);
             return data;
         })
         .catch(error => {
@@ -1760,33 +1863,37 @@ function showNextAppointmentDetails() {
 }
 
 // Function to refresh agenda stats
+function applyAgendaStats(stats) {
+    // Update the stats cards - look specifically in the agenda tab
+    const agendaTab = document.getElementById('agenda-tab');
+    if (agendaTab) {
+        const consultasHojeElement = agendaTab.querySelector('.stats-card-primary .stats-number');
+        const pacientesAtendidosElement = agendaTab.querySelector('.stats-card-success .stats-number');
+        const consultasPendentesElement = agendaTab.querySelector('.stats-card-info .stats-number');
+        const proximaConsultaElement = agendaTab.querySelector('.stats-card-warning .stats-number');
+        
+        if (consultasHojeElement) {
+            consultasHojeElement.textContent = stats.consultas_hoje;
+        }
+        if (pacientesAtendidosElement) {
+            pacientesAtendidosElement.textContent = stats.pacientes_atendidos;
+        }
+        if (consultasPendentesElement) {
+            consultasPendentesElement.textContent = stats.consultas_pendentes;
+        }
+        if (proximaConsultaElement) {
+            proximaConsultaElement.textContent = stats.proxima_consulta;
+        }
+    }
+}
+
 function refreshAgendaStats() {
     console.log('Refreshing agenda stats');
     fetch('/dashboard/api/agenda-stats/')
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                // Update the stats cards - look specifically in the agenda tab
-                const agendaTab = document.getElementById('agenda-tab');
-                if (agendaTab) {
-                    const consultasHojeElement = agendaTab.querySelector('.stats-card-primary .stats-number');
-                    const pacientesAtendidosElement = agendaTab.querySelector('.stats-card-success .stats-number');
-                    const consultasPendentesElement = agendaTab.querySelector('.stats-card-info .stats-number');
-                    const proximaConsultaElement = agendaTab.querySelector('.stats-card-warning .stats-number');
-                    
-                    if (consultasHojeElement) {
-                        consultasHojeElement.textContent = data.stats.consultas_hoje;
-                    }
-                    if (pacientesAtendidosElement) {
-                        pacientesAtendidosElement.textContent = data.stats.pacientes_atendidos;
-                    }
-                    if (consultasPendentesElement) {
-                        consultasPendentesElement.textContent = data.stats.consultas_pendentes;
-                    }
-                    if (proximaConsultaElement) {
-                        proximaConsultaElement.textContent = data.stats.proxima_consulta;
-                    }
-                }
+                applyAgendaStats(data.stats);
             }
         })
         .catch(error => {
@@ -1794,6 +1901,121 @@ function refreshAgendaStats() {
         });
 }
 
+// Everything the dashboard needs on first paint, in one round trip.
+// Falls back to the individual endpoints if the bootstrap request fails.
+function loadDashboardBootstrap() {
+    window.dashboardBootstrapPromise = fetch('/dashboard/api/bootstrap/')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            window.dashboardDoctors = data.doctors;
+            window.nextAppointment = data.next_appointment;
+            applyPatientsList(data.patients);
+            applyAgendaStats(data.stats);
+            if (typeof applyAppointmentSettings === 'function') {
+                applyAppointmentSettings(data.settings);
+            }
+            return data;
+        })
+        .catch(error => {
+            console.error('Error loading dashboard bootstrap:', error);
+            loadPatientsAndDoctors().catch(() => {});
+            refreshAgendaStats();
+            if (typeof loadSettings === 'function') {
+                loadSettings();
+            }
+        })
+        .finally(() => {
+            window.dashboardBootstrapPromise = null;
+        });
+    return window.dashboardBootstrapPromise;
+}
+
+// Live agenda updates (server-sent events, or polling when streaming is off)
+let agendaEventSource = null;
+let agendaLiveRefreshTimer = null;
+
+function scheduleAgendaLiveRefresh() {
+    // Coalesce bursts (e.g. bulk cancellations) into a single refresh
+    clearTimeout(agendaLiveRefreshTimer);
+    agendaLiveRefreshTimer = setTimeout(() => {
+        refreshAgendaStats();
+        if (typeof refreshCalendar === 'function') {
+            refreshCalendar();
+        }
+    }, 300);
+}
+
+function startAgendaLiveUpdates() {
+    if (agendaEventSource || agendaPollTimer || !document.getElementById('agenda-tab')) {
+        return;
+    }
+    if (typeof EventSource === 'undefined') {
+        startAgendaPolling();
+        return;
+    }
+    agendaEventSource = new EventSource('/dashboard/api/agenda/stream/');
+    agendaEventSource.onmessage = scheduleAgendaLiveRefresh;
+    agendaEventSource.onerror = function() {
+        // The server answers 204 when streaming is disabled, which closes the
+        // stream for good; network errors keep reconnecting on their own
+        if (agendaEventSource.readyState === EventSource.CLOSED) {
+            agendaEventSource = null;
+            startAgendaPolling();
+        }
+    };
+}
+
+// Polling fallback: a conditional request every AGENDA_POLL_SECONDS, answered
+// with a 304 while nothing changed in the open agenda. Idle agendas back off,
+// doubling the interval up to AGENDA_POLL_MAX_SECONDS; a change resets it.
+const AGENDA_POLL_SECONDS = 15;
+const AGENDA_POLL_MAX_SECONDS = 120;
+let agendaPollTimer = null;
+let agendaPollDelay = AGENDA_POLL_SECONDS;
+let agendaPollState = null;
+let agendaPollRange = null;
+
+function startAgendaPolling() {
+    if (agendaPollTimer) return;
+    scheduleAgendaPoll();
+}
+
+function scheduleAgendaPoll() {
+    agendaPollTimer = setTimeout(pollAgendaChanges, agendaPollDelay * 1000);
+}
+
+function pollAgendaChanges() {
+    if (document.hidden) {
+        scheduleAgendaPoll();
+        return;
+    }
+    const params = new URLSearchParams();
+    if (typeof calendar !== 'undefined' && calendar && calendar.view) {
+        const end = new Date(calendar.view.activeEnd.getTime() - 1);
+        params.append('start', calendar.view.activeStart.toLocaleDateString('sv-SE'));
+        params.append('end', end.toLocaleDateString('sv-SE'));
+    }
+    fetch(`/dashboard/api/agenda/changes/?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) return;
+            // A new calendar range changes the state without anything having changed
+            if (agendaPollRange === params.toString() && data.state !== agendaPollState) {
+                scheduleAgendaLiveRefresh();
+                agendaPollDelay = AGENDA_POLL_SECONDS;
+            } else {
+                agendaPollDelay = Math.min(agendaPollDelay * 2, AGENDA_POLL_MAX_SECONDS);
+            }
+            agendaPollRange = params.toString();
+            agendaPollState = data.state;
+        })
+        .catch(error => console.error('Error polling agenda changes:', error))
+        .finally(scheduleAgendaPoll);
+}
+
 // Prescription functionality
 let currentPrescriptionId = null;
 let prescriptionFormInitialized = false;
@@ -2800,8 +3022,33 @@ function exportReport() {
     // Show loading notification
     showNotification('Gerando PDF...', 'info');
     
-    // Generate PDF using the API
-    window.location.href = `/dashboard/api/reports/generate-pdf/?report_type=${reportType}&start_date=${startDate}&end_date=${endDate}`;
+    // The PDF is rendered by a background job: poll it, then download the stored file
+    const formData = new FormData();
+    formData.append('report_type', reportType);
+    formData.append('start_date', startDate);
+    formData.append('end_date', endDate);
+    
+    fetch('/dashboard/api/reports/pdf-jobs/', {
+        method: 'POST',
+        headers: {
+            'X-CSRFToken': getCookie('csrftoken')
+        },
+        body: formData
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            throw new Error(data.error || 'Erro desconhecido');
+        }
+        return waitForBackgroundJob(data.status_url).then(() => data.download_url);
+    })
+    .then(downloadUrl => {
+        window.location.href = downloadUrl;
+    })
+    .catch(error => {
+        console.error('Error generating PDF report:', error);
+        showNotification('Erro ao gerar PDF: ' + error.message, 'error');
+    });
 }
 
 // ============================================================================
@@ -4070,6 +4317,16 @@ function confirmBulkCancel() {
         body: formData
     })
     .then(response => response.json())
+    .then(data => {
+        if (data.success && data.background) {
+            // Large ranges are cancelled by a background job: poll until it finishes
+            showNotification(data.message, 'info');
+            return waitForBackgroundJob(data.status_url, (job) => {
+                confirmBtn.innerHTML = `<i class="fas fa-spinner fa-spin me-2"></i>Cancelando... ${job.percent}%`;
+            }).then(job => ({ success: true, message: job.result.message }));
+        }
+        return data;
+    })
     .then(data => {
         if (data.success) {
             showNotification(data.message, 'success');
@@ -4109,6 +4366,36 @@ function confirmBulkCancel() {
     });
 }
 
+/**
+ * Poll a background job status URL until the job completes or fails.
+ * Resolves with the finished job; rejects with its error message.
+ */
+function waitForBackgroundJob(statusUrl, onProgress, intervalMs = 1000) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(statusUrl)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        reject(new Error(data.error));
+                        return;
+                    }
+                    const job = data.job;
+                    if (job.status === 'completed') {
+                        resolve(job);
+                    } else if (job.status === 'failed') {
+                        reject(new Error(job.error || 'Erro desconhecido'));
+                    } else {
+                        if (onProgress) onProgress(job);
+                        setTimeout(poll, intervalMs);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
 // ============================================================================
 // BLOCK CALENDAR (BLOQUEAR AGENDA) FUNCTIONS
 // ============================================================================
@@ -4,6 +4,10 @@ let calendarInitialized = false;
 
 // Load settings early so colors are available
 function ensureSettingsLoaded() {
+    // The dashboard bootstrap request (extra.js) already brings the settings
+    if (window.dashboardBootstrapPromise) {
+        return;
+    }
     if (typeof appointmentSettings === 'undefined' || !appointmentSettings) {
         // Try to load settings if not already loaded
         if (typeof loadSettings === 'function') {
@@ -367,123 +371,126 @@ function initializeFullCalendar() {
             // Single-slot selections are handled by dateClick above
         },
         eventDrop: function(info) {
-            // Check for conflicts before allowing the drop
-            const newStart = info.event.start;
-            const newEnd = info.event.end;
-            const appointmentId = info.event.id;
-            
-            // Get all other events on the same day
-            const events = calendar.getEvents();
-            const conflictingEvents = events.filter(event => {
-                return event.id !== appointmentId && 
-                       event.start.toDateString() === newStart.toDateString() &&
-                       ((newStart < event.end && newEnd > event.start));
-            });
-            
-            if (conflictingEvents.length > 0) {
-                // Revert the event to its original position
-                info.revert();
-                return;
-            }
-            
-            // If no conflicts, proceed with the update
-            updateAppointmentTime(info.event);
+            // The server checks overlaps with appointments and calendar blocks
+            // (including ones outside the loaded range) and the event is
+            // reverted if the new slot is taken
+            updateAppointmentTime(info.event, info.revert);
         },
         eventResize: function(info) {
-            // Check for conflicts before allowing the resize
-            const newStart = info.event.start;
-            const newEnd = info.event.end;
-            const appointmentId = info.event.id;
-            
-            // Get all other events on the same day
-            const events = calendar.getEvents();
-            const conflictingEvents = events.filter(event => {
-                return event.id !== appointmentId && 
-                       event.start.toDateString() === newStart.toDateString() &&
-                       ((newStart < event.end && newEnd > event.start));
-            });
-            
-            if (conflictingEvents.length > 0) {
-                // Revert the event to its original size
-                info.revert();
-                return;
-            }
-            
-            // If no conflicts, proceed with the update
-            updateAppointmentDuration(info.event);
+            updateAppointmentDuration(info.event, info.revert);
         }
     });
 
     calendar.render();
 }
 
+// Per-range feed cache: raw appointments/blocks keyed by id, plus the cursor
+// and ETag of the last response, so refetches only download what changed.
+const calendarFeedCache = {};
+
 function loadAppointmentsForCalendar(start, end, successCallback, failureCallback) {
     // Get both start and end dates to support month view
     const startDate = start.toISOString().split('T')[0];
     const endDate = end.toISOString().split('T')[0];
+    const cacheKey = `${startDate}|${endDate}`;
+    const cached = calendarFeedCache[cacheKey];
     
     // Use start and end parameters to support both week and month views
-    fetch(`/dashboard/api/week-appointments/?start=${startDate}&end=${endDate}`)
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                const events = data.appointments.map(appointment => {
-                    // Create Date objects that represent the exact time shown in the left column
-                    // The time slots show local time, so we create dates in local time
-                    const startDate = createDateFromComponents(appointment.appointment_date, appointment.appointment_time);
-                    const endDate = addMinutesToDate(startDate, appointment.duration_minutes);
-                    
-                    return {
-                        id: appointment.id,
-                        title: appointment.patient_name,
-                        start: startDate, // Date object in local time - matches left column times
-                        end: endDate, // Date object in local time
-                        backgroundColor: getEventColor(appointment.status),
-                        borderColor: getEventColor(appointment.status),
-                        extendedProps: {
-                            patientId: appointment.patient_id,
-                            patientName: appointment.patient_name,
-                            doctorName: appointment.doctor_name,
-                            appointmentType: appointment.appointment_type,
-                            paymentType: appointment.payment_type,
-                            status: appointment.status,
-                            value: appointment.value,
-                            reason: appointment.reason,
-                            notes: appointment.notes,
-                            location: appointment.location,
-                            isFirstAppointment: !!appointment.is_first_appointment,
-                            isBlock: false
-                        }
-                    };
-                });
-                // Add calendar blocks (unavailable periods)
-                const blocks = data.blocks || [];
-                const blockColor = '#6c757d';
-                blocks.forEach(function(block) {
-                    events.push({
-                        id: block.id,
-                        title: block.reason ? 'Bloqueio: ' + block.reason : 'Bloqueio',
-                        start: block.start,
-                        end: block.end,
-                        backgroundColor: blockColor,
-                        borderColor: blockColor,
-                        editable: false,
-                        extendedProps: {
-                            isBlock: true,
-                            reason: block.reason || ''
-                        }
-                    });
-                });
-                successCallback(events);
-            } else {
+    let url = `/dashboard/api/week-appointments/?start=${startDate}&end=${endDate}`;
+    const headers = {};
+    if (cached) {
+        url += `&since=${encodeURIComponent(cached.cursor)}`;
+        headers['If-None-Match'] = cached.etag;
+    }
+    
+    fetch(url, { headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304 && cached) {
+                return null;
+            }
+            return response.json().then(data => ({ data: data, etag: response.headers.get('ETag') }));
+        })
+        .then(result => {
+            if (result === null) {
+                successCallback(buildCalendarEvents(cached));
+                return;
+            }
+            const data = result.data;
+            if (!data.success) {
                 failureCallback(data.error);
+                return;
+            }
+            const entry = (data.delta && cached) ? cached : { appointments: {}, blocks: {} };
+            if (data.delta && cached) {
+                (data.removed_ids || []).forEach(id => { delete entry.appointments[id]; });
+                // Blocks are deleted server-side; keep only the ids still present
+                const blockIds = new Set(data.block_ids || []);
+                Object.keys(entry.blocks).forEach(id => {
+                    if (!blockIds.has(id)) delete entry.blocks[id];
+                });
             }
+            data.appointments.forEach(appointment => { entry.appointments[appointment.id] = appointment; });
+            (data.blocks || []).forEach(block => { entry.blocks[block.id] = block; });
+            entry.cursor = data.cursor;
+            entry.etag = result.etag;
+            calendarFeedCache[cacheKey] = entry;
+            successCallback(buildCalendarEvents(entry));
         })
         .catch(error => {
             failureCallback(error);
         });
 }
 
+function buildCalendarEvents(entry) {
+    const events = Object.values(entry.appointments).map(appointment => {
+        // Create Date objects that represent the exact time shown in the left column
+        // The time slots show local time, so we create dates in local time
+        const startDate = createDateFromComponents(appointment.appointment_date, appointment.appointment_time);
+        const endDate = addMinutesToDate(startDate, appointment.duration_minutes);
+        
+        return {
+            id: appointment.id,
+            title: appointment.patient_name,
+            start: startDate, // Date object in local time - matches left column times
+            end: endDate, // Date object in local time
+            backgroundColor: getEventColor(appointment.status),
+            borderColor: getEventColor(appointment.status),
+            extendedProps: {
+                patientId: appointment.patient_id,
+                patientName: appointment.patient_name,
+                doctorName: appointment.doctor_name,
+                appointmentType: appointment.appointment_type,
+                paymentType: appointment.payment_type,
+                status: appointment.status,
+                value: appointment.value,
+                reason: appointment.reason,
+                notes: appointment.notes,
+                location: appointment.location,
+                isFirstAppointment: !!appointment.is_first_appointment,
+                isBlock: false
+            }
+        };
+    });
+    // Add calendar blocks (unavailable periods)
+    const blockColor = '#6c757d';
+    Object.values(entry.blocks).forEach(function(block) {
+        events.push({
+            id: block.id,
+            title: block.reason ? 'Bloqueio: ' + block.reason : 'Bloqueio',
+            start: block.start,
+            end: block.end,
+            backgroundColor: blockColor,
+            borderColor: blockColor,
+            editable: false,
+            extendedProps: {
+                isBlock: true,
+                reason: block.reason || ''
+            }
+        });
+    });
+    return events;
+}
+
 /**
  * Create a Date object from date and time components
  * This creates the date in the browser's local timezone
@@ -977,7 +984,8 @@ function showNewAppointmentModalForTime(start, end) {
     }
 }
 
-function updateAppointmentTime(event) {
+// revert is the eventDrop callback's info.revert (EventApi has no revert of its own)
+function updateAppointmentTime(event, revert) {
     const appointmentId = event.id;
     
     // Get the local date and time properly
@@ -1008,16 +1016,17 @@ function updateAppointmentTime(event) {
         } else {
             showNotification('Erro ao atualizar consulta: ' + data.error, 'error');
             // Revert the event position
-            event.revert();
+            revert();
         }
     })
     .catch(error => {
         showNotification('Erro ao atualizar consulta', 'error');
-        event.revert();
+        revert();
     });
 }
 
-function updateAppointmentDuration(event) {
+// revert is the eventResize callback's info.revert
+function updateAppointmentDuration(event, revert) {
     const appointmentId = event.id;
     const duration = Math.round((event.end - event.start) / (1000 * 60)); // in minutes
     
@@ -1041,12 +1050,12 @@ function updateAppointmentDuration(event) {
         } else {
             showNotification('Erro ao atualizar duração: ' + data.error, 'error');
             // Revert the event
-            event.revert();
+            revert();
         }
     })
     .catch(error => {
         showNotification('Erro ao atualizar duração', 'error');
-        event.revert();
+        revert();
     });
 }
 
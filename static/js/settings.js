@@ -2,49 +2,54 @@
 
 let appointmentSettings = null;
 
+// Store settings (from the settings endpoint or the dashboard bootstrap) and apply them
+function applyAppointmentSettings(settings) {
+    appointmentSettings = settings;
+    // Normalize old format to new format if needed
+    if (appointmentSettings.type_choices && appointmentSettings.type_choices.length > 0) {
+        if (Array.isArray(appointmentSettings.type_choices[0]) && appointmentSettings.type_choices[0].length >= 2) {
+            // Old format: convert to new format
+            appointmentSettings.type_choices = appointmentSettings.type_choices.map(c => c[1]);
+        }
+    }
+    if (appointmentSettings.status_choices && appointmentSettings.status_choices.length > 0) {
+        if (Array.isArray(appointmentSettings.status_choices[0]) && appointmentSettings.status_choices[0].length >= 2) {
+            // Old format: convert to new format
+            appointmentSettings.status_choices = appointmentSettings.status_choices.map(c => c[1]);
+        }
+    }
+    // Initialize status_colors if not present
+    if (!appointmentSettings.status_colors) {
+        appointmentSettings.status_colors = {};
+    }
+    // Initialize insurance_operators if not present
+    if (!appointmentSettings.insurance_operators) {
+        appointmentSettings.insurance_operators = [];
+    }
+    // Initialize cancellation_reasons if not present
+    if (!appointmentSettings.cancellation_reasons) {
+        appointmentSettings.cancellation_reasons = [];
+    }
+    // Initialize convenio_prices if not present (dict: operator name -> price string)
+    if (!appointmentSettings.convenio_prices || typeof appointmentSettings.convenio_prices !== 'object') {
+        appointmentSettings.convenio_prices = {};
+    }
+    renderSettings();
+    // Also update appointment modal with these settings
+    updateAppointmentModalWithSettings();
+    // Refresh calendar if it exists to apply new colors
+    if (typeof calendar !== 'undefined' && calendar) {
+        calendar.refetchEvents();
+    }
+}
+
 // Load settings when settings tab is shown
 function loadSettings() {
     fetch('/dashboard/api/appointment-settings/')
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                appointmentSettings = data.settings;
-                // Normalize old format to new format if needed
-                if (appointmentSettings.type_choices && appointmentSettings.type_choices.length > 0) {
-                    if (Array.isArray(appointmentSettings.type_choices[0]) && appointmentSettings.type_choices[0].length >= 2) {
-                        // Old format: convert to new format
-                        appointmentSettings.type_choices = appointmentSettings.type_choices.map(c => c[1]);
-                    }
-                }
-                if (appointmentSettings.status_choices && appointmentSettings.status_choices.length > 0) {
-                    if (Array.isArray(appointmentSettings.status_choices[0]) && appointmentSettings.status_choices[0].length >= 2) {
-                        // Old format: convert to new format
-                        appointmentSettings.status_choices = appointmentSettings.status_choices.map(c => c[1]);
-                    }
-                }
-                // Initialize status_colors if not present
-                if (!appointmentSettings.status_colors) {
-                    appointmentSettings.status_colors = {};
-                }
-                // Initialize insurance_operators if not present
-                if (!appointmentSettings.insurance_operators) {
-                    appointmentSettings.insurance_operators = [];
-                }
-                // Initialize cancellation_reasons if not present
-                if (!appointmentSettings.cancellation_reasons) {
-                    appointmentSettings.cancellation_reasons = [];
-                }
-                // Initialize convenio_prices if not present (dict: operator name -> price string)
-                if (!appointmentSettings.convenio_prices || typeof appointmentSettings.convenio_prices !== 'object') {
-                    appointmentSettings.convenio_prices = {};
-                }
-                renderSettings();
-                // Also update appointment modal with these settings
-                updateAppointmentModalWithSettings();
-                // Refresh calendar if it exists to apply new colors
-                if (typeof calendar !== 'undefined' && calendar) {
-                    calendar.refetchEvents();
-                }
+                applyAppointmentSettings(data.settings);
             } else {
                 showNotification('Erro ao carregar configurações: ' + data.error, 'error');
             }